@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+import argparse
+import csv
+import datetime
+import sys
+from array import array
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy
+
+from log_sink import field_kind
+
+# A pause of more than GAP_FACTOR sample intervals between readings (ACAL, a restart) splits the log in segments
+GAP_FACTOR = 3.0
+TIMESTAMP_COLUMN = 'datetime'
+
+
+def read_log_columns(path: str, columns: Sequence[str]) -> Dict[str, Tuple[numpy.ndarray, numpy.ndarray]]:
+    """
+    Reads the timestamps (in seconds since the first row) and values of columns of one of our CSV logs, one row at a time into compact arrays, so a log of millions of rows is not held as Python objects. Rows where a column is empty, like the temperature and ACAL rows, are left out of that column. Without a datetime column the row number is used as timestamp.
+    """
+    times = {column: array('d') for column in columns}
+    values = {column: array('d') for column in columns}
+    start_time = None
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        missing = [column for column in columns if column not in header]
+        if missing:
+            raise ValueError(f'{path} has no column {", ".join(missing)}, available: {", ".join(header)}')
+        time_index = header.index(TIMESTAMP_COLUMN) if TIMESTAMP_COLUMN in header else None
+        indices = [(column, header.index(column)) for column in columns]
+        for row_number, row in enumerate(reader):
+            if time_index is None:
+                timestamp = float(row_number)
+            else:
+                if time_index >= len(row) or not row[time_index]:
+                    continue
+                timestamp = datetime.datetime.fromisoformat(row[time_index]).timestamp()
+                if start_time is None:
+                    start_time = timestamp
+                timestamp -= start_time
+            for column, index in indices:
+                if index < len(row) and row[index]:
+                    try:
+                        value = float(row[index])
+                    except ValueError:
+                        continue
+                    times[column].append(timestamp)
+                    values[column].append(value)
+    return {column: (numpy.frombuffer(times[column]), numpy.frombuffer(values[column])) for column in columns}
+
+
+def numeric_columns(path: str) -> List[str]:
+    with open(path, newline='') as f:
+        header = next(csv.reader(f))
+    return [column for column in header if field_kind(column) == 'float']
+
+
+def sample_interval(times: numpy.ndarray) -> float:
+    intervals = numpy.diff(times)
+    intervals = intervals[intervals > 0]
+    return float(numpy.median(intervals)) if len(intervals) else 1.0
+
+
+def split_at_gaps(times: numpy.ndarray, values: numpy.ndarray, tau0: float, gap_factor: float = GAP_FACTOR) -> List[numpy.ndarray]:
+    """
+    Splits values where the time between two readings is more than gap_factor times the sample interval tau0. The deviations are computed per segment and combined, instead of treating readings on both sides of a gap as adjacent.
+    """
+    gaps = numpy.flatnonzero(numpy.diff(times) > gap_factor * tau0) + 1
+    return [segment for segment in numpy.split(values, gaps) if len(segment)]
+
+
+def octave_factors(count: int) -> List[int]:
+    """
+    The averaging factors 1, 2, 4, ... for which count readings give at least one ADEV term.
+    """
+    factors = []
+    factor = 1
+    while 2 * factor < count + 1:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+@dataclass
+class DeviationSums:
+    """
+    Sums of squares and number of terms of the overlapping Allan, modified Allan and Hadamard variance at one averaging factor, which can be added over segments.
+    """
+    factor: int
+    adev_sum: float = 0.0
+    adev_terms: int = 0
+    mdev_sum: float = 0.0
+    mdev_terms: int = 0
+    hdev_sum: float = 0.0
+    hdev_terms: int = 0
+
+    def add_segment(self, values: numpy.ndarray):
+        """
+        Adds the terms of a segment of readings, from the cumulative sum of the readings (the phase, for readings that are a frequency): every average over m readings is a difference of two cumulative sums, so all overlapping terms at one factor take a few vector operations instead of a loop over the readings.
+        """
+        m = self.factor
+        count = len(values)
+        if count < 2 * m:
+            return
+        # Removing the mean keeps the cumulative sum small, so the differences don't lose the digits of a 10 V reading
+        phase = numpy.concatenate(([0.0], numpy.cumsum(values - values.mean())))
+        second_differences = phase[2 * m:] - 2 * phase[m:-m] + phase[:-2 * m]
+        self.adev_sum += float(numpy.dot(second_differences, second_differences)) / (2 * m ** 2)
+        self.adev_terms += len(second_differences)
+        if count >= 3 * m - 1:
+            cumulative_differences = numpy.concatenate(([0.0], numpy.cumsum(second_differences)))
+            moving_sums = cumulative_differences[m:] - cumulative_differences[:-m]
+            self.mdev_sum += float(numpy.dot(moving_sums, moving_sums)) / (2 * m ** 4)
+            self.mdev_terms += len(moving_sums)
+        if count >= 3 * m:
+            third_differences = phase[3 * m:] - 3 * phase[2 * m:-m] + 3 * phase[m:-2 * m] - phase[:-3 * m]
+            self.hdev_sum += float(numpy.dot(third_differences, third_differences)) / (6 * m ** 2)
+            self.hdev_terms += len(third_differences)
+
+    @staticmethod
+    def deviation(total: float, terms: int) -> Optional[float]:
+        return (total / terms) ** 0.5 if terms else None
+
+    @property
+    def adev(self) -> Optional[float]:
+        return self.deviation(self.adev_sum, self.adev_terms)
+
+    @property
+    def mdev(self) -> Optional[float]:
+        return self.deviation(self.mdev_sum, self.mdev_terms)
+
+    @property
+    def hdev(self) -> Optional[float]:
+        return self.deviation(self.hdev_sum, self.hdev_terms)
+
+
+def allan_deviations(segments: Sequence[numpy.ndarray], factors: Optional[Sequence[int]] = None) -> List[DeviationSums]:
+    """
+    Overlapping ADEV, MDEV and HDEV of the readings at every octave averaging factor, over segments of contiguous readings (see split_at_gaps). Factors without any term are left out.
+    """
+    if factors is None:
+        factors = octave_factors(max((len(segment) for segment in segments), default=0))
+    results = []
+    for factor in factors:
+        sums = DeviationSums(factor)
+        for segment in segments:
+            sums.add_segment(segment)
+        if sums.adev_terms:
+            results.append(sums)
+    return results
+
+
+def analyse_column(times: numpy.ndarray, values: numpy.ndarray, tau0: Optional[float] = None, gap_factor: float = GAP_FACTOR) -> Tuple[float, List[DeviationSums]]:
+    tau0 = tau0 or sample_interval(times)
+    return tau0, allan_deviations(split_at_gaps(times, values, tau0, gap_factor))
+
+
+def format_deviation(value: Optional[float], scale: float) -> str:
+    return f'{value * scale:12.4e}' if value is not None else f'{"":12s}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Overlapping Allan, modified Allan and Hadamard deviation of the columns of a CSV log at octave averaging times')
+    parser.add_argument('log', help='CSV log, e.g. k182-dcv-mv-log-unattended.csv')
+    parser.add_argument('--column', action='append', help='Column to analyse, all measurement columns by default')
+    parser.add_argument('--tau0', type=float, help='Sample interval in seconds, the median interval between readings by default')
+    parser.add_argument('--gap-factor', type=float, default=GAP_FACTOR, help='Split the readings at pauses longer than this many sample intervals')
+    parser.add_argument('--relative', action='store_true', help='Report the deviations in ppm of the mean reading')
+    parser.add_argument('--output', help='CSV file to write the deviations to')
+    args = parser.parse_args()
+
+    columns = args.column or numeric_columns(args.log)
+    data = read_log_columns(args.log, columns)
+    output_rows = []
+    for column in columns:
+        times, values = data[column]
+        if len(values) < 2:
+            print(f'{column}: {len(values)} readings, skipped')
+            continue
+        tau0, results = analyse_column(times, values, args.tau0, args.gap_factor)
+        mean = float(values.mean())
+        scale = 1e6 / abs(mean) if args.relative and mean else 1.0
+        print(f'{column}: {len(values)} readings, tau0 {tau0:g} s, mean {mean:.9g}{", deviations in ppm" if scale != 1.0 else ""}')
+        print(f'{"tau (s)":>12s} {"terms":>10s} {"adev":>12s} {"mdev":>12s} {"hdev":>12s}')
+        for sums in results:
+            print(f'{sums.factor * tau0:12.6g} {sums.adev_terms:10d} ' + ' '.join(format_deviation(value, scale) for value in (sums.adev, sums.mdev, sums.hdev)))
+            output_rows.append({'column': column, 'tau': sums.factor * tau0, 'terms': sums.adev_terms,
+                                **{name: value * scale if value is not None else None
+                                   for name, value in (('adev', sums.adev), ('mdev', sums.mdev), ('hdev', sums.hdev))}})
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=('column', 'tau', 'terms', 'adev', 'mdev', 'hdev'))
+            writer.writeheader()
+            writer.writerows(output_rows)
+    return 0 if output_rows else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
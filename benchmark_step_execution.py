@@ -0,0 +1,312 @@
+#!/usr/bin/python3
+import argparse
+import contextlib
+import csv
+import datetime
+import functools
+import importlib.util
+import io
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ALL_COMPLETED, Executor, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List
+
+import ivi
+
+import common_step_execution
+import simulated_instruments
+from common_step_execution import (Dut, FourWireResistanceCommand, Instrument, Res4WDutSettings, SettleDetector, Step3, TransferDirection, generate_resistance_transfer_steps,
+                                   initiate_and_fetch, read_instruments_concurrently, run_procedure, settings_snapshot)
+from simulated_instruments import SimulationConfig
+
+OUTPUT_FILE = 'benchmark_step_execution.json'
+SAMPLES_PER_STEP = 16
+STEP_SOAK_TIME = 60
+INTEGRATION_TIME = 2.0
+GPIB_LATENCY = 0.005
+PHASES = ('set_instrument_and_dut_safe', 'setup_dut', 'setup_instrument', 'settle', 'sample')
+COMPARISON_FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'ag3458a_2_ohm', 'k2000_ohm', 'k2000_20_ohm', 'temp_2', 'last_acal_2',
+                         'last_acal_2_cal72', 'ag3458a_2_range', 'ag3458a_2_delay')
+
+
+class VirtualClock:
+    """
+    Stands in for the time module of the step engine and the scripts: sleeping advances the clock instead of blocking, so soak and integration times only count as bench time.
+
+    Every thread has its own time, so reads that run concurrently cost the bench time of the slowest one rather than their sum. A task submitted to an executor from executor() starts at the time of the thread that submitted it, and wait() advances the waiting thread to the time the last of the tasks finished.
+    """
+    def __init__(self):
+        self.local = threading.local()
+
+    @property
+    def now(self) -> float:
+        return getattr(self.local, 'now', 0.0)
+
+    @now.setter
+    def now(self, value: float):
+        self.local.now = value
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += max(0.0, seconds)
+
+    def executor(self, executor: Executor) -> 'VirtualTimeExecutor':
+        return VirtualTimeExecutor(self, executor)
+
+    def wait(self, futures, timeout=None, return_when=ALL_COMPLETED):
+        """
+        concurrent.futures.wait on the virtual clock.
+        """
+        result = wait(futures, timeout, return_when)
+        self.now = max([self.now] + [future.end_time for future in result.done if hasattr(future, 'end_time')])
+        return result
+
+
+class VirtualTimeExecutor:
+    """
+    Submits tasks to executor with a clock of their own, see VirtualClock.
+    """
+    def __init__(self, clock: VirtualClock, executor: Executor):
+        self.clock = clock
+        self.executor = executor
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        start_time = self.clock.now
+        future = Future()
+
+        def run():
+            self.clock.now = start_time
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.end_time = self.clock.now
+                future.set_exception(e)
+            else:
+                future.end_time = self.clock.now
+                future.set_result(result)
+        self.executor.submit(run)
+        return future
+
+
+def load_script(file_name: str):
+    spec = importlib.util.spec_from_file_location(os.path.splitext(file_name)[0].replace('-', '_'), os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name))
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+    return script
+
+
+def init_3458a(resource: str):
+    ag3458a = ivi.agilent.agilent3458A(resource, reset=True)
+    ag3458a.measurement_function = 'four_wire_resistance'
+    ag3458a.last_temp = datetime.datetime.utcnow()
+    ag3458a.last_acal = datetime.datetime.utcnow()
+    ag3458a.last_acal_temp = ag3458a.last_temp_value = ag3458a.utility.temp
+    ag3458a.last_acal_cal72 = ag3458a._ask('CAL? 72').strip()
+    return ag3458a
+
+
+def resistance_transfer_scenario():
+    """
+    SR104 to 1 kOhm and back via the F5450A on a 3458A, read with the row function of ks3458a-f5450a-sweep.py.
+    """
+    script = load_script('ks3458a-f5450a-sweep.py')
+    ag3458a = Instrument('ag3458a_2', FourWireResistanceCommand(10e3))
+    reference = Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))
+    transfer = Dut('Fluke 5450A', '', Res4WDutSettings())
+    target = Dut('HP 11103A', '1 kOhm', Res4WDutSettings(range=1e3, value=1e3))
+    procedure = (generate_resistance_transfer_steps(ag3458a, reference, transfer, target, TransferDirection.FORWARD)
+                 + generate_resistance_transfer_steps(ag3458a, reference, transfer, target, TransferDirection.REVERSE))
+    inits = {'ag3458a_2': init_3458a('TCPIP::gpib1::gpib,20::INSTR'), 'f5450a': ivi.fluke.fluke5450a('TCPIP::gpib4::gpib0,10::INSTR')}
+    return procedure, inits, script.read_row, script.FIELDNAMES, {}, [script]
+
+
+def w4920_ac_sweep_scenario():
+    """
+    The AC sweep of w4920-v2703-acv-sweep.py, including its settle detection.
+    """
+    script = load_script('w4920-v2703-acv-sweep.py')
+    inits = {'w4920': ivi.datron_wavetek.wavetek4920('TCPIP::gpib4::gpib0,4::INSTR', reset=True)}
+    settle_detector = SettleDetector(script.SETTLE_THRESHOLD_PPM, window=6, read_instrument=script.read_settle_value)
+    return script.procedure, inits, script.read_row, script.FIELDNAMES, {'settle_detector': settle_detector}, [script]
+
+
+def read_comparison_row(inits, instruments):
+    ag3458a_2 = inits['ag3458a_2']
+    row = {'datetime': datetime.datetime.utcnow().isoformat()}
+    readings = read_instruments_concurrently(inits, instruments, initiate_and_fetch)
+    row['ag3458a_2_ohm'] = readings.get('ag3458a_2')
+    row['k2000_ohm'] = readings.get('k2000')
+    row['k2000_20_ohm'] = readings.get('k2000_20')
+    row['last_acal_2'] = ag3458a_2.last_acal.isoformat()
+    row['last_acal_2_cal72'] = ag3458a_2.last_acal_cal72
+    ag3458a_2_settings = settings_snapshot(ag3458a_2)
+    row['ag3458a_2_range'] = ag3458a_2_settings['range']
+    row['ag3458a_2_delay'] = ag3458a_2_settings['trigger.delay']
+    print(f"ag3458a_2: {row['ag3458a_2_ohm']}, k2000: {row['k2000_ohm']}, k2000_20: {row['k2000_20_ohm']}")
+    return row, True
+
+
+def three_instrument_comparison_scenario():
+    """
+    10k resistors measured by a 3458A and two K2000s at the same time, like ks3458a-k2000-x2-f732a-x2-10k-resistors-comparison.py.
+    """
+    instruments = [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))]
+    procedure = [Step3(Dut(name, '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), instruments, True)
+                 for name in ('SR104', 'Guildline 9330 s/n 42709', 'SR104')]
+    inits = {'ag3458a_2': init_3458a('TCPIP::gpib1::gpib,20::INSTR'),
+             'k2000': ivi.keithley.keithley2000('TCPIP::gpib1::gpib,16::INSTR'),
+             'k2000_20': ivi.keithley.keithley2000('TCPIP::gpib1::gpib,17::INSTR')}
+    return procedure, inits, read_comparison_row, COMPARISON_FIELDNAMES, {}, []
+
+
+SCENARIOS: Dict[str, Callable] = {
+    'resistance_transfer': resistance_transfer_scenario,
+    'w4920_ac_sweep': w4920_ac_sweep_scenario,
+    'three_instrument_comparison': three_instrument_comparison_scenario,
+}
+
+
+class CountingWriter:
+    def __init__(self, fieldnames):
+        self.file = open(os.devnull, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+        self.rows = 0
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.rows += 1
+
+
+@contextlib.contextmanager
+def patched(target, name, value):
+    original = getattr(target, name)
+    setattr(target, name, value)
+    try:
+        yield
+    finally:
+        setattr(target, name, original)
+
+
+def timed(func, phase: str, timings: Dict[str, Dict[str, float]], clock: VirtualClock):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        wall_start, bench_start = time.perf_counter(), clock.now
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[phase]['wall_seconds'] += time.perf_counter() - wall_start
+            timings[phase]['bench_seconds'] += clock.now - bench_start
+    return wrapper
+
+
+@contextlib.contextmanager
+def benchmark_environment(clock: VirtualClock, scripts: List, timings):
+    """
+    Runs the step engine on the virtual clock without beeps or operator prompts, with the time of every phase of execute_step recorded in timings.
+    """
+    with contextlib.ExitStack() as stack:
+        for module in [common_step_execution] + [script for script in scripts if hasattr(script, 'time')]:
+            stack.enter_context(patched(module, 'time', clock))
+        executor = stack.enter_context(ThreadPoolExecutor(max_workers=common_step_execution.ACQUISITION_WORKERS))
+        stack.enter_context(patched(common_step_execution, 'get_acquisition_executor', lambda: clock.executor(executor)))
+        stack.enter_context(patched(common_step_execution, 'wait', clock.wait))
+        stack.enter_context(patched(common_step_execution, 'beep', lambda: None))
+        stack.enter_context(patched(common_step_execution, 'manual_prompt', lambda step: None))
+        for name in ('set_instrument_and_dut_safe', 'setup_dut', 'setup_instrument'):
+            stack.enter_context(patched(common_step_execution, name, timed(getattr(common_step_execution, name), name, timings, clock)))
+        stack.enter_context(patched(common_step_execution, 'wait_for_settle', timed(common_step_execution.wait_for_settle, 'settle', timings, clock)))
+        stack.enter_context(patched(SettleDetector, 'wait_for_settle', timed(SettleDetector.wait_for_settle, 'settle', timings, clock)))
+        for name in ('sample_input', 'sample_input_burst'):
+            stack.enter_context(patched(common_step_execution, name, timed(getattr(common_step_execution, name), 'sample', timings, clock)))
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        yield
+
+
+def run_scenario(name: str, samples_per_step: int, step_soak_time: float, trace_allocations=False) -> Dict:
+    clock = VirtualClock()
+    bench = simulated_instruments.install(SimulationConfig(integration_time=INTEGRATION_TIME, gpib_latency=GPIB_LATENCY, seed=1,
+                                                           clock=clock.monotonic, sleep=clock.sleep))
+    timings = defaultdict(lambda: {'wall_seconds': 0.0, 'bench_seconds': 0.0})
+    try:
+        procedure, inits, read_row, fieldnames, kwargs, scripts = SCENARIOS[name]()
+        csvw = CountingWriter(fieldnames)
+        transactions_before = bench.transactions
+        with benchmark_environment(clock, scripts, timings):
+            if trace_allocations:
+                tracemalloc.start()
+                blocks_before = sys.getallocatedblocks()
+            wall_start, bench_start = time.perf_counter(), clock.now
+            run_procedure(csvw, procedure, inits, read_row, samples_per_step, step_soak_time, **kwargs)
+            wall_seconds, bench_seconds = time.perf_counter() - wall_start, clock.now - bench_start
+            if trace_allocations:
+                retained_blocks = sys.getallocatedblocks() - blocks_before
+                retained_bytes, peak_bytes = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+        csvw.file.close()
+    finally:
+        simulated_instruments.uninstall()
+    rows = csvw.rows
+    if trace_allocations:
+        return {'retained_blocks_per_row': retained_blocks / rows, 'retained_bytes_per_row': retained_bytes / rows, 'peak_traced_bytes': peak_bytes}
+    return {
+        'steps': len(procedure),
+        'rows': rows,
+        'gpib_transactions_per_row': (bench.transactions - transactions_before) / rows,
+        'wall_seconds': wall_seconds,
+        'rows_per_second': rows / wall_seconds,
+        'python_overhead_per_sample_seconds': timings['sample']['wall_seconds'] / rows,
+        'bench_seconds': bench_seconds,
+        'bench_seconds_per_row': bench_seconds / rows,
+        'phases': {phase: timings[phase] for phase in PHASES},
+    }
+
+
+def run_benchmarks(scenarios, samples_per_step=SAMPLES_PER_STEP, step_soak_time=STEP_SOAK_TIME) -> Dict:
+    results = {}
+    for name in scenarios:
+        results[name] = run_scenario(name, samples_per_step, step_soak_time)
+        # Allocations are measured in a separate run, as tracing slows down the run being timed
+        results[name].update(run_scenario(name, samples_per_step, step_soak_time, trace_allocations=True))
+    return {
+        'datetime': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'samples_per_step': samples_per_step,
+        'step_soak_time': step_soak_time,
+        'integration_time': INTEGRATION_TIME,
+        'gpib_latency': GPIB_LATENCY,
+        'scenarios': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the step execution engine on simulated instruments and a virtual clock')
+    parser.add_argument('--output', default=OUTPUT_FILE, help='JSON file to write the results to')
+    parser.add_argument('--samples-per-step', type=int, default=SAMPLES_PER_STEP)
+    parser.add_argument('--step-soak-time', type=float, default=STEP_SOAK_TIME)
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='Scenario to run, all by default')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.scenario or SCENARIOS, args.samples_per_step, args.step_soak_time)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    for name, result in results['scenarios'].items():
+        phases = ', '.join(f"{phase} {result['phases'][phase]['wall_seconds']*1e3:.1f} ms" for phase in PHASES)
+        print(f"{name}: {result['rows']} rows, {result['rows_per_second']:.0f} rows/s, "
+              f"{result['python_overhead_per_sample_seconds']*1e6:.0f} us overhead/sample, "
+              f"{result['gpib_transactions_per_row']:.1f} GPIB transactions/row, {result['retained_bytes_per_row']:.0f} B retained/row ({phases})")
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
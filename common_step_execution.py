@@ -1,18 +1,89 @@
 #!/usr/bin/python3
+import asyncio
+import contextlib
+import functools
+import hashlib
+import itertools
+import json
 import logging
+import statistics
 import subprocess
-from dataclasses import dataclass
+import sys
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 from enum import Enum
 from math import log10, ceil
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Dict, Callable, Any, Sequence, Tuple, Deque
 
+import datetime
 import ivi
+import numpy
 import time
 import os
 from quantiphy import Quantity
 
 import vxi11
 
+import latency_stats
+import simulated_instruments
+import vxi11_link_pool
+from log_sink import field_kind, is_number
+
+FETCH_TIMEOUT = 360
+ACQUISITION_WORKERS = 16
+# Weight of the latest reading time in the expected reading time of an instrument used by read_instruments_by_bus, and
+# how long a fetch has to take to have waited for the reading instead of the reading waiting for the fetch
+READING_TIME_SMOOTHING = 0.3
+BLOCKED_FETCH_TIME = 0.02
+ACAL_MAX_AGE_SECONDS = 24 * 3600
+# Default ACAL threshold of the internal temperature, callers that follow the manual pass 1 °C
+ACAL_MAX_TEMP_CHANGE = 0.5
+# How long ACAL of each type takes, the driver returns as soon as the ACAL command is sent
+ACAL_SECONDS = {'dcv': 3 * 60, 'ohms': 12 * 60}
+# ACAL turns the display back on
+DISPLAY_OFF_COMMAND_3458A = 'DISP OFF,"                 "'
+BURST_FORMATS = {'SREAL': '>f4', 'DREAL': '>f8'}
+# Restores the reset state of the 3458A after a burst
+BURST_RESTORE_COMMANDS = 'NRDGS 1,AUTO;MEM OFF;MFORMAT SREAL;OFORMAT ASCII'
+# Added to the integration time of a burst for the transfer and the trigger latency
+BURST_TIMEOUT_MARGIN = 10
+# Status byte bit that is set while a reading is ready to be fetched, and the command that makes the instrument report it,
+# by lower case driver class name. The other drivers are waited for by their blocking fetch.
+READING_READY_STATUS = {'agilent3458a': (0x80, None),  # Data available
+                        'keithley182': (0x08, 'M8X')}  # Reading done, once enabled in the SRQ mask
+# Time a reading takes after initiate, by lower case driver class name, for meters that neither report a finished
+# reading in their status byte nor block their fetch until it is done. The W4920 returns its last reading at once.
+READING_TIME = {'wavetek4920': 4}
+# Commands that arm a meter to start its next reading on a GPIB Group Execute Trigger (GET), by lower case driver class
+# name. They are sent before every synchronised row, as a bus triggered reading disarms the K199, K182 and K2000.
+BUS_TRIGGER_COMMANDS = {'agilent3458a': 'TRIG HOLD;TARM SGL',  # A GET is a single trigger
+                        'keithley2000': ':INIT:CONT OFF;:TRIG:SOUR BUS;:INIT',
+                        'keithley199': 'T3X',  # One-shot on GET
+                        'keithley182': 'T3X'}
+# Return an armed meter to continuous triggering after the fetch: the reset state of the 3458A, immediate trigger source
+# with continuous initiation on the K2000, continuous on talk on the K199/K182
+BUS_TRIGGER_RESTORE_COMMANDS = {'agilent3458a': 'TRIG AUTO',
+                                'keithley2000': ':TRIG:SOUR IMM;:INIT:CONT ON',
+                                'keithley199': 'T0X',
+                                'keithley182': 'T0X'}
+STATUS_POLL_INTERVAL = 0.005
+STATUS_POLL_INTERVAL_MAX = 0.1
+VXI11_IO_TIMEOUT = 15
+# Command languages that accept several commands in one message, by lower case driver class name. The Wavetek, Datron,
+# Fluke and K182 command sets are not known to, so their settings are still written one by one.
+COMMAND_LANGUAGES = {'agilent3458a': 'hp-ml', 'keithley2000': 'scpi'}
+# Settings logged with every row, by lower case driver class name. They only change at step boundaries, so they are read
+# once per step into a snapshot instead of being queried for every sample.
+SNAPSHOT_SETTINGS = {'agilent3458a': ('range', 'trigger.delay'),
+                     'wavetek4950': ('measurement_function', 'range', 'measurement.percentage'),
+                     'wavetek4920': ('measurement_function', 'range')}
+
+simulated_instruments.install_if_requested()
+vxi11_link_pool.install_if_enabled()
+latency_stats.install_if_enabled()
+
 
 @dataclass
 class DutSettingCommand:
@@ -180,14 +251,29 @@ class TransferDirection(Enum):
     REVERSE = 'reverse'
 
 
-def run_procedure(csvw, procedure: List[Step3], inits, read_row, samples_per_step, step_soak_time):
-    previous_step = None
+def run_procedure(csvw, procedure: List[Step3], inits, read_row, samples_per_step, step_soak_time, settle_detector: Optional['SettleDetector'] = None, read_burst=None,
+                  journal: Optional['ProcedureJournal'] = None, resume=False, retry_policy: Optional['RetryPolicy'] = None,
+                  step_statistics: Optional['StepStatistics'] = None):
+    retry_policy = retry_policy or RetryPolicy()
+    latency_stats.instrument_sessions(inits)
+    start_step, first_sample = journal.start(procedure, samples_per_step, resume) if journal else (0, 1)
+    previous_step = procedure[start_step - 1] if start_step else None
     try:
-        for step_number, step in enumerate(procedure):
+        for step_number, step in enumerate(procedure[start_step:], start_step):
             print(f'Step {step_number+1}/{len(procedure)}')
-            execute_step(csvw, step_number, step, previous_step, inits, read_row, samples_per_step, step_soak_time)
+            execute_step(csvw, step_number, step, previous_step, inits, read_row, samples_per_step, step_soak_time, settle_detector, read_burst,
+                         first_sample if step_number == start_step else 1, journal, retry_policy, step_statistics)
+            if journal:
+                journal.record(step_number + 1, 0, csvw)
             previous_step = step
+        if journal:
+            journal.complete()
+    except StepInterrupted:
+        for session in inits.values():
+            invalidate_state_cache(session)
+        raise
     finally:
+        latency_stats.finish()
         beep()
 
 
@@ -307,7 +393,9 @@ def disable_manual_prompt_for_steps_with_same_dut(steps: List[Step3]) -> List[St
     return steps_with_manual_prompt_disabled
 
 
-def execute_step(csvw, step_number: int, step: Union[Step, Step2, Step3], previous_step: Union[Step, Step2, Step3], inits, read_row, samples_per_step, step_soak_time):
+def execute_step(csvw, step_number: int, step: Union[Step, Step2, Step3], previous_step: Union[Step, Step2, Step3], inits, read_row, samples_per_step, step_soak_time, settle_detector: Optional['SettleDetector'] = None, read_burst=None,
+                 first_sample=1, journal: Optional['ProcedureJournal'] = None, retry_policy: Optional['RetryPolicy'] = None,
+                 step_statistics: Optional['StepStatistics'] = None):
     if not isinstance(step, Step3):
         step = step.to_step3()
     if previous_step and not isinstance(previous_step, Step3):
@@ -316,31 +404,206 @@ def execute_step(csvw, step_number: int, step: Union[Step, Step2, Step3], previo
     if step.manual_prompt:
         manual_prompt(step)
     print(f'Executing step: {step}')
-    setup_dut(step, inits)
-    setup_instrument(step, previous_step, inits, step_soak_time)
-    wait_for_settle(step, step_soak_time, step.manual_prompt)
-    sample_input(step_number, step, inits, csvw, read_row, samples_per_step)
+    run_batched(setup_dut, inits, step, inits)
+    run_batched(setup_instrument, inits, step, previous_step, inits, step_soak_time)
+    snapshot_step_settings(inits)
+    if settle_detector:
+        settle_detector.wait_for_settle(step, inits, step_soak_time, step.manual_prompt)
+    else:
+        wait_for_settle(step, step_soak_time, step.manual_prompt)
+    schedule_acal(step, inits)
+    retry_policy = retry_policy or RetryPolicy()
+    retry_policy.start_step()
+    if step_statistics:
+        csvw = step_statistics.start_step(step_number, step, csvw)
+    try:
+        if read_burst:
+            sample_input_burst(step_number, step, inits, csvw, read_burst, samples_per_step, first_sample, journal, retry_policy)
+        else:
+            sample_input(step_number, step, inits, csvw, read_row, samples_per_step, first_sample, journal, retry_policy)
+    finally:
+        if step_statistics:
+            step_statistics.end_step()
+    retry_policy.log_step(step_number)
+
+
+def write_setting(session, name: str, value) -> bool:
+    """
+    Sets the driver setting name (dotted for nested settings, e.g. 'ac.frequency_min') to value, unless it was already set to value through write_setting since the state cache of the session was last invalidated. Returns whether it was written.
+
+    Re-sending an unchanged FUNC or RANGE makes the 3458A settle again, so step transitions should only send the settings that really change. Settings written in another way are not known to the cache and will be written once.
+    """
+    state_cache = getattr(session, 'state_cache', None)
+    if state_cache is None:
+        state_cache = session.state_cache = {}
+    if name in state_cache and state_cache[name] == value:
+        return False
+    *path, attribute = name.split('.')
+    setattr(functools.reduce(getattr, path, session), attribute, value)
+    state_cache[name] = value
+    session.settings_snapshot = None
+    return True
+
+
+def forget_settings(session, *names: str):
+    state_cache = getattr(session, 'state_cache', None)
+    for name in names:
+        if state_cache:
+            state_cache.pop(name, None)
+    session.settings_snapshot = None
+
+
+def invalidate_state_cache(session):
+    """
+    Forgets all settings written to session, e.g. after a reset or device clear, or after an interrupted step during which the operator may have changed the instrument.
+    """
+    if getattr(session, 'state_cache', None):
+        session.state_cache.clear()
+    session.settings_snapshot = None
+
+
+def take_settings_snapshot(session) -> Dict[str, Any]:
+    """
+    Reads the SNAPSHOT_SETTINGS of the driver of session (dotted for nested settings, e.g. 'trigger.delay') from the instrument, and keeps them on the session until a setting is written through write_setting or the state cache is invalidated.
+    """
+    names = SNAPSHOT_SETTINGS.get(type(session).__name__.lower(), ())
+    session.settings_snapshot = {name: functools.reduce(getattr, name.split('.'), session) for name in names}
+    return session.settings_snapshot
+
+
+def settings_snapshot(session) -> Dict[str, Any]:
+    """
+    The settings of session to log with a row: the snapshot of the current step, taken now if there is none yet.
+    """
+    snapshot = getattr(session, 'settings_snapshot', None)
+    if snapshot is None:
+        snapshot = take_settings_snapshot(session)
+    return snapshot
+
+
+def snapshot_step_settings(inits):
+    # Also the sessions that are not set up by the step, as read_row may log them. A session running a background ACAL
+    # is left without a snapshot, so it is taken on its first row instead of waiting here.
+    for session in {id(session): session for session in inits.values()}.values():
+        if type(session).__name__.lower() not in SNAPSHOT_SETTINGS:
+            continue
+        if instrument_busy(session):
+            session.settings_snapshot = None
+        else:
+            take_settings_snapshot(session)
+
+
+def join_commands(commands: List[str], language: str) -> str:
+    if language == 'scpi':
+        # A leading colon resets the command tree, so every command is interpreted as if it was sent on its own
+        commands = [command if command.startswith((':', '*')) else f':{command}' for command in commands]
+    return ';'.join(commands)
+
+
+class CommandBatch:
+    """
+    Collects the commands written by the driver of a session, and sends them as one message when the batch is flushed.
+
+    Queries and raw I/O flush all batches of the group first, so the instrument sees commands and queries in the order the driver issued them.
+    """
+    IO_METHODS = ('_ask', '_read', '_read_raw', '_write_raw', '_ask_raw', '_read_stb')
+
+    def __init__(self, session, language: str, group: List['CommandBatch']):
+        self.session = session
+        self.language = language
+        self.group = group
+        self.commands: List[str] = []
+        self.saved_methods = {}
+
+    def start(self):
+        for name in ('_write',) + self.IO_METHODS:
+            if hasattr(self.session, name):
+                self.saved_methods[name] = self.session.__dict__.get(name)
+        self.write_command = self.session._write
+        self.session._write = self.write
+        for name in self.IO_METHODS:
+            if name in self.saved_methods:
+                setattr(self.session, name, self.flushing(getattr(self.session, name)))
+
+    def stop(self):
+        for name, method in self.saved_methods.items():
+            if method is None:
+                del self.session.__dict__[name]
+            else:
+                setattr(self.session, name, method)
+
+    def write(self, data, encoding='utf-8'):
+        if not self.commands:
+            self.group.append(self)
+        self.commands.extend(command.strip() for command in (data if isinstance(data, (list, tuple)) else [data]))
+
+    def flushing(self, method):
+        @functools.wraps(method)
+        def flush_and_call(*args, **kwargs):
+            flush_command_batches(self.group)
+            return method(*args, **kwargs)
+        return flush_and_call
+
+    def flush(self):
+        commands, self.commands = self.commands, []
+        try:
+            self.write_command(join_commands(commands, self.language))
+        except BaseException:
+            # It is unknown which settings arrived, so they have to be written again next time
+            invalidate_state_cache(self.session)
+            raise
+
+
+def flush_command_batches(group: List[CommandBatch]):
+    while group:
+        group.pop(0).flush()
+
+
+@contextlib.contextmanager
+def command_batches(sessions):
+    """
+    Sends the setting changes made in the block as one message per instrument instead of a VXI-11 round trip per setting, for the instruments whose language allows it (see COMMAND_LANGUAGES). Instruments are written in the order of their first change, so a source is still set up before a meter if it was changed first.
+    """
+    group: List[CommandBatch] = []
+    batches = []
+    for session in {id(session): session for session in sessions}.values():
+        language = COMMAND_LANGUAGES.get(type(session).__name__.lower())
+        if language and not instrument_busy(session):
+            batch = CommandBatch(session, language, group)
+            batch.start()
+            batches.append(batch)
+    try:
+        yield
+    finally:
+        for batch in batches:
+            batch.stop()
+        flush_command_batches(group)
+
+
+def run_batched(func, inits, *args):
+    with command_batches(inits.values()):
+        return func(*args)
 
 
 def setup_dut(step: Step3, inits):
     dut = get_dut(step, inits)
     if isinstance(dut, ivi.fluke.fluke5450a):
         f5450a = dut
-        f5450a.output_function = step.dut.dut_setting_cmd.function
-        f5450a.output.value = step.dut.dut_setting_cmd.value
-        f5450a.output.enabled = 'on'
+        write_setting(f5450a, 'output_function', step.dut.dut_setting_cmd.function)
+        write_setting(f5450a, 'output.value', step.dut.dut_setting_cmd.value)
+        write_setting(f5450a, 'output.enabled', 'on')
     elif isinstance(dut, ivi.datron_wavetek.datron4700):
         d4700 = dut
-        d4700.output_function = step.dut.dut_setting_cmd.function
-        d4700.range = step.dut.dut_setting_cmd.range
+        write_setting(d4700, 'output_function', step.dut.dut_setting_cmd.function)
+        write_setting(d4700, 'range', step.dut.dut_setting_cmd.range)
         if step.dut.dut_setting_cmd.function in ('two_wire_resistance', 'four_wire_resistance'):
             if step.dut.dut_setting_cmd.value == 0:
-                d4700.output.full_range_or_zero = 'zero'
+                write_setting(d4700, 'output.full_range_or_zero', 'zero')
             else:
-                d4700.output.full_range_or_zero = '+full_range'
+                write_setting(d4700, 'output.full_range_or_zero', '+full_range')
         else:
-            d4700.output.value = step.dut.dut_setting_cmd.value
-        d4700.output.enabled = 'on'
+            write_setting(d4700, 'output.value', step.dut.dut_setting_cmd.value)
+        write_setting(d4700, 'output.enabled', 'on')
 
 
 def setup_instrument(step: Step3, previous_step: Step3, inits, step_soak_time: float):
@@ -350,8 +613,8 @@ def setup_instrument(step: Step3, previous_step: Step3, inits, step_soak_time: f
         if instrument.name.startswith('ag3458a_'):
             ag3458a: ivi.agilent.agilent3458A = inits[instrument.name]
             measurement_function = instrument.setting.measurement_function
-            ag3458a.measurement_function = 'ac_volts_sync' if measurement_function == 'ac_volts' else measurement_function
-            ag3458a.range = instrument.setting.range
+            write_setting(ag3458a, 'measurement_function', 'ac_volts_sync' if measurement_function == 'ac_volts' else measurement_function)
+            write_setting(ag3458a, 'range', instrument.setting.range)
         elif instrument.name == 'w4950':
             w4950: ivi.datron_wavetek.wavetek4950 = inits['w4950']
             percentage = int(abs(step.dut.dut_setting_cmd.value) / step.dut.dut_setting_cmd.range * 100)
@@ -361,12 +624,13 @@ def setup_instrument(step: Step3, previous_step: Step3, inits, step_soak_time: f
                 w4950._measurement_percentage = percentage
                 w4950._range = instrument.setting.range
                 w4950._ac_frequency_min = instrument.setting.freq
+                forget_settings(w4950, 'measurement_function', 'measurement.percentage', 'range', 'ac.frequency_min')
                 return
-            w4950.measurement_function = instrument.setting.measurement_function
+            write_setting(w4950, 'measurement_function', instrument.setting.measurement_function)
             if getattr(instrument.setting, 'freq', None):
-                w4950.ac.frequency_min = instrument.setting.freq
-            w4950.measurement.percentage = percentage
-            w4950.range = instrument.setting.range
+                write_setting(w4950, 'ac.frequency_min', instrument.setting.freq)
+            write_setting(w4950, 'measurement.percentage', percentage)
+            write_setting(w4950, 'range', instrument.setting.range)
         elif instrument.name == 'w4920':
             w4920: ivi.datron_wavetek.wavetek4920 = inits['w4920']
             if previous_step:
@@ -386,10 +650,10 @@ def setup_instrument(step: Step3, previous_step: Step3, inits, step_soak_time: f
                 w4920.measurement.measure_gain()
             measurement_function = 'ac_millivolts' if instrument.setting.measurement_function == 'ac_volts' and instrument.setting.range <= 0.105 \
                 else instrument.setting.measurement_function
-            w4920.measurement_function = measurement_function
-            w4920.range = instrument.setting.range
+            write_setting(w4920, 'measurement_function', measurement_function)
+            write_setting(w4920, 'range', instrument.setting.range)
             low_frequency_limit = max(1, step.dut.dut_setting_cmd.freq / 2)
-            w4920.ac.frequency_min = low_frequency_limit
+            write_setting(w4920, 'ac.frequency_min', low_frequency_limit)
 
 
 def set_instrument_and_dut_safe(step: Step3, previous_step: Step3, inits):
@@ -401,8 +665,8 @@ def set_instrument_and_dut_safe(step: Step3, previous_step: Step3, inits):
     if previous_step is None:
         if instrument_name == 'w4950' and instrument_setting.measurement_function in ('ac_volts', 'ac_current'):
             return
-        instrument.measurement_function = instrument_setting.measurement_function
-        instrument.range = instrument_setting.range
+        write_setting(instrument, 'measurement_function', instrument_setting.measurement_function)
+        write_setting(instrument, 'range', instrument_setting.range)
         return
     old_function = previous_step.dut.dut_setting_cmd.function
     old_range = previous_instrument_setting.range
@@ -416,7 +680,7 @@ def set_instrument_and_dut_safe(step: Step3, previous_step: Step3, inits):
     if not safe_transition or is_unsafe_manual_transition:
         for dut in {old_dut, new_dut}:
             if hasattr(dut, 'output'):
-                dut.output.enabled = False
+                write_setting(dut, 'output.enabled', False)
     if instrument_name == 'w4920':
         transition_function = 'ac_millivolts' if transition_function == 'ac_volts' and transition_range <= 0.105 \
             else transition_function
@@ -424,9 +688,10 @@ def set_instrument_and_dut_safe(step: Step3, previous_step: Step3, inits):
         # ACV and ACI commands are not working on my 4950, ACV does nothing and ACI gives system error
         instrument._measurement_function = instrument_setting.measurement_function
         instrument._range = instrument_setting.range
+        forget_settings(instrument, 'measurement_function', 'range')
     else:
-        instrument.measurement_function = transition_function
-        instrument.range = transition_range
+        write_setting(instrument, 'measurement_function', transition_function)
+        write_setting(instrument, 'range', transition_range)
 
 
 def manual_prompt(step: Step3):
@@ -490,45 +755,867 @@ def wait_for_settle(step: Step3, step_soak_time, manual_prompt=False):
     time.sleep(step_soak_time)
 
 
-def sample_input(step_number: int, step: Step3, inits, csvw, read_row, samples_per_step):
+
+def sample_numbers(step: Step3, samples_per_step, first_sample=1):
     if step.run_until_interrupted:
-        sample_no = 1
+        return itertools.count(first_sample)
+    return range(first_sample, samples_per_step+1)
+
+
+def sample_input(step_number: int, step: Step3, inits, csvw, read_row, samples_per_step, first_sample=1, journal: Optional['ProcedureJournal'] = None,
+                 retry_policy: Optional['RetryPolicy'] = None):
+    retry_policy = retry_policy or RetryPolicy()
+    try:
+        for sample_no in sample_numbers(step, samples_per_step, first_sample):
+            take_single_sample(step, inits, csvw, read_row, sample_no, retry_policy)
+            if journal:
+                journal.record(step_number, sample_no, csvw)
+    except KeyboardInterrupt:
+        raise StepInterrupted(step_number)
+
+
+def sample_input_burst(step_number: int, step: Step3, inits, csvw, read_burst, samples_per_step, first_sample=1, journal: Optional['ProcedureJournal'] = None,
+                       retry_policy: Optional['RetryPolicy'] = None):
+    """
+    Takes the samples of a step as bursts: read_burst(inits, instruments, count) takes count readings in one go and returns a list of (row, has_measurement), like read_row does for a single sample.
+    """
+    retry_policy = retry_policy or RetryPolicy()
+    samples_taken = first_sample - 1
+    try:
+        while step.run_until_interrupted or samples_taken < samples_per_step:
+            count = samples_per_step - samples_taken % samples_per_step
+            take_single_burst(step, inits, csvw, read_burst, count, retry_policy)
+            samples_taken += count
+            if journal:
+                journal.record(step_number, samples_taken, csvw)
+    except KeyboardInterrupt:
+        raise StepInterrupted(step_number)
+
+
+def take_single_burst(step: Step3, inits, csvw, read_burst, samples_per_step, retry_policy: Optional['RetryPolicy'] = None):
+    retry_policy = retry_policy or RetryPolicy()
+    while True:
         try:
-            while True:
-                take_single_sample(step, inits, csvw, read_row, sample_no)
-                sample_no += 1
-        except KeyboardInterrupt:
-            raise StepInterrupted(step_number)
-    else:
-        for sample_no in range(1, samples_per_step+1):
-            try:
-                take_single_sample(step, inits, csvw, read_row, sample_no)
-            except KeyboardInterrupt:
-                raise StepInterrupted(step_number)
+            rows = read_burst(inits, step.instruments, samples_per_step)
+        except RETRIED_ERRORS as e:
+            if not retry_policy.retry(e, step_sessions(step, inits)):
+                raise
+        else:
+            retry_policy.succeeded()
+            for row, has_measurement in rows:
+                if has_measurement:
+                    row['dut'] = step.dut.name
+                    row['dut_setting'] = step.dut.setting
+                csvw.writerow(row)
+            latency_stats.write_if_due()
+            return
 
 
-def take_single_sample(step: Step3, inits, csvw, read_row, sample_no):
+def read_burst_3458a(ag3458a, count: int, real_format: str = 'DREAL', reading_time: Optional[float] = None) -> numpy.ndarray:
+    """
+    Takes count readings on a single trigger into the 3458A reading memory and transfers them back as one binary block, instead of an initiate/fetch round trip and an ASCII parse per reading.
+
+    DREAL keeps the full resolution of the 3458A, SREAL halves the transfer but is limited to about 7 digits. The readings are taken back to back after the trigger, but the 3458A does not report when, so the caller should log the time of the burst and the index of the reading rather than a time per reading. With reading_time, the time of one reading in seconds (twice the aperture with offset compensation), the interface timeout is raised for the transfer to cover all count readings.
+    """
+    dtype = numpy.dtype(BURST_FORMATS[real_format])
+    timeout = ag3458a._interface.timeout
+    if reading_time is not None:
+        ag3458a._interface.timeout = max(timeout, count * reading_time + BURST_TIMEOUT_MARGIN)
+    ag3458a._write(f'MEM FIFO;MFORMAT {real_format};OFORMAT {real_format};NRDGS {count},AUTO;TARM SGL')
+    try:
+        data = ag3458a._read_raw(count * dtype.itemsize)
+    finally:
+        ag3458a._interface.timeout = timeout
+        ag3458a._write(BURST_RESTORE_COMMANDS)
+    if len(data) != count * dtype.itemsize:
+        raise IOError(f'Received {len(data)} bytes from {ag3458a}, expected {count} {real_format} readings')
+    return numpy.frombuffer(data, dtype=dtype).astype(float)
+
+
+def take_single_sample(step: Step3, inits, csvw, read_row, sample_no, retry_policy: Optional['RetryPolicy'] = None):
+    retry_policy = retry_policy or RetryPolicy()
     while True:
         print(f"{sample_no:2d}: ", end="")
         try:
             row, has_measurement = read_row(inits, step.instruments)
-        except vxi11.vxi11.Vxi11Exception as e:
-            beep()
-            logging.error(exc_info=e)
+        except RETRIED_ERRORS as e:
+            if not retry_policy.retry(e, step_sessions(step, inits)):
+                raise
             has_measurement = False
         else:
+            retry_policy.succeeded()
             if has_measurement:
                 row['dut'] = step.dut.name
                 row['dut_setting'] = step.dut.setting
             csvw.writerow(row)
+            latency_stats.write_if_due()
         if has_measurement:
             break
 
 
+_acquisition_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_acquisition_executor() -> ThreadPoolExecutor:
+    global _acquisition_executor
+    if _acquisition_executor is None:
+        _acquisition_executor = ThreadPoolExecutor(max_workers=ACQUISITION_WORKERS, thread_name_prefix='acquisition')
+    return _acquisition_executor
+
+
+def wait_for_reading(session, timeout: float = FETCH_TIMEOUT, started: Optional[float] = None) -> bool:
+    """
+    Waits until the meter of session has a reading ready to be fetched, by serial polling its status byte (see READING_READY_STATUS). Meters without a ready bit in READING_TIME are given their reading time, counted from started (time.monotonic() at initiate) if it is known. Returns False without waiting for other drivers, their fetch still blocks until the reading is done.
+
+    A fetch that blocks keeps the VXI-11 link, and with the link pool the gateway channel shared with the other instruments, busy for the whole integration time. A serial poll is a short transaction, so the bus is free for other instruments between polls. The poll interval starts at STATUS_POLL_INTERVAL and doubles up to STATUS_POLL_INTERVAL_MAX, so short readings are picked up quickly without polling long ones all the time.
+    """
+    status = READING_READY_STATUS.get(type(session).__name__.lower())
+    if status is None:
+        reading_time = READING_TIME.get(type(session).__name__.lower())
+        if reading_time is None:
+            return False
+        remaining = reading_time - (time.monotonic() - started if started is not None else 0)
+        if remaining > 0:
+            time.sleep(remaining)
+        return True
+    ready_bit, enable_command = status
+    if enable_command and not getattr(session, 'reading_ready_enabled', False):
+        session._write(enable_command)
+        session.reading_ready_enabled = True
+    deadline = time.monotonic() + timeout
+    interval = STATUS_POLL_INTERVAL
+    while not session._read_stb() & ready_bit:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            # Reported like a fetch that timed out on the link
+            raise vxi11.vxi11.Vxi11Exception(15, 'wait_for_reading')
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, STATUS_POLL_INTERVAL_MAX)
+    return True
+
+
+def initiate_and_fetch(session, instrument: Instrument):
+    session.measurement.initiate()
+    wait_for_reading(session)
+    return session.measurement.fetch(FETCH_TIMEOUT)
+
+
+def read_instruments_concurrently(inits, instruments: List[Instrument],
+                                  read_instrument: Callable[[Any, Instrument], Any] = initiate_and_fetch) -> Dict[str, Any]:
+    """
+    Reads all instruments of a step at the same time, each on its own worker thread, and returns the readings by instrument name once every instrument has answered.
+
+    Every instrument has its own VXI-11 connection, so the integration time of one meter overlaps with the others and a row takes about as long as the slowest meter instead of the sum of all of them. With the link pool (VXI11_LINK_POOL=1) the instruments on a gateway share one connection, on which a blocking fetch holds the connection until its reading arrives; read_instrument should then poll for the reading first, as initiate_and_fetch does with wait_for_reading. If any instrument raises, the first exception (in instrument order) is re-raised after all reads have finished, so no link is left halfway through a transaction. Instruments that are busy with a background operation (see run_in_background) are not read and get None.
+    """
+    executor = get_acquisition_executor()
+    readings = {instrument.name: None for instrument in instruments if instrument_busy(inits[instrument.name])}
+    futures = {instrument.name: executor.submit(read_instrument, inits[instrument.name], instrument)
+               for instrument in instruments if instrument.name not in readings}
+    wait(futures.values())
+    readings.update({name: future.result() for name, future in futures.items()})
+    return readings
+
+
+def gpib_bus(session) -> Optional[str]:
+    """
+    The bus an instrument is on, e.g. 'gpib1/gpib' for TCPIP::gpib1::gpib,25::INSTR: the gateway host and its GPIB interface. A LAN instrument is a bus of its own. None if the interface has no VXI-11 address.
+    """
+    interface = getattr(session, '_interface', None)
+    host, name = getattr(interface, 'host', None), getattr(interface, 'name', None)
+    if host is None and isinstance(name, str):
+        parsed = vxi11.vxi11.parse_visa_resource_string(name)
+        if parsed:
+            host, name = parsed['arg1'], parsed['arg2']
+    if host is None:
+        return None
+    return f"{host}/{(name or 'inst0').split(',')[0]}"
+
+
+def gpib_address(interface) -> Optional[Tuple[int, ...]]:
+    """
+    The primary and secondary GPIB address of a VXI-11 link, e.g. (25,) for gpib,25. None if it is not on a GPIB bus.
+    """
+    address = getattr(interface, 'name', '').split(',')[1:]
+    if not address or not all(part.isdigit() for part in address):
+        return None
+    return tuple(int(part) for part in address)
+
+
+_bus_interface_devices: Dict[Tuple[str, str], vxi11.vxi11.InterfaceDevice] = {}
+
+
+def bus_interface_device(host: str, name: str) -> vxi11.vxi11.InterfaceDevice:
+    key = (host, name)
+    if key not in _bus_interface_devices:
+        _bus_interface_devices[key] = vxi11_link_pool.interface_device(host, name)
+    return _bus_interface_devices[key]
+
+
+def group_execute_trigger(sessions: List[Any]):
+    """
+    Triggers instruments on the same GPIB bus at once: the interface device of the gateway addresses them all to listen and sends a single Group Execute Trigger. Instruments that are not VXI-11 GPIB links, like the simulated instruments, are triggered one after the other by the driver instead.
+    """
+    interfaces = [session._interface for session in sessions]
+    addresses = [gpib_address(interface) for interface in interfaces]
+    if not all(isinstance(interface, vxi11.Instrument) for interface in interfaces) or None in addresses:
+        for session in sessions:
+            session._trigger()
+        return
+    interface_device = bus_interface_device(interfaces[0].host, interfaces[0].name.split(',')[0])
+    # The setup addresses the gateway as talker, its bus address is only known once the link is open (send_setup has the same problem)
+    interface_device.open()
+    interface_device.send_command(interface_device.create_setup(addresses) + bytes([vxi11.vxi11.GPIB_CMD_GET]))
+
+
+def trigger_bus(inits, names: List[str], fetch_only: Sequence[str]) -> Tuple[Dict[str, float], Dict[str, BaseException]]:
+    triggered, errors = {}, {}
+    for name in names:
+        inits[name].last_trigger = None
+        try:
+            if name not in fetch_only:
+                inits[name].measurement.initiate()
+        except Exception as e:
+            errors[name] = e
+        else:
+            triggered[name] = time.monotonic()
+            if name not in fetch_only:
+                inits[name].last_trigger = datetime.datetime.utcnow()
+    return triggered, errors
+
+
+def trigger_bus_synchronised(inits, names: List[str], fetch_only: Sequence[str]) -> Tuple[Dict[str, float], Dict[str, BaseException]]:
+    """
+    Arms the meters on a bus for a bus trigger (see BUS_TRIGGER_COMMANDS) and starts all their readings with one GET (see group_execute_trigger). Meters that cannot be armed are initiated just before the GET. Meters in fetch_only are not armed, so a meter that triggers continuously keeps doing so. The armed meters are returned to their own trigger source by restore_bus_trigger.
+    """
+    armed, errors = [], {}
+    for name in names:
+        session = inits[name]
+        session.last_trigger = None
+        command = BUS_TRIGGER_COMMANDS.get(type(session).__name__.lower())
+        if command is not None and name not in fetch_only:
+            try:
+                session._write(command)
+            except Exception as e:
+                errors[name] = e
+            else:
+                armed.append(name)
+    triggered, initiate_errors = trigger_bus(inits, [name for name in names if name not in armed and name not in errors], fetch_only)
+    errors.update(initiate_errors)
+    if armed:
+        try:
+            group_execute_trigger([inits[name] for name in armed])
+        except Exception as e:
+            errors.update(dict.fromkeys(armed, e))
+        else:
+            trigger_time, last_trigger = time.monotonic(), datetime.datetime.utcnow()
+            for name in armed:
+                triggered[name] = trigger_time
+                inits[name].last_trigger = last_trigger
+    return triggered, errors
+
+
+def restore_bus_trigger(inits, names: List[str], fetch_only: Sequence[str], errors: Dict[str, BaseException]):
+    """
+    Returns the meters armed by trigger_bus_synchronised to their own trigger source (see BUS_TRIGGER_RESTORE_COMMANDS), so they are not left waiting for a GET when they are read some other way or the script stops.
+    """
+    for name in names:
+        command = BUS_TRIGGER_RESTORE_COMMANDS.get(type(inits[name]).__name__.lower())
+        if command is None or name in fetch_only:
+            continue
+        try:
+            inits[name]._write(command)
+        except Exception as e:
+            errors.setdefault(name, e)
+
+
+def drain_bus(inits, names: List[str], fetch_only: Sequence[str], synchronised_trigger: bool = False) -> Tuple[Dict[str, Any], Dict[str, BaseException]]:
+    triggered, errors = (trigger_bus_synchronised if synchronised_trigger else trigger_bus)(inits, names, fetch_only)
+    try:
+        readings = fetch_bus(inits, triggered, errors)
+    finally:
+        if synchronised_trigger:
+            restore_bus_trigger(inits, names, fetch_only, errors)
+    return readings, errors
+
+
+def fetch_bus(inits, triggered: Dict[str, float], errors: Dict[str, BaseException]) -> Dict[str, Any]:
+    readings = {}
+    for name in sorted(triggered, key=lambda name: triggered[name] + getattr(inits[name], 'expected_reading_time', 0.0)):
+        session = inits[name]
+        expected_reading_time = getattr(session, 'expected_reading_time', None)
+        if expected_reading_time is not None:
+            remaining = triggered[name] + expected_reading_time - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+        fetch_start = time.monotonic()
+        try:
+            wait_for_reading(session, started=triggered[name])
+            readings[name] = session.measurement.fetch(FETCH_TIMEOUT)
+        except Exception as e:
+            errors[name] = e
+            continue
+        fetch_end = time.monotonic()
+        if fetch_end - fetch_start >= BLOCKED_FETCH_TIME:
+            # The fetch waited for the reading, so it took about this long
+            reading_time = fetch_end - triggered[name]
+            session.expected_reading_time = reading_time if expected_reading_time is None \
+                else expected_reading_time + READING_TIME_SMOOTHING * (reading_time - expected_reading_time)
+        else:
+            # The reading was already waiting, so it may be fetched earlier next time
+            reading_time = fetch_start - triggered[name]
+            session.expected_reading_time = (1 - READING_TIME_SMOOTHING) * min(reading_time, expected_reading_time if expected_reading_time is not None else reading_time)
+    return readings
+
+
+def read_instruments_by_bus(inits, instruments: Sequence[Union[Instrument, str]], fetch_only: Sequence[str] = (),
+                            synchronised_trigger: bool = False) -> Dict[str, Any]:
+    """
+    Reads instruments that share a GPIB bus (see gpib_bus) without keeping the bus busy while they integrate: all instruments on a bus are triggered first, then their readings are fetched in order of expected completion, so a row takes about as long as the slowest meter. Instruments in fetch_only are not triggered, e.g. a K2000 that triggers continuously.
+
+    The expected reading time of an instrument is learned from the previous rows and kept on the session as expected_reading_time: a fetch that waited for its reading gives the reading time, a reading that was already waiting lowers the expectation so it is fetched earlier next time. Until a reading is expected the bus is left alone, after that the meter is serial polled (see wait_for_reading) or its fetch blocks. Different buses are read at the same time. Errors and busy instruments are handled like in read_instruments_concurrently.
+
+    With synchronised_trigger the meters on a bus are armed and triggered by a single GET (see trigger_bus_synchronised), so their integrations start together and the readings of a row are not skewed by the time it takes to trigger the meters one by one. The time a reading was triggered is kept on the session as last_trigger, None for busy instruments and for meters that are only fetched.
+    """
+    names = [getattr(instrument, 'name', instrument) for instrument in instruments]
+    readings = {name: None for name in names if instrument_busy(inits[name])}
+    for name in readings:
+        inits[name].last_trigger = None
+    buses: Dict[str, List[str]] = {}
+    for name in names:
+        if name not in readings:
+            buses.setdefault(gpib_bus(inits[name]) or name, []).append(name)
+    executor = get_acquisition_executor()
+    futures = [executor.submit(drain_bus, inits, bus_names, fetch_only, synchronised_trigger) for bus_names in buses.values()]
+    wait(futures)
+    errors = {}
+    for future in futures:
+        bus_readings, bus_errors = future.result()
+        readings.update(bus_readings)
+        errors.update(bus_errors)
+    for name in names:
+        if name in errors:
+            raise errors[name]
+    return {name: readings[name] for name in names}
+
+
+def run_in_background(session, func, *args) -> Future:
+    """
+    Runs a long instrument operation such as ACAL on a worker thread. Until it finishes, instrument_busy returns True for the session and read_instruments_concurrently reports None for it instead of reading it.
+    """
+    session.background_job = get_acquisition_executor().submit(func, *args)
+    return session.background_job
+
+
+def instrument_busy(session) -> bool:
+    background_job = getattr(session, 'background_job', None)
+    if background_job is None:
+        return False
+    if not background_job.done():
+        return True
+    session.background_job = None
+    # Re-raise a failed background operation instead of silently measuring on an uncalibrated meter
+    background_job.result()
+    return False
+
+
+def acal_3458a(ag3458a, acal_types=('dcv', 'ohms')):
+    """
+    Runs ACAL, waiting for each type to finish (see ACAL_SECONDS, or acal_seconds on the session for drivers that already block until it is done), and records when and at which internal temperature (the last one read into last_temp_value) it started, and the CAL? 72 value it produced. last_acal_cal72 is None while ACAL runs, so no row is logged with the value of the previous ACAL. A 3458A with display_off set gets its display turned off again afterwards.
+    """
+    ag3458a.last_acal = datetime.datetime.utcnow()
+    ag3458a.last_acal_temp = getattr(ag3458a, 'last_temp_value', getattr(ag3458a, 'last_acal_temp', None))
+    ag3458a.last_acal_cal72 = None
+    acal_seconds = getattr(ag3458a, 'acal_seconds', ACAL_SECONDS)
+    for acal_type in acal_types:
+        getattr(ag3458a.acal, f'start_{acal_type}')()
+        time.sleep(acal_seconds.get(acal_type, 0))
+    ag3458a.last_acal_cal72 = ag3458a._ask('CAL? 72').strip()
+    if getattr(ag3458a, 'display_off', False):
+        ag3458a._write(DISPLAY_OFF_COMMAND_3458A)
+
+
+def start_acal_3458a_in_background(ag3458a, acal_types=('dcv', 'ohms')) -> Future:
+    if instrument_busy(ag3458a):
+        return ag3458a.background_job
+    print(f'Starting ACAL {", ".join(acal_types).upper()} in background')
+    return run_in_background(ag3458a, acal_3458a, ag3458a, acal_types)
+
+
+def acal_due(ag3458a, max_temp_change: float = ACAL_MAX_TEMP_CHANGE) -> bool:
+    if not hasattr(ag3458a, 'last_acal'):
+        return False
+    if (datetime.datetime.utcnow() - ag3458a.last_acal).total_seconds() > ACAL_MAX_AGE_SECONDS:
+        return True
+    last_temp_value = getattr(ag3458a, 'last_temp_value', None)
+    last_acal_temp = getattr(ag3458a, 'last_acal_temp', None)
+    return last_temp_value is not None and last_acal_temp is not None and abs(last_acal_temp - last_temp_value) >= max_temp_change
+
+
+def acal_3458a_if_due(ag3458a, acal_types=('dcv', 'ohms'), max_temp_change: float = ACAL_MAX_TEMP_CHANGE) -> Optional[Future]:
+    """
+    Starts ACAL in the background when it is due (see acal_due, max_temp_change is the change of the internal temperature in °C that makes it due) and the 3458A is not busy. This is the only ACAL scheduler: steps call it through schedule_acal, logging loops without steps call it directly after reading the temperature into last_temp_value.
+    """
+    if not instrument_busy(ag3458a) and acal_due(ag3458a, max_temp_change):
+        return start_acal_3458a_in_background(ag3458a, acal_types)
+    return None
+
+
+def acal_cal72(ag3458a) -> Optional[str]:
+    """
+    The CAL? 72 value of the last ACAL to log, None while an ACAL is running.
+    """
+    return None if instrument_busy(ag3458a) else getattr(ag3458a, 'last_acal_cal72', None)
+
+
+def schedule_acal(step: Step3, inits):
+    for instrument in step.instruments:
+        if instrument.name.startswith('ag3458a_') and instrument.setting.allow_acal:
+            acal_3458a_if_due(inits[instrument.name])
+
+
+def estimate_remaining_drift(times: Sequence[float], values: Sequence[float]) -> float:
+    """
+    Estimates how much a settling reading will still change, from a window of recent readings.
+
+    The window is split in three blocks. If the block means show a significant change that is clearly decreasing in the same direction, the reading is assumed to decay exponentially and the remaining change from the last block towards the asymptote is extrapolated (Aitken's delta-squared). Otherwise the linear trend over one window length is used.
+    """
+    block_size = len(values) // 3
+    blocks = [values[i * block_size:(i + 1) * block_size] for i in range(3)]
+    mean1, mean2, mean3 = map(statistics.fmean, blocks)
+    change1, change2 = mean2 - mean1, mean3 - mean2
+    noise = statistics.fmean(statistics.stdev(block) for block in blocks) if block_size > 1 else 0
+    change_uncertainty = 2 * noise * (2 / block_size) ** 0.5
+    ratio = change2 / change1 if change1 else 0
+    # A ratio close to 1 is indistinguishable from a linear drift and would extrapolate to infinity
+    if abs(change1) > change_uncertainty and 0 < ratio < 0.8:
+        return abs(change2 * ratio / (1 - ratio))
+    slope = statistics.linear_regression(times, values).slope
+    return abs(slope * (times[-1] - times[0]))
+
+
+@dataclass
+class SettleDetector:
+    """
+    Ends the soak of a step as soon as the reading has settled, with the step soak time (and 5 times that after a manual prompt) only as an upper bound.
+
+    During the soak, the first instrument of the step is read continuously with read_instrument. Once there are window readings, the step is settled when the remaining drift estimated from the last window is below threshold_ppm of the reading, or of range_fraction of the instrument range for readings near zero, like offsets and null measurements. The threshold should be above the noise of the readings, otherwise the soak simply runs to its upper bound.
+    """
+    threshold_ppm: float = 10
+    window: int = 9
+    min_soak_time: float = 0
+    range_fraction: float = 0.01
+    read_instrument: Callable[[Any, Instrument], Any] = initiate_and_fetch
+
+    def __post_init__(self):
+        # estimate_remaining_drift splits the window in three blocks
+        if self.window < 3:
+            raise ValueError(f'Settle window must be at least 3 readings: {self.window}')
+
+    def is_settled(self, times: Sequence[float], values: Sequence[float], instrument_range: Optional[float] = None) -> bool:
+        if len(values) < self.window:
+            return False
+        times, values = times[-self.window:], values[-self.window:]
+        scale = max(abs(statistics.fmean(values)), self.range_fraction * (instrument_range or 0)) or 1
+        return estimate_remaining_drift(times, values) <= self.threshold_ppm * 1e-6 * scale
+
+    def add_reading(self, times: List[float], values: List[Any], elapsed: float, value, instrument: Instrument) -> bool:
+        times.append(elapsed)
+        values.append(value)
+        if elapsed >= self.min_soak_time and self.is_settled(times, values, instrument.setting.range):
+            print(f'Settled after {elapsed:.0f} s')
+            return True
+        return False
+
+    def wait_for_settle(self, step: Step3, inits, step_soak_time, manual_prompt=False):
+        max_soak_time = step_soak_time * 6 if manual_prompt else step_soak_time
+        instrument = step.instruments[0]
+        session = inits[instrument.name]
+        start = time.monotonic()
+        times, values = [], []
+        while time.monotonic() - start < max_soak_time:
+            value = self.read_instrument(session, instrument)
+            if self.add_reading(times, values, time.monotonic() - start, value, instrument):
+                return
+        print(f'Not settled within {max_soak_time:.0f} s, continuing')
+
+    async def wait_for_settle_async(self, step: Step3, inits, step_soak_time, manual_prompt=False):
+        """
+        Like wait_for_settle, with every reading awaited on its own, so cancelling the soak stops it between two readings instead of leaving it running in a worker thread.
+        """
+        max_soak_time = step_soak_time * 6 if manual_prompt else step_soak_time
+        instrument = step.instruments[0]
+        session = inits[instrument.name]
+        start = time.monotonic()
+        times, values = [], []
+        while time.monotonic() - start < max_soak_time:
+            value = await run_blocking(self.read_instrument, session, instrument)
+            if self.add_reading(times, values, time.monotonic() - start, value, instrument):
+                return
+        print(f'Not settled within {max_soak_time:.0f} s, continuing')
+
+
+async def run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+
+async def run_procedure_async(csvw, procedure: List[Step3], inits, read_row, samples_per_step, step_soak_time, settle_detector: Optional[SettleDetector] = None, read_burst=None,
+                              journal: Optional['ProcedureJournal'] = None, resume=False, retry_policy: Optional['RetryPolicy'] = None,
+                              step_statistics: Optional['StepStatistics'] = None):
+    """
+    Asyncio variant of run_procedure: instrument I/O runs in the default executor and soak, manual prompt and sampling are awaitable, so several rigs can be driven from one event loop and a step can be cancelled without waiting for an instrument timeout.
+
+    Cancelling the task raises StepInterrupted with the step that was running, during the soak as well as while sampling, just like KeyboardInterrupt does for run_procedure. Only this top level maps the cancellation, the step coroutines below it let asyncio.CancelledError through, so they can be used with asyncio.timeout or in a TaskGroup. Instrument I/O is awaited one reading at a time, so a cancelled step stops between two readings; a blocking instrument call that is already running still finishes in its worker thread, but its result is discarded.
+    """
+    retry_policy = retry_policy or RetryPolicy()
+    latency_stats.instrument_sessions(inits)
+    start_step, first_sample = journal.start(procedure, samples_per_step, resume) if journal else (0, 1)
+    previous_step = procedure[start_step - 1] if start_step else None
+    step_number = start_step
+    try:
+        for step_number, step in enumerate(procedure[start_step:], start_step):
+            print(f'Step {step_number+1}/{len(procedure)}')
+            await execute_step_async(csvw, step_number, step, previous_step, inits, read_row, samples_per_step, step_soak_time, settle_detector, read_burst,
+                                     first_sample if step_number == start_step else 1, journal, retry_policy, step_statistics)
+            if journal:
+                journal.record(step_number + 1, 0, csvw)
+            previous_step = step
+        if journal:
+            journal.complete()
+    except asyncio.CancelledError:
+        for session in inits.values():
+            invalidate_state_cache(session)
+        raise StepInterrupted(step_number)
+    finally:
+        latency_stats.finish()
+        await run_blocking(beep)
+
+
+async def execute_step_async(csvw, step_number: int, step: Union[Step, Step2, Step3], previous_step: Union[Step, Step2, Step3], inits, read_row, samples_per_step, step_soak_time, settle_detector: Optional[SettleDetector] = None, read_burst=None,
+                             first_sample=1, journal: Optional['ProcedureJournal'] = None, retry_policy: Optional['RetryPolicy'] = None,
+                             step_statistics: Optional['StepStatistics'] = None):
+    if not isinstance(step, Step3):
+        step = step.to_step3()
+    if previous_step and not isinstance(previous_step, Step3):
+        previous_step = previous_step.to_step3()
+    await run_blocking(set_instrument_and_dut_safe, step, previous_step, inits)
+    if step.manual_prompt:
+        await manual_prompt_async(step)
+    print(f'Executing step: {step}')
+    await run_blocking(run_batched, setup_dut, inits, step, inits)
+    await run_blocking(run_batched, setup_instrument, inits, step, previous_step, inits, step_soak_time)
+    await run_blocking(snapshot_step_settings, inits)
+    if settle_detector:
+        await settle_detector.wait_for_settle_async(step, inits, step_soak_time, step.manual_prompt)
+    else:
+        await wait_for_settle_async(step, step_soak_time, step.manual_prompt)
+    schedule_acal(step, inits)
+    retry_policy = retry_policy or RetryPolicy()
+    retry_policy.start_step()
+    if step_statistics:
+        csvw = step_statistics.start_step(step_number, step, csvw)
+    try:
+        if read_burst:
+            await sample_input_burst_async(step_number, step, inits, csvw, read_burst, samples_per_step, first_sample, journal, retry_policy)
+        else:
+            await sample_input_async(step_number, step, inits, csvw, read_row, samples_per_step, first_sample, journal, retry_policy)
+    finally:
+        if step_statistics:
+            step_statistics.end_step()
+    retry_policy.log_step(step_number)
+
+
+async def manual_prompt_async(step: Step3):
+    instrument_names = ', '.join([i.name for i in step.instruments])
+    print(f'Please connect {instrument_names} to {step.dut.name} set to {step.dut.setting} for {step.dut.dut_setting_cmd.function}')
+    await run_blocking(beep)
+    await input_async('Press enter to continue...')
+
+
+async def input_async(prompt: str) -> str:
+    """
+    Reads a line from stdin without a worker thread where the event loop can watch stdin, so a cancelled prompt stops waiting for it. Falls back to input in a worker thread otherwise, e.g. on Windows or when stdin is not a file.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        stdin = sys.stdin.fileno()
+    except (AttributeError, OSError, ValueError):
+        return await run_blocking(input, prompt)
+    line = loop.create_future()
+    try:
+        loop.add_reader(stdin, lambda: line.done() or line.set_result(sys.stdin.readline()))
+    except (NotImplementedError, OSError, ValueError):
+        return await run_blocking(input, prompt)
+    print(prompt, end='', flush=True)
+    try:
+        return (await line).rstrip('\n')
+    finally:
+        loop.remove_reader(stdin)
+
+
+async def wait_for_settle_async(step: Step3, step_soak_time, manual_prompt=False):
+    if manual_prompt:
+        await asyncio.sleep(step_soak_time * 5)
+    await asyncio.sleep(step_soak_time)
+
+
+async def sample_input_async(step_number: int, step: Step3, inits, csvw, read_row, samples_per_step, first_sample=1, journal: Optional['ProcedureJournal'] = None,
+                             retry_policy: Optional['RetryPolicy'] = None):
+    retry_policy = retry_policy or RetryPolicy()
+    for sample_no in sample_numbers(step, samples_per_step, first_sample):
+        await take_single_sample_async(step, inits, csvw, read_row, sample_no, retry_policy)
+        if journal:
+            journal.record(step_number, sample_no, csvw)
+
+
+async def sample_input_burst_async(step_number: int, step: Step3, inits, csvw, read_burst, samples_per_step, first_sample=1, journal: Optional['ProcedureJournal'] = None,
+                                   retry_policy: Optional['RetryPolicy'] = None):
+    # Like sample_input_burst, with every burst awaited on its own
+    retry_policy = retry_policy or RetryPolicy()
+    samples_taken = first_sample - 1
+    while step.run_until_interrupted or samples_taken < samples_per_step:
+        count = samples_per_step - samples_taken % samples_per_step
+        await run_blocking(take_single_burst, step, inits, csvw, read_burst, count, retry_policy)
+        samples_taken += count
+        if journal:
+            journal.record(step_number, samples_taken, csvw)
+
+
+async def take_single_sample_async(step: Step3, inits, csvw, read_row, sample_no, retry_policy: Optional['RetryPolicy'] = None):
+    retry_policy = retry_policy or RetryPolicy()
+    while True:
+        print(f"{sample_no:2d}: ", end="")
+        try:
+            row, has_measurement = await run_blocking(read_row, inits, step.instruments)
+        except RETRIED_ERRORS as e:
+            if not await run_blocking(retry_policy.retry, e, step_sessions(step, inits)):
+                raise
+            has_measurement = False
+        else:
+            retry_policy.succeeded()
+            if has_measurement:
+                row['dut'] = step.dut.name
+                row['dut_setting'] = step.dut.setting
+            csvw.writerow(row)
+            latency_stats.write_if_due()
+        if has_measurement:
+            break
+
+
+class ErrorKind(Enum):
+    TRANSIENT = 'transient'
+    TIMEOUT = 'timeout'
+    OVER_RANGE = 'over_range'
+
+
+class OverRangeError(IOError):
+    pass
+
+
+# The errors classify_error has a kind for, anything else raised while reading a row is a bug and raised at once
+RETRIED_ERRORS = (OverRangeError, vxi11.vxi11.Vxi11Exception, TimeoutError, ConnectionError, EOFError)
+
+
+def classify_error(error: BaseException) -> Optional[ErrorKind]:
+    """
+    The kind of an error raised while reading instruments, or None for errors that are not worth retrying, such as errors in a script.
+    """
+    if isinstance(error, OverRangeError):
+        return ErrorKind.OVER_RANGE
+    if isinstance(error, vxi11.vxi11.Vxi11Exception):
+        return ErrorKind.TIMEOUT if error.err == VXI11_IO_TIMEOUT else ErrorKind.TRANSIENT
+    if isinstance(error, TimeoutError):
+        return ErrorKind.TIMEOUT
+    if isinstance(error, (ConnectionError, EOFError)):
+        return ErrorKind.TRANSIENT
+    return None
+
+
+def step_sessions(step: Step3, inits) -> list:
+    return list({id(inits[i.name]): inits[i.name] for i in step.instruments if i.name in inits}.values())
+
+
+def device_clear(session):
+    try:
+        session._clear()
+    except (vxi11.vxi11.Vxi11Exception, OSError, EOFError) as e:
+        logging.error(f'Device clear of {session} failed', exc_info=e)
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Decides whether a failed read of a row is retried. Transient bus errors, timeouts and over/under range readings (see classify_error) are retried after an exponential backoff, other errors are raised at once. A timeout first clears the instruments of the step, so a late reply is not taken as the reply to the next query.
+
+    A step may retry retries_per_step times, after that the error is raised instead of stalling the procedure on an instrument that does not recover. The backoff starts at initial_backoff and doubles with every failure in a row, up to max_backoff. counters counts the errors of the run by ErrorKind value and is logged at the end of every step that retried.
+    """
+    retries_per_step: int = 20
+    initial_backoff: float = 1.0
+    max_backoff: float = 60.0
+    counters: Counter = field(default_factory=Counter)
+    step_retries: int = 0
+    consecutive_failures: int = 0
+
+    def start_step(self):
+        self.step_retries = 0
+        self.consecutive_failures = 0
+
+    def succeeded(self):
+        self.consecutive_failures = 0
+
+    def backoff(self) -> float:
+        return min(self.initial_backoff * 2 ** max(0, self.consecutive_failures - 1), self.max_backoff)
+
+    def retry(self, error: BaseException, sessions=()) -> bool:
+        kind = classify_error(error)
+        if kind is None:
+            return False
+        self.counters[kind.value] += 1
+        if self.step_retries >= self.retries_per_step:
+            self.counters['exhausted'] += 1
+            logging.error(f'Giving up after {self.step_retries} retries in this step', exc_info=error)
+            return False
+        self.step_retries += 1
+        self.consecutive_failures += 1
+        delay = self.backoff()
+        logging.warning(f'{kind.value} error, retry {self.step_retries}/{self.retries_per_step} in {delay:g} s: {error}')
+        if kind == ErrorKind.TIMEOUT:
+            for session in sessions:
+                device_clear(session)
+        time.sleep(delay)
+        return True
+
+    def log_step(self, step_number: int):
+        if self.step_retries:
+            logging.warning(f'Step {step_number+1}: {self.step_retries} retries, errors so far: {dict(self.counters)}')
+
+
+@dataclass
+class RunningStatistics:
+    """
+    Count, mean, variance, minimum and maximum of a stream of values, updated per value with Welford's algorithm: no values are kept, and the variance does not lose its digits to cancellation like a sum of squares of readings around 10 kOhm would.
+    """
+    n: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+    def add(self, value: float):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def std(self) -> Optional[float]:
+        return (self.m2 / (self.n - 1)) ** 0.5 if self.n > 1 else None
+
+    @property
+    def sem(self) -> Optional[float]:
+        return self.std / self.n ** 0.5 if self.n > 1 else None
+
+
+# Columns of an instrument that log one of its settings rather than a measurement, by the part after the instrument name
+SETTING_COLUMN_SUFFIXES = ('range', 'delay', 'function', 'percentage', 'nsamples', 'aper_or_nplc', 'trigger', 'burst_reading')
+STEP_STATISTICS_FIELDNAMES = ('step', 'dut', 'dut_setting', 'column', 'n', 'mean', 'std', 'sem', 'min', 'max', 'first', 'last')
+
+
+def is_measurement_column(column: str, instrument_names: Sequence[str]) -> bool:
+    """
+    Whether column is a numeric measurement of one of instrument_names, like ag3458a_2_ohm or k2000_d4910_avg_f732a1, rather than one of its settings (see SETTING_COLUMN_SUFFIXES) or a column of another instrument, like k2000_20_ohm for k2000.
+    """
+    if field_kind(column) != 'float':
+        return False
+    names = [name for name in instrument_names if column.startswith(f'{name}_')]
+    if not names:
+        return False
+    suffix = column[len(max(names, key=len)) + 1:]
+    if suffix.split('_')[0].isdigit():
+        return False
+    return suffix not in SETTING_COLUMN_SUFFIXES
+
+
+class StepStatistics:
+    """
+    Keeps RunningStatistics of the measurement columns of the instruments of a step (see is_measurement_column) in its measurement rows as they are written, and writes one record per column with STEP_STATISTICS_FIELDNAMES to sink when the step ends, so the per step mean and standard deviation don't need a pass over the log. first and last are the datetime of the first and last row of the step.
+
+    Rows without a measurement (temperature and ACAL rows) are not counted. A step that is interrupted or fails is summarised up to its last row, a resumed step only from where it was resumed.
+    """
+    def __init__(self, sink):
+        self.sink = sink
+        self.step_number: Optional[int] = None
+        self.step: Optional[Step3] = None
+        self.columns: Dict[str, RunningStatistics] = {}
+        self.measurement_columns: Dict[str, bool] = {}
+        self.first = None
+        self.last = None
+
+    def start_step(self, step_number: int, step: Step3, csvw) -> 'StatisticsWriter':
+        """
+        Starts the statistics of a step and returns the writer to write its rows to, which passes them on to csvw.
+        """
+        self.step_number, self.step = step_number, step
+        self.columns = {}
+        self.measurement_columns = {}
+        self.first = self.last = None
+        return StatisticsWriter(csvw, self)
+
+    def add_row(self, row: Dict[str, Any]):
+        if self.step is None or row.get('dut') != self.step.dut.name:
+            return
+        if self.first is None:
+            self.first = row.get('datetime')
+        self.last = row.get('datetime')
+        for column, value in row.items():
+            if column not in self.measurement_columns:
+                self.measurement_columns[column] = is_measurement_column(column, [instrument.name for instrument in self.step.instruments])
+            if value not in (None, '') and self.measurement_columns[column] and is_number(value):
+                if column not in self.columns:
+                    self.columns[column] = RunningStatistics()
+                self.columns[column].add(float(value))
+
+    def summaries(self) -> List[Dict[str, Any]]:
+        return [{'step': self.step_number + 1, 'dut': self.step.dut.name, 'dut_setting': self.step.dut.setting, 'column': column,
+                 'n': running.n, 'mean': running.mean, 'std': running.std, 'sem': running.sem, 'min': running.min,
+                 'max': running.max, 'first': self.first, 'last': self.last}
+                for column, running in self.columns.items()]
+
+    def end_step(self):
+        for summary in self.summaries():
+            self.sink.writerow(summary)
+        self.step = None
+
+
+class StatisticsWriter:
+    """
+    The csv.DictWriter interface of csvw, adding every row written to the statistics of the step.
+    """
+    def __init__(self, csvw, step_statistics: StepStatistics):
+        self.csvw = csvw
+        self.step_statistics = step_statistics
+
+    def writeheader(self):
+        return self.csvw.writeheader()
+
+    def writerow(self, row: Dict[str, Any]):
+        self.csvw.writerow(row)
+        self.step_statistics.add_row(row)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def __getattr__(self, name):
+        # flush, on_commit, rows_written etc. of the sink
+        return getattr(self.csvw, name)
+
+
 def check_valid_value(instrument, value):
     if instrument.measurement.is_over_range(value) or instrument.measurement.is_under_range(value):
         # beep()
-        raise IOError(f'Received under/overrange value {value} from {instrument}')
+        raise OverRangeError(f'Received under/overrange value {value} from {instrument}')
 
 def beep():
     os.environ['PULSE_SERVER'] = 'nufan'
@@ -542,4 +1629,85 @@ def resistance_is_4w(value) -> bool:
 class StepInterrupted(Exception):
     def __init__(self, step_number: int):
         self.step_number = step_number
-        super().__init__(f'Step interrupted at step {step_number}')
\ No newline at end of file
+        super().__init__(f'Step interrupted at step {step_number}')
+
+def procedure_hash(procedure: Sequence[Union[Step, Step2, Step3]]) -> str:
+    return hashlib.sha256(repr(list(procedure)).encode()).hexdigest()
+
+
+class ProcedureJournal:
+    """
+    Progress journal for run_procedure, so a crashed or interrupted procedure can be resumed at the first incomplete step and sample instead of repeating hours of soak.
+
+    The journal file holds the hash of the procedure, the step number (the index into the procedure, like StepInterrupted.step_number) and the number of samples taken in that step. It is replaced atomically after every sample, and removed once the procedure is complete. With a log sink that reports its commits (see log_sink.CsvSink.on_commit), the progress of a sample is only recorded once the sink has committed its rows, so the journal never claims samples that are not on disk, without forcing a commit per sample.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.procedure_hash = None
+        # (rows_written of the log after the sample, step_number, samples_taken) waiting for the log to commit
+        self.pending: Deque[Tuple[int, int, int]] = deque()
+        self.lock = threading.Lock()
+
+    def read(self) -> Optional[dict]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def start(self, procedure: Sequence[Union[Step, Step2, Step3]], samples_per_step, resume=False) -> Tuple[int, int]:
+        """
+        Returns the step number and first sample to run procedure from: where the journal left off if resume is set and the journal belongs to the same procedure, otherwise the beginning.
+        """
+        self.procedure_hash = procedure_hash(procedure)
+        step_number, samples_taken = 0, 0
+        if resume:
+            state = self.read()
+            if state and state['procedure_hash'] == self.procedure_hash:
+                step_number, samples_taken = state['step_number'], state['samples_taken']
+                print(f'Resuming at step {step_number+1}/{len(procedure)}, sample {samples_taken+1}')
+            else:
+                print(f'No journal for this procedure in {self.path}, starting from the beginning')
+        if step_number < len(procedure) and samples_taken >= samples_per_step and not getattr(procedure[step_number], 'run_until_interrupted', False):
+            step_number, samples_taken = step_number + 1, 0
+        self.record(step_number, samples_taken)
+        return step_number, samples_taken + 1
+
+    def record(self, step_number: int, samples_taken: int, log=None):
+        """
+        Records progress, once the rows written to log (the sink the samples were written to) are committed if it reports its commits, otherwise right away.
+        """
+        if not hasattr(log, 'on_commit'):
+            with self.lock:
+                self.pending.clear()
+                self.write(step_number, samples_taken)
+            return
+        log.on_commit(self.committed)
+        with self.lock:
+            self.pending.append((log.rows_written, step_number, samples_taken))
+        self.committed(log.rows_committed)
+
+    def committed(self, rows_committed: int):
+        """
+        Commit callback of the log, records the last progress whose rows are all committed.
+        """
+        with self.lock:
+            progress = None
+            while self.pending and self.pending[0][0] <= rows_committed:
+                progress = self.pending.popleft()
+            if progress:
+                self.write(*progress[1:])
+
+    def write(self, step_number: int, samples_taken: int):
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump({'procedure_hash': self.procedure_hash, 'step_number': step_number, 'samples_taken': samples_taken}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.path)
+
+    def complete(self):
+        with self.lock:
+            self.pending.clear()
+            if os.path.exists(self.path):
+                os.remove(self.path)
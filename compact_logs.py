@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+import argparse
+import ast
+import csv
+import glob
+import os
+import shutil
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from log_sink import convert_value, field_kind, is_number
+
+BATCH_ROWS = 65536
+CLOSED_AFTER_SECONDS = 24 * 3600
+PARTITION_COLUMNS = ('month', 'dut')
+
+
+def script_fieldnames(script_dir: str = '.') -> Dict[str, Tuple[str, ...]]:
+    """
+    The FIELDNAMES of the scripts in script_dir by the file name of their OUTPUT_FILE. The constants are read from the source instead of importing the scripts, which would import the instrument drivers.
+    """
+    fieldnames = {}
+    for path in sorted(glob.glob(os.path.join(script_dir, '*.py'))):
+        try:
+            with open(path) as f:
+                tree = ast.parse(f.read())
+        except (SyntaxError, UnicodeDecodeError):
+            continue
+        constants = {}
+        for node in tree.body:
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name) \
+                    and node.targets[0].id in ('OUTPUT_FILE', 'FIELDNAMES'):
+                try:
+                    constants[node.targets[0].id] = ast.literal_eval(node.value)
+                except ValueError:
+                    pass
+        if isinstance(constants.get('OUTPUT_FILE'), str) and isinstance(constants.get('FIELDNAMES'), (tuple, list)):
+            fieldnames[os.path.basename(constants['OUTPUT_FILE'])] = tuple(constants['FIELDNAMES'])
+    return fieldnames
+
+
+def log_columns(header: Sequence[str], fieldnames: Optional[Sequence[str]]) -> List[str]:
+    """
+    The columns of the Parquet files: the FIELDNAMES of the script, followed by any column of the log that is no longer in them. A column of FIELDNAMES that is not in the log, added after the log was started, is all nulls.
+    """
+    columns = list(fieldnames or header)
+    return columns + [column for column in header if column not in columns]
+
+
+def log_rows(path: str) -> Iterator[Tuple[List[str], Optional[List[str]]]]:
+    """
+    The header and the rows of a log, None for a row that has a different number of fields than the header, like a torn last record.
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        for row in reader:
+            yield header, row if len(row) == len(header) else None
+
+
+def is_timestamp(value: str) -> bool:
+    try:
+        convert_value('timestamp', value)
+    except ValueError:
+        return False
+    return True
+
+
+def scan_kinds(path: str, columns: Sequence[str]) -> Tuple[Dict[str, str], int, int]:
+    """
+    First pass over a log: the kind of every column from its name (see log_sink.field_kind), falling back to string for a float or timestamp column with text in it, and the number of rows and skipped rows. Only one row is held at a time.
+    """
+    kinds = {column: field_kind(column) for column in columns}
+    rows = skipped = 0
+    indices = None
+    for header, row in log_rows(path):
+        if indices is None:
+            indices = [(column, header.index(column)) for column in columns if column in header]
+        if row is None:
+            skipped += 1
+            continue
+        rows += 1
+        for column, index in indices:
+            value = row[index]
+            if value and ((kinds[column] == 'float' and not is_number(value)) or (kinds[column] == 'timestamp' and not is_timestamp(value))):
+                kinds[column] = 'string'
+    return kinds, rows, skipped
+
+
+class LogCompactor:
+    """
+    Converts a closed CSV log into a Parquet dataset partitioned by month and dut (Hive style directories, e.g. month=2024-01/dut=SR104), with the column types of log_sink.field_kind and dictionary-encoded string columns.
+
+    The log is streamed twice: once to infer the column kinds and count the rows, once to write the rows in batches of batch_rows, so memory is bounded by a batch per open partition whatever the size of the log. Rows without datetime or dut go to the default partition. The rows in the dataset are counted afterwards and compared with the rows of the log.
+    """
+    def __init__(self, script_dir: str = '.', batch_rows: int = BATCH_ROWS):
+        try:
+            import pyarrow
+            import pyarrow.dataset
+        except ImportError as e:
+            raise ImportError('LogCompactor requires pyarrow, install it with: pip install pyarrow') from e
+        self.pa = pyarrow
+        self.ds = pyarrow.dataset
+        self.fieldnames = script_fieldnames(script_dir)
+        self.batch_rows = batch_rows
+
+    def arrow_type(self, column: str, kind: str):
+        if column in PARTITION_COLUMNS:
+            return self.pa.string()
+        if kind == 'timestamp':
+            return self.pa.timestamp('us')
+        if kind == 'float':
+            return self.pa.float64()
+        return self.pa.dictionary(self.pa.int32(), self.pa.string())
+
+    def record_batches(self, path: str, columns: Sequence[str], kinds: Dict[str, str], schema) -> Iterator:
+        batch = {column: [] for column in schema.names}
+        indices = None
+        for header, row in log_rows(path):
+            if indices is None:
+                indices = {column: header.index(column) for column in columns if column in header}
+            if row is None:
+                continue
+            for column in columns:
+                batch[column].append(convert_value(kinds[column], row[indices[column]]) if column in indices else None)
+            if 'month' not in columns:
+                timestamp = row[indices['datetime']] if 'datetime' in indices else ''
+                batch['month'].append(timestamp[:7] or None)
+            if len(batch['month']) >= self.batch_rows:
+                yield self.pa.RecordBatch.from_pydict(batch, schema=schema)
+                batch = {column: [] for column in schema.names}
+        if batch['month']:
+            yield self.pa.RecordBatch.from_pydict(batch, schema=schema)
+
+    def compact(self, path: str, output_path: str, overwrite: bool = False) -> int:
+        """
+        Writes the rows of the log in path to the dataset in output_path and returns the number of rows. Raises ValueError if the dataset does not have as many rows as the log.
+        """
+        with open(path, newline='') as f:
+            header = next(csv.reader(f), [])
+        columns = log_columns(header, self.fieldnames.get(os.path.basename(path)))
+        kinds, rows, skipped = scan_kinds(path, columns)
+        schema = self.pa.schema([(column, self.arrow_type(column, kinds[column])) for column in columns] +
+                                ([('month', self.pa.string())] if 'month' not in columns else []))
+        partitioning = self.ds.partitioning(self.pa.schema([(column, self.pa.string()) for column in PARTITION_COLUMNS if column in schema.names]),
+                                            flavor='hive')
+        if overwrite and os.path.exists(output_path):
+            shutil.rmtree(output_path)
+        self.ds.write_dataset(self.record_batches(path, columns, kinds, schema), output_path, schema=schema, format='parquet',
+                              partitioning=partitioning, basename_template='part-{i}.parquet', max_rows_per_group=self.batch_rows,
+                              existing_data_behavior='error')
+        written = self.ds.dataset(output_path, format='parquet', partitioning=partitioning).count_rows()
+        if written != rows:
+            raise ValueError(f'{output_path} has {written} rows, {path} has {rows}')
+        print(f'{path}: {rows} rows to {output_path}' + (f', incomplete rows skipped: {skipped}' if skipped else ''))
+        return rows
+
+
+def is_closed(path: str, min_age: float = CLOSED_AFTER_SECONDS) -> bool:
+    return time.time() - os.path.getmtime(path) >= min_age
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert closed CSV logs into Parquet datasets partitioned by month and dut, typed by the FIELDNAMES of the scripts')
+    parser.add_argument('logs', nargs='*', help='CSV logs to convert, all CSV files in the current directory by default')
+    parser.add_argument('--scripts', default=os.path.dirname(os.path.abspath(__file__)), help='Directory with the scripts that wrote the logs')
+    parser.add_argument('--output-dir', help='Directory for the datasets, next to the logs by default')
+    parser.add_argument('--min-age', type=float, default=CLOSED_AFTER_SECONDS / 3600, help='Hours since the last write before a log counts as closed')
+    parser.add_argument('--overwrite', action='store_true', help='Replace existing datasets')
+    args = parser.parse_args()
+
+    compactor = LogCompactor(args.scripts)
+    failed = False
+    for path in args.logs or sorted(glob.glob('*.csv')):
+        if not is_closed(path, args.min_age * 3600):
+            print(f'{path}: written in the last {args.min_age:g} hours, skipped')
+            continue
+        output_path = os.path.join(args.output_dir or os.path.dirname(path), os.path.splitext(os.path.basename(path))[0] + '.parquet')
+        if os.path.exists(output_path) and not args.overwrite:
+            print(f'{path}: {output_path} exists, skipped')
+            continue
+        try:
+            compactor.compact(path, output_path, args.overwrite)
+        except ValueError as e:
+            print(f'{path}: {e}')
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
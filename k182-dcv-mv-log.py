@@ -3,16 +3,15 @@
 import ivi
 import time
 import datetime
-import csv
-import os
 import readline
 from enum import Enum, auto
 import argparse
 
+from common_step_execution import wait_for_reading
+from log_sink import open_log
+
 OUTPUT_FILE = 'k182-dcv-mv-log.csv'
-SAMPLE_INTERVAL = 0
 FIELDNAMES = ('datetime', 'dut_neg_lead', 'dut_pos_lead', 'k182_dcv')
-WRITE_INTERVAL_SECONDS = 3600
 STABLE_THRESHOLD = 1e-1  # Should be stable within 10%
 ABS_STABLE_THRESHOLD = 2e-6 # Or within 2 uV
 STABLE_WAIT_TIME_SECONDS = 10
@@ -23,10 +22,6 @@ class State(Enum):
     WAITING = auto()
     RECORDING = auto()
 
-if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
-
-
 def k182_high_accuracy(k182):
     pass
 
@@ -47,7 +42,7 @@ def read_row(k182):
     row['datetime'] = datetime.datetime.utcnow().isoformat()
     k182.measurement.initiate()
     if not k182.is_high_speed:
-        time.sleep(SAMPLE_INTERVAL)
+        wait_for_reading(k182)
     row['k182_dcv'] = k182.measurement.fetch(0)
     return row
 
@@ -63,12 +58,7 @@ if __name__ == '__main__':
     inits = init_func()
     readline.parse_and_bind('tab: self-insert')
 
-    last_csvw_write = datetime.datetime(2018,1,1)
-    with open(output_file, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(output_file, FIELDNAMES) as csvw:
         state = State.WAITING
         k182_high_speed(inits['k182'])
         last_row = None
@@ -108,8 +98,4 @@ if __name__ == '__main__':
                     row['dut_neg_lead'] = dut_neg_lead
                     row['dut_pos_lead'] = dut_pos_lead
                     csvw.writerow(row)
-                    if (datetime.datetime.utcnow() - last_csvw_write) \
-                            > datetime.timedelta(seconds=WRITE_INTERVAL_SECONDS):
-                        csv_file.flush()
-                        last_csvw_write = datetime.datetime.utcnow()
             last_row = row
@@ -3,10 +3,13 @@
 import ivi
 import time
 import datetime
-import csv
-import os
+from concurrent.futures import wait
 
-OUTPUT_FILE = 'k199-x2-3458A-x2-k2000-x2-6031A-D4910-F732A-x3-F7001-log.csv'
+from common_step_execution import acal_3458a_if_due, acal_cal72, instrument_busy, read_instruments_by_bus, start_acal_3458a_in_background
+from log_sink import CsvSink
+
+# The trigger time columns were added, a log with the old header is not appended to
+OUTPUT_FILE = 'k199-x2-3458A-x2-k2000-x2-6031A-D4910-F732A-x3-F7001-log-2.csv'
 SAMPLE_INTERVAL = 0
 
 FIELDNAMES = ('datetime', 'k199_1_d4910_avg_2', 'k199_2_d4910_avg_3',
@@ -14,21 +17,25 @@ FIELDNAMES = ('datetime', 'k199_1_d4910_avg_2', 'k199_2_d4910_avg_3',
               'ag3458a_1_d4910_avg_f732a3', 'temp_2', 'last_acal_2',
               'last_acal_2_cal72', 'ag3458a_2_d4910_avg_f7001',
               'k2000_d4910_avg_f732a1', 'k2000_20_d4910_avg_1',
-              'prema6031a_d4910_avg_f732a2')
-WRITE_INTERVAL_SECONDS = 3600
+              'prema6031a_d4910_avg_f732a2', 'k199_25_trigger', 'k199_26_trigger',
+              'ag3458a_1_trigger', 'ag3458a_2_trigger', 'k2000_trigger',
+              'k2000_20_trigger', 'prema6031a_trigger')
+# The K2000s trigger continuously unless they are armed for a bus trigger, the other meters are triggered for every row
+CONTINUOUS_METERS = ('k2000', 'k2000_20')
+# Arm all meters, the K2000s included, for a bus trigger and start their readings with a single GET, so the readings of
+# a row are taken at the same time. The 6031A cannot be armed and is initiated just before the GET.
+SYNCHRONISED_TRIGGER = True
 DEBUG = False
+# Only DCV is measured
+ACAL_TYPES = ('dcv',)
+# ACAL every 24h or 1°C change in internal temperature, per manual
+ACAL_MAX_TEMP_CHANGE = 1
 
-if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
-
-def start_acal_3458a(ag3458a, temp):
-    ag3458a._write('ACAL DCV')
-    ag3458a.last_acal = datetime.datetime.utcnow()
-    ag3458a.last_acal_temp = temp
-
-def finish_acal_3458a(ag3458a):
-    ag3458a.last_acal_cal72 = ag3458a._ask('CAL? 72').strip()
-    ag3458a._write('DISP OFF,"                 "')
+def read_temp_3458a(ag3458a):
+    temp = float(ag3458a._ask('TEMP?'))
+    ag3458a.last_temp = datetime.datetime.utcnow()
+    ag3458a.last_temp_value = temp
+    return temp
 
 def init_func():
     k199_25 = ivi.keithley.keithley199("TCPIP::gpib1::gpib,25::INSTR",
@@ -65,15 +72,17 @@ def init_func():
     ag3458a_1._interface.timeout = 60
     ag3458a_1.measurement_function = 'dc_volts'
     ag3458a_1.range = 1e-3
-    temp_1 = float(ag3458a_1._ask('TEMP?'))
-    ag3458a_1.last_temp = datetime.datetime.utcnow()
+    ag3458a_1._write('DISP OFF,"                 "')
+    ag3458a_1.display_off = True
+    temp_1 = read_temp_3458a(ag3458a_1)
     ag3458a_2 = ivi.agilent.agilent3458A("TCPIP::gpib1::gpib,20::INSTR",
             reset=True)
     ag3458a_2._interface.timeout = 60
     ag3458a_2.measurement_function = 'dc_volts'
     ag3458a_2.range = 1e-3
-    temp_2 = float(ag3458a_2._ask('TEMP?'))
-    ag3458a_2.last_temp = datetime.datetime.utcnow()
+    ag3458a_2._write('DISP OFF,"                 "')
+    ag3458a_2.display_off = True
+    temp_2 = read_temp_3458a(ag3458a_2)
     if DEBUG:
         ag3458a_1.last_acal = datetime.datetime.utcnow()
         ag3458a_1.last_acal_temp = temp_1
@@ -81,14 +90,12 @@ def init_func():
         ag3458a_2.last_acal = datetime.datetime.utcnow()
         ag3458a_2.last_acal_temp = temp_2
         ag3458a_2.last_acal_cal72 = 'test'
-        # finish_acal_3458a(ag3458a_1)
-        # finish_acal_3458a(ag3458a_2)
     else:
-        start_acal_3458a(ag3458a_1, temp_1)
-        start_acal_3458a(ag3458a_2, temp_2)
-        time.sleep(3*60)
-        finish_acal_3458a(ag3458a_1)
-        finish_acal_3458a(ag3458a_2)
+        # Both ACALs run at the same time, the log starts once they are done
+        acals = [start_acal_3458a_in_background(ag3458a_1, ACAL_TYPES), start_acal_3458a_in_background(ag3458a_2, ACAL_TYPES)]
+        wait(acals)
+        for acal in acals:
+            acal.result()
     return {
         'k199_25': k199_25, 'k199_26': k199_26,
         'k2000': k2000, 'k2000_20': k2000_20,
@@ -97,69 +104,46 @@ def init_func():
         }
 
 
-def loop_func(csvw, k199_25, k199_26, k2000, k2000_20, ag3458a_1, ag3458a_2, prema6031a):
+def loop_func(csvw, inits):
+    ag3458a_1, ag3458a_2 = inits['ag3458a_1'], inits['ag3458a_2']
     row = {}
-    # ACAL every 24h or 1°C change in internal temperature, per manual
-    do_acal_3458a_1 = False
-    do_acal_3458a_2 = False
-    # Measure temperature every 15 minutes
+    # Measure temperature every 15 minutes, ACAL is scheduled by the engine when it is due
     temp_1 = None
     temp_2 = None
     if ((datetime.datetime.utcnow() - ag3458a_1.last_temp).total_seconds()
-            > 15 * 60):
-        temp_1 = float(ag3458a_1._ask('TEMP?'))
-        ag3458a_1.last_temp = datetime.datetime.utcnow()
-
-        if ((datetime.datetime.utcnow() - ag3458a_1.last_acal).total_seconds() > 24 * 3600) \
-                or (abs(ag3458a_1.last_acal_temp - temp_1) >= 1):
-            do_acal_3458a_1 = True
+            > 15 * 60) and not instrument_busy(ag3458a_1):
+        temp_1 = read_temp_3458a(ag3458a_1)
+        acal_3458a_if_due(ag3458a_1, ACAL_TYPES, ACAL_MAX_TEMP_CHANGE)
     if ((datetime.datetime.utcnow() - ag3458a_2.last_temp).total_seconds()
-            > 15 * 60):
-        temp_2 = float(ag3458a_2._ask('TEMP?'))
-        ag3458a_2.last_temp = datetime.datetime.utcnow()
-        if ((datetime.datetime.utcnow() - ag3458a_2.last_acal).total_seconds() > 24 * 3600) \
-                or (abs(ag3458a_2.last_acal_temp - temp_2) >= 1):
-            do_acal_3458a_2 = True
-    if do_acal_3458a_1 or do_acal_3458a_2:
-        if do_acal_3458a_1:
-            start_acal_3458a(ag3458a_1, temp_1)
-        if do_acal_3458a_2:
-            start_acal_3458a(ag3458a_2, temp_2)
-        time.sleep(3*60)
-        if do_acal_3458a_1:
-            finish_acal_3458a(ag3458a_1)
-        if do_acal_3458a_2:
-            finish_acal_3458a(ag3458a_2)
+            > 15 * 60) and not instrument_busy(ag3458a_2):
+        temp_2 = read_temp_3458a(ag3458a_2)
+        acal_3458a_if_due(ag3458a_2, ACAL_TYPES, ACAL_MAX_TEMP_CHANGE)
     row['datetime'] = datetime.datetime.utcnow().isoformat()
-    row['k199_1_d4910_avg_2'] = k199_25.measurement.read(0)
-    row['k199_2_d4910_avg_3'] = k199_26.measurement.read(0)
-    row['k2000_d4910_avg_f732a1'] = k2000.measurement.fetch(1)
-    row['k2000_20_d4910_avg_1'] = k2000_20.measurement.fetch(1)
+    # All meters share gpib1: trigger them all, then fetch in order of expected completion. A 3458A running ACAL reads None.
+    readings = read_instruments_by_bus(inits, list(inits), fetch_only=() if SYNCHRONISED_TRIGGER else CONTINUOUS_METERS,
+                                       synchronised_trigger=SYNCHRONISED_TRIGGER)
+    for name, session in inits.items():
+        row[f'{name}_trigger'] = session.last_trigger.isoformat() if session.last_trigger else None
+    row['k199_1_d4910_avg_2'] = readings['k199_25']
+    row['k199_2_d4910_avg_3'] = readings['k199_26']
+    row['k2000_d4910_avg_f732a1'] = readings['k2000']
+    row['k2000_20_d4910_avg_1'] = readings['k2000_20']
     row['temp_1'] = temp_1
     row['last_acal_1'] = ag3458a_1.last_acal.isoformat()
-    row['last_acal_1_cal72'] = ag3458a_1.last_acal_cal72
-    row['ag3458a_1_d4910_avg_f732a3'] = ag3458a_1.measurement.read(0)
-    row['prema6031a_d4910_avg_f732a2'] = prema6031a.measurement.read(0)
+    row['last_acal_1_cal72'] = acal_cal72(ag3458a_1)
+    row['ag3458a_1_d4910_avg_f732a3'] = readings['ag3458a_1']
+    row['prema6031a_d4910_avg_f732a2'] = readings['prema6031a']
     row['temp_2'] = temp_2
     row['last_acal_2'] = ag3458a_2.last_acal.isoformat()
-    row['last_acal_2_cal72'] = ag3458a_2.last_acal_cal72
-    row['ag3458a_2_d4910_avg_f7001'] = ag3458a_2.measurement.read(0)
+    row['last_acal_2_cal72'] = acal_cal72(ag3458a_2)
+    row['ag3458a_2_d4910_avg_f7001'] = readings['ag3458a_2']
     csvw.writerow(row)
 
 
 if __name__ == '__main__':
     inits = init_func()
 
-    last_csvw_write = datetime.datetime(2018,1,1)
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with CsvSink(OUTPUT_FILE, FIELDNAMES) as csvw:
         while True:
-            loop_func(csvw, **inits)
+            loop_func(csvw, inits)
             time.sleep(SAMPLE_INTERVAL)
-            if (datetime.datetime.utcnow() - last_csvw_write) \
-                    > datetime.timedelta(seconds=WRITE_INTERVAL_SECONDS):
-                csv_file.flush()
-                last_csvw_write = datetime.datetime.utcnow()
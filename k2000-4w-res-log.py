@@ -4,19 +4,14 @@ import argparse
 import ivi
 import time
 import datetime
-import csv
-import os
+
+from log_sink import open_log
 
 OUTPUT_FILE = 'k2000-4w-res-log.csv'
 SAMPLE_INTERVAL = 10
 FIELDNAMES = ('datetime', 'k2000_ohm', 'dut', 'dut_setting')
-WRITE_INTERVAL_SECONDS = 3600
 DEBUG = False
 
-if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
-
-
 def init_func():
     k2000 = ivi.keithley.keithley2000("TCPIP::gpib1::gpib,16::INSTR",
             id_query=True)
@@ -46,16 +41,7 @@ if __name__ == '__main__':
     args = parser.parse_args()
     inits = init_func()
 
-    last_csvw_write = datetime.datetime(2018, 1, 1)
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         while True:
             loop_func(csvw, args.dut, args.dut_setting, **inits)
             time.sleep(SAMPLE_INTERVAL)
-            if (datetime.datetime.utcnow() - last_csvw_write) \
-                    > datetime.timedelta(seconds=WRITE_INTERVAL_SECONDS):
-                csv_file.flush()
-                last_csvw_write = datetime.datetime.utcnow()
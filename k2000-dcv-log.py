@@ -3,16 +3,15 @@
 import ivi
 import time
 import datetime
-import csv
-import os
 import readline
 from enum import Enum, auto
 from quantiphy import Quantity
 
+from log_sink import open_log
+
 OUTPUT_FILE = 'k2000-dcv-log.csv'
 SAMPLE_INTERVAL = 1
 FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'k2000_dcv')
-WRITE_INTERVAL_SECONDS = 3600
 STABLE_THRESHOLD = 1e-3 # Should be stable within 0.1%
 MIN_VALUE = 9.9
 STABLE_WAIT_TIME_SECONDS = 10
@@ -23,9 +22,6 @@ class State(Enum):
     WAITING = auto()
     RECORDING = auto()
 
-if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
-
 def k2000_high_accuracy(k2000):
     k2000.is_high_speed = False
     k2000._write(':VOLT:DC:NPLC 10')
@@ -56,12 +52,7 @@ if __name__ == '__main__':
     inits = init_func()
     readline.parse_and_bind('tab: self-insert')
 
-    last_csvw_write = datetime.datetime(2018,1,1)
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         state = State.WAITING
         k2000_high_speed(inits['k2000'])
         last_row = None
@@ -100,8 +91,4 @@ if __name__ == '__main__':
                     row['dut'] = device_name
                     row['dut_setting'] = dut_setting
                     csvw.writerow(row)
-                    if (datetime.datetime.utcnow() - last_csvw_write) \
-                            > datetime.timedelta(seconds=WRITE_INTERVAL_SECONDS):
-                        csv_file.flush()
-                        last_csvw_write = datetime.datetime.utcnow()
             last_row = row
@@ -3,14 +3,13 @@
 import ivi
 import time
 import datetime
-import csv
-import os
+
+from log_sink import open_log
 
 OUTPUT_FILE = 'k2000-lm399-log.csv'
 SAMPLE_INTERVAL = 180
 FIELDNAMES = ('datetime', 'lm399-1', 'lm399-2', 'lm399-4', 'lm399-6', 'lm399-7',
               'lm399-8', 'lm399-9', 'lm399-10', 'lm399-11', 'lm399-12')
-WRITE_INTERVAL_SECONDS = 3600
 
 def init_func():
     k2000 = ivi.keithley.keithley2000("TCPIP::gpib1::gpib,16::INSTR",
@@ -37,16 +36,7 @@ def loop_func(csvw, k2000):
 if __name__ == '__main__':
     inits = init_func()
 
-    last_csvw_write = datetime.datetime(2018,1,1)
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         while True:
             loop_func(csvw, **inits)
             time.sleep(SAMPLE_INTERVAL)
-            if (datetime.datetime.utcnow() - last_csvw_write) \
-                    > datetime.timedelta(seconds=WRITE_INTERVAL_SECONDS):
-                csv_file.flush()
-                last_csvw_write = datetime.datetime.utcnow()
@@ -3,19 +3,14 @@
 import ivi
 import time
 import datetime
-import csv
-import os
+
+from log_sink import open_log
 
 OUTPUT_FILE = 'k2000-sr104-thermistor-log.csv'
 SAMPLE_INTERVAL = 60
 FIELDNAMES = ('datetime', 'k2000_temp_ohm')
-WRITE_INTERVAL_SECONDS = 3600
 DEBUG = False
 
-if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
-
-
 def init_func():
     k2000 = ivi.keithley.keithley2000("TCPIP::gpib1::gpib,16::INSTR",
             id_query=True)
@@ -39,16 +34,7 @@ def loop_func(csvw, k2000):
 if __name__ == '__main__':
     inits = init_func()
 
-    last_csvw_write = datetime.datetime(2018, 1, 1)
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         while True:
             loop_func(csvw, **inits)
             time.sleep(SAMPLE_INTERVAL)
-            if (datetime.datetime.utcnow() - last_csvw_write) \
-                    > datetime.timedelta(seconds=WRITE_INTERVAL_SECONDS):
-                csv_file.flush()
-                last_csvw_write = datetime.datetime.utcnow()
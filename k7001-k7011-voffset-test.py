@@ -3,11 +3,10 @@
 import ivi
 import time
 import datetime
-import csv
-import os
 import readline
 
-from common_step_execution import beep
+from common_step_execution import beep, wait_for_reading
+from log_sink import open_log
 
 OUTPUT_FILE = 'k7001-k7011-voffset-test.csv'
 FIELDNAMES = ('datetime', 'card', 'bank', 'channel1', 'channel2', 'k182_dcv')
@@ -27,6 +26,7 @@ def init_func():
 def read_row(k182, k7001):
     row = {}
     k182.measurement.initiate()
+    wait_for_reading(k182)
     row['k182_dcv'] = k182.measurement.fetch(0)
     row['datetime'] = datetime.datetime.utcnow().isoformat()
     return row
@@ -35,13 +35,8 @@ def read_row(k182, k7001):
 if __name__ == '__main__':
     inits = init_func()
     k7001 = inits['k7001']
-    last_csvw_write = datetime.datetime(2018, 1, 1)
     try:
-        with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-            initial_size = os.fstat(csv_file.fileno()).st_size
-            csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-            if initial_size == 0:
-                csvw.writeheader()
+        with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
             while True:
                 bank_names = ('A', 'B', 'C', 'D')
                 bank_names = ['D']
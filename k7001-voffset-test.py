@@ -3,10 +3,10 @@
 import ivi
 import time
 import datetime
-import csv
-import os
 import readline
 
+from log_sink import open_log
+
 OUTPUT_FILE = 'k7001-voffset-test.csv'
 FIELDNAMES = ('datetime', 'card', 'channel1', 'channel2', 'k182_dcv')
 TEST_CARD_NUMBER = '2'
@@ -33,13 +33,8 @@ def read_row(k182, k7001):
 if __name__ == '__main__':
     inits = init_func()
     k7001 = inits['k7001']
-    last_csvw_write = datetime.datetime(2018, 1, 1)
     try:
-        with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-            initial_size = os.fstat(csv_file.fileno()).st_size
-            csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-            if initial_size == 0:
-                csvw.writeheader()
+        with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
             while True:
                     for channel in k7001._channel_name:
                         if channel == 'common':
@@ -3,16 +3,15 @@
 import ivi
 import time
 import datetime
-import csv
-import os
 import readline
 from enum import Enum, auto
 from quantiphy import Quantity
 
+from log_sink import open_log
+
 OUTPUT_FILE = 'ks3458a-2w-res-log.csv'
 FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'ag3458a_2_ohm', 'temp_2', 'last_acal_2',
         'last_acal_2_cal72', 'ag3458a_2_range')
-WRITE_INTERVAL_SECONDS = 3600
 STABLE_THRESHOLD = 1e-3 # Should be stable within 0.1%
 STABLE_WAIT_TIME_SECONDS = 10
 
@@ -22,9 +21,6 @@ class State(Enum):
     WAITING = auto()
     RECORDING = auto()
 
-if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
-
 def acal_3458a(ag3458a):
     ag3458a.acal.start_dcv()
     ag3458a.acal.start_ohms()
@@ -93,12 +89,7 @@ if __name__ == '__main__':
     inits = init_func()
     readline.parse_and_bind('tab: self-insert')
 
-    last_csvw_write = datetime.datetime(2018,1,1)
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         state = State.WAITING
         ag3458a_high_speed(inits['ag3458a_2'])
         last_row = None
@@ -137,8 +128,4 @@ if __name__ == '__main__':
                     row['dut'] = device_name
                     row['dut_setting'] = dut_setting
                     csvw.writerow(row)
-                    if (datetime.datetime.utcnow() - last_csvw_write) \
-                            > datetime.timedelta(seconds=WRITE_INTERVAL_SECONDS):
-                        csv_file.flush()
-                        last_csvw_write = datetime.datetime.utcnow()
             last_row = row
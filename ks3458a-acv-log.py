@@ -3,20 +3,15 @@
 import ivi
 import time
 import datetime
-import csv
-import os
+
+from log_sink import open_log
 
 OUTPUT_FILE = 'ks3458a-acv-log.csv'
 SAMPLE_INTERVAL = 10
 FIELDNAMES = ('datetime', 'ag3458a_2_acv', 'temp_2', 'last_acal_2',
         'last_acal_2_cal72')
-WRITE_INTERVAL_SECONDS = 3600
 DEBUG = False
 
-if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
-
-
 def acal_3458a(ag3458a):
     ag3458a.acal.start_dcv()
     ag3458a.acal.start_ac()
@@ -80,16 +75,7 @@ def loop_func(csvw, ag3458a_2):
 if __name__ == '__main__':
     inits = init_func()
 
-    last_csvw_write = datetime.datetime(2018, 1, 1)
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         while True:
             loop_func(csvw, **inits)
             time.sleep(SAMPLE_INTERVAL)
-            if (datetime.datetime.utcnow() - last_csvw_write) \
-                    > datetime.timedelta(seconds=WRITE_INTERVAL_SECONDS):
-                csv_file.flush()
-                last_csvw_write = datetime.datetime.utcnow()
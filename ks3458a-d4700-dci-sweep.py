@@ -2,22 +2,19 @@
 
 import ivi
 import datetime
-import csv
-import os
 
-from common_step_execution import Step, DcCurrentDutSettings, DcCurrentCommand, run_procedure, check_valid_value
+from common_step_execution import Step, DcCurrentDutSettings, DcCurrentCommand, run_procedure, settings_snapshot, check_valid_value, wait_for_reading
+from log_sink import open_log
 
 OUTPUT_FILE = 'ks3458a-d4700-dci-sweep.csv'
 FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'ag3458a_2_value', 'temp_2', 'last_acal_2',
               'last_acal_2_cal72', '3458a_2_function', 'ag3458a_2_range')
-WRITE_INTERVAL_SECONDS = 3600
 SAMPLES_PER_STEP = 16
 STEP_SOAK_TIME = 60
 DEBUG = False
 
 
 if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
     STEP_SOAK_TIME = 6
     SAMPLES_PER_STEP = 4
 
@@ -54,11 +51,7 @@ procedure = [
 
 def main():
     inits = init_func()
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         run_procedure(csvw, procedure, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
 
 
@@ -97,11 +90,12 @@ def read_row(inits, instruments):
         ag3458a_2.measurement.read(360)
     else:
         ag3458a_2.measurement.initiate()
+        wait_for_reading(ag3458a_2)
         row['ag3458a_2_value'] = ag3458a_2.measurement.fetch(360)
         row['temp_2'] = None
         row['last_acal_2'] = ag3458a_2.last_acal.isoformat()
         row['last_acal_2_cal72'] = ag3458a_2.last_acal_cal72
-        row['ag3458a_2_range'] = ag3458a_2.range
+        row['ag3458a_2_range'] = settings_snapshot(ag3458a_2)['range']
         print(f"{row['ag3458a_2_value']}")
         check_valid_value(ag3458a_2, row['ag3458a_2_value'])
     return row, row['temp_2'] is None
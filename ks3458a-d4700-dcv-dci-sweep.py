@@ -2,10 +2,9 @@
 
 import ivi
 import datetime
-import csv
-import os
 
-from common_step_execution import Step, DcCurrentDutSettings, DcCurrentCommand, run_procedure, check_valid_value, DcVoltageDutSettings, DcVoltageCommand
+from common_step_execution import Step, DcCurrentDutSettings, DcCurrentCommand, run_procedure, settings_snapshot, check_valid_value, DcVoltageDutSettings, DcVoltageCommand, wait_for_reading
+from log_sink import open_log
 
 OUTPUT_FILE_DCV = 'ks3458a-d4700-dcv-sweep.csv'
 FIELDNAMES_DCV = ('datetime', 'dut', 'dut_setting', 'ag3458a_2_value', 'temp_2', 'last_acal_2',
@@ -13,14 +12,12 @@ FIELDNAMES_DCV = ('datetime', 'dut', 'dut_setting', 'ag3458a_2_value', 'temp_2',
 OUTPUT_FILE_DCI = 'ks3458a-d4700-dci-sweep.csv'
 FIELDNAMES_DCI = ('datetime', 'dut', 'dut_setting', 'ag3458a_2_value', 'temp_2', 'last_acal_2',
                   'last_acal_2_cal72', '3458a_2_function', 'ag3458a_2_range')
-WRITE_INTERVAL_SECONDS = 3600
 SAMPLES_PER_STEP = 16
 STEP_SOAK_TIME = 60
 DEBUG = False
 
 
 if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
     STEP_SOAK_TIME = 6
     SAMPLES_PER_STEP = 4
 
@@ -116,20 +113,11 @@ procedure_dci = [
 
 def main():
     inits = init_func()
-    with open(OUTPUT_FILE_DCV, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES_DCV)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE_DCV, FIELDNAMES_DCV) as csvw:
         run_procedure(csvw, procedure_dcv1, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
-    with open(OUTPUT_FILE_DCI, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES_DCI)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE_DCI, FIELDNAMES_DCI) as csvw:
         run_procedure(csvw, procedure_dci, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
-    with open(OUTPUT_FILE_DCV, 'a', newline='') as csv_file:
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES_DCV)
+    with open_log(OUTPUT_FILE_DCV, FIELDNAMES_DCV) as csvw:
         run_procedure(csvw, procedure_dcv2, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
 
 
@@ -168,11 +156,12 @@ def read_row(inits, instruments):
         ag3458a_2.measurement.read(360)
     else:
         ag3458a_2.measurement.initiate()
+        wait_for_reading(ag3458a_2)
         row['ag3458a_2_value'] = ag3458a_2.measurement.fetch(360)
         row['temp_2'] = None
         row['last_acal_2'] = ag3458a_2.last_acal.isoformat()
         row['last_acal_2_cal72'] = ag3458a_2.last_acal_cal72
-        row['ag3458a_2_range'] = ag3458a_2.range
+        row['ag3458a_2_range'] = settings_snapshot(ag3458a_2)['range']
         print(f"{row['ag3458a_2_value']}")
         check_valid_value(ag3458a_2, row['ag3458a_2_value'])
     return row, row['temp_2'] is None
@@ -3,21 +3,17 @@
 import ivi
 import time
 import datetime
-import csv
-import os
 import readline
 
+from log_sink import CsvSink
+
 OUTPUT_FILE = 'ks3458a-dcv-tc-log-w-acal.csv'
 SAMPLE_INTERVAL = 10
 FIELDNAMES = ('datetime', 'ag3458a_2_dcv', 'temp_2', 'last_acal_2', 'last_acal_2_cal72')
-WRITE_INTERVAL_SECONDS = 900
 STABLE_WAIT_TIME_SECONDS = 10
 
 DEBUG = False
 
-if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
-
 
 def acal_3458a(ag3458a, temp):
     ag3458a.acal.start_dcv()
@@ -77,16 +73,7 @@ if __name__ == '__main__':
     inits = init_func()
     readline.parse_and_bind('tab: self-insert')
 
-    last_csvw_write = datetime.datetime(2018,1,1)
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with CsvSink(OUTPUT_FILE, FIELDNAMES) as csvw:
         while True:
             loop_func(csvw, **inits)
             time.sleep(SAMPLE_INTERVAL)
-            if (datetime.datetime.utcnow() - last_csvw_write) \
-                    > datetime.timedelta(seconds=WRITE_INTERVAL_SECONDS):
-                csv_file.flush()
-                last_csvw_write = datetime.datetime.utcnow()
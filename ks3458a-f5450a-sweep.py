@@ -2,24 +2,28 @@
 
 import ivi
 import datetime
-import csv
-import os
 
-from common_step_execution import Step, Res4WDutSettings, FourWireResistanceCommand, run_procedure
+from common_step_execution import Step, Res4WDutSettings, FourWireResistanceCommand, run_procedure, settings_snapshot, read_burst_3458a, wait_for_reading
+from log_sink import open_log
 
-OUTPUT_FILE = 'ks3458a-f5450a-sweep.csv'
+# The burst reading column was added, a log with the old header is not appended to
+OUTPUT_FILE = 'ks3458a-f5450a-sweep-2.csv'
+# In burst mode datetime is the time of the burst trigger, and ag3458a_2_burst_reading the index of the reading in the burst
 FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'ag3458a_2_ohm', 'temp_2', 'last_acal_2',
-              'last_acal_2_cal72', '3458a_2_function', 'ag3458a_2_range', 'ag3458a_2_delay')
-WRITE_INTERVAL_SECONDS = 3600
+              'last_acal_2_cal72', '3458a_2_function', 'ag3458a_2_range', 'ag3458a_2_delay', 'ag3458a_2_burst_reading')
 SAMPLES_PER_STEP = 16
 STEP_SOAK_TIME = 60
+BURST_MODE = False
 DEBUG = False
+# Time of one reading: 100 PLC at 50 Hz, twice with offset compensation
+READING_TIME = 2 * 100 / 50
 
 
 if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
     STEP_SOAK_TIME = 6
     SAMPLES_PER_STEP = 4
+    # 10 PLC after reset, without offset compensation
+    READING_TIME = 10 / 50
 
 
 procedure = [
@@ -76,12 +80,9 @@ procedure = [
 
 def main():
     inits = init_func()
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
-        run_procedure(csvw, procedure, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
+        run_procedure(csvw, procedure, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME,
+                      read_burst=read_burst if BURST_MODE else None)
 
 
 def init_func():
@@ -121,16 +122,38 @@ def read_row(inits, instruments):
         ag3458a_2.measurement.read(360)
     else:
         ag3458a_2.measurement.initiate()
+        wait_for_reading(ag3458a_2)
         row['ag3458a_2_ohm'] = ag3458a_2.measurement.fetch(360)
         row['temp_2'] = None
         row['last_acal_2'] = ag3458a_2.last_acal.isoformat()
         row['last_acal_2_cal72'] = ag3458a_2.last_acal_cal72
-        row['ag3458a_2_range'] = ag3458a_2.range
-        row['ag3458a_2_delay'] = ag3458a_2.trigger.delay
+        ag3458a_2_settings = settings_snapshot(ag3458a_2)
+        row['ag3458a_2_range'] = ag3458a_2_settings['range']
+        row['ag3458a_2_delay'] = ag3458a_2_settings['trigger.delay']
         print(f"{row['ag3458a_2_ohm']}")
     return row, row['temp_2'] is None
 
 
+def read_burst(inits, instruments, count):
+    ag3458a_2 = inits['ag3458a_2']
+    rows = []
+    if ((datetime.datetime.utcnow() - ag3458a_2.last_temp).total_seconds()
+            > 30 * 60):
+        temp_2 = ag3458a_2.utility.temp
+        ag3458a_2.last_temp = datetime.datetime.utcnow()
+        rows.append(({'datetime': ag3458a_2.last_temp.isoformat(), 'temp_2': temp_2,
+                      'last_acal_2': ag3458a_2.last_acal.isoformat(), 'last_acal_2_cal72': ag3458a_2.last_acal_cal72}, False))
+    ag3458a_2_settings = settings_snapshot(ag3458a_2)
+    settings = {'last_acal_2': ag3458a_2.last_acal.isoformat(), 'last_acal_2_cal72': ag3458a_2.last_acal_cal72,
+                'ag3458a_2_range': ag3458a_2_settings['range'], 'ag3458a_2_delay': ag3458a_2_settings['trigger.delay']}
+    start = datetime.datetime.utcnow().isoformat()
+    values = read_burst_3458a(ag3458a_2, count, reading_time=READING_TIME)
+    for sample_no, value in enumerate(values.tolist(), 1):
+        rows.append((dict(settings, datetime=start, ag3458a_2_ohm=value, ag3458a_2_burst_reading=sample_no), True))
+        print(f"{sample_no:2d}: {value}")
+    return rows
+
+
 def acal_3458a(ag3458a):
     ag3458a.acal.start_dcv()
     ag3458a.acal.start_ohms()
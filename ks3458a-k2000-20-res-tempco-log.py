@@ -6,12 +6,16 @@ import sys
 from typing import List
 import ivi
 from quantiphy import Quantity
-import os
 from copy import deepcopy
 
-from common_step_execution import Dut, FourWireResistanceCommand, Instrument, Step2, Res4WDutSettings, Step3, StepInterrupted, TransferDirection, disable_manual_prompt_for_steps_with_same_dut, generate_resistance_transfer_steps, resistance_is_4w, Res2WDutSettings, run_procedure
+from common_step_execution import Dut, FourWireResistanceCommand, Instrument, Step2, Res4WDutSettings, Step3, StepInterrupted, TransferDirection, disable_manual_prompt_for_steps_with_same_dut, generate_resistance_transfer_steps, resistance_is_4w, Res2WDutSettings, run_procedure, settings_snapshot, ProcedureJournal, wait_for_reading, StepStatistics, STEP_STATISTICS_FIELDNAMES
+from log_sink import open_log
+from transfer_solver import TRANSFER_FIELDNAMES, print_solution, read_transfer_log, solve_transfer
 
 OUTPUT_FILE = 'ks3458a-k2000-20-res-tempco-log.csv'
+JOURNAL_FILE = 'ks3458a-k2000-20-res-tempco-log.journal'
+STEP_STATISTICS_FILE = 'ks3458a-k2000-20-res-tempco-log-steps.csv'
+TRANSFER_FILE = 'ks3458a-k2000-20-res-tempco-log-transfer.csv'
 FIELDNAMES = ('datetime', 'dut_setting', 'dut', 'ag3458a_2_ohm', 'ag3458a_2_range', 'ag3458a_2_delay', 'temp_2', 'last_acal_2',
               'last_acal_2_cal72', 'k2000_20_pt100_ohm')
 DEBUG = False
@@ -43,10 +47,13 @@ def main():
     parser = argparse.ArgumentParser(description='Transfer resistance from SR104 using F5450A and log tempco of resistor under test')
     parser.add_argument('dut', type=str)
     parser.add_argument('dut_value', type=float)
+    parser.add_argument('--resume', action='store_true', help='Resume an interrupted run at the step and sample recorded in the journal')
+    parser.add_argument('--solve', action='store_true', help=f'Reduce the transfers in {OUTPUT_FILE} to the value of the resistor under test per cycle instead of measuring')
+    parser.add_argument('--reference-value', type=float, help='Calibrated value of the SR104, 10 kOhm by default')
+    parser.add_argument('--reference-uncertainty', type=float, default=0.0, help='Standard uncertainty of the SR104 in Ohm')
 
     args = parser.parse_args()
 
-    inits = init_func()
     ag3458a = Instrument('ag3458a_2', FourWireResistanceCommand(range=args.dut_value))
     sr104_dut = Dut(name='SR104', setting='10 kOhm', dut_setting_cmd=Res4WDutSettings(value=10e3))
     f5450a_dut = Dut(name='Fluke 5450A', setting='', dut_setting_cmd=Res4WDutSettings())
@@ -58,21 +65,31 @@ def main():
     steps.append(subject_dut_step)
     end_steps = generate_resistance_transfer_steps(ag3458a, sr104_dut, f5450a_dut, subject_dut, TransferDirection.REVERSE)[1:]
     steps.extend(end_steps)
+    if args.solve:
+        solution = solve_transfer(steps, read_transfer_log(OUTPUT_FILE, 'ag3458a_2_ohm', 'ag3458a_2_range'), sr104_dut, subject_dut, args.reference_value,
+                                  args.reference_uncertainty, samples_per_step=SAMPLES_PER_STEP)
+        print_solution(solution)
+        with open(TRANSFER_FILE, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=TRANSFER_FIELDNAMES)
+            writer.writeheader()
+            writer.writerows(solution.rows())
+        return
     steps = disable_manual_prompt_for_steps_with_same_dut(deepcopy(steps))
     steps[0].manual_prompt = False
 
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    inits = init_func()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw, open_log(STEP_STATISTICS_FILE, STEP_STATISTICS_FIELDNAMES) as step_statistics_sink:
+        journal = ProcedureJournal(JOURNAL_FILE)
+        resume = args.resume
+        step_statistics = StepStatistics(step_statistics_sink)
         while True:
             try:
-                run_procedure(csvw, steps, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
+                run_procedure(csvw, steps, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME, journal=journal, resume=resume,
+                              step_statistics=step_statistics)
             except StepInterrupted as step_interrupted:
                 for instrument in steps[step_interrupted.step_number].instruments:
                     inits[instrument.name]._interface.clear()
-                steps = ask_user_for_procedure(step_interrupted.step_number, steps, start_steps, subject_dut_step, end_steps, inits)
+                steps, resume = ask_user_for_procedure(step_interrupted.step_number, steps, start_steps, subject_dut_step, end_steps, inits)
                 steps = disable_manual_prompt_for_steps_with_same_dut(deepcopy(steps))
             else:
                 break
@@ -94,23 +111,26 @@ def ask_user_for_procedure_subject_dut_step(step_number: int, steps: List[Step3]
         print('4. Repeat from the beginning')
         print('5. End the measurement')
         print('6. Measure reference resistor and continue')
+        print('7. Continue from the interrupted step and sample recorded in the journal')
 
-        response = input('Enter 0, 1, 2, 3, 4, 5 or 6: ')
+        response = input('Enter 0, 1, 2, 3, 4, 5, 6 or 7: ')
         if response == '0':
             sys.exit()
         elif response == '1':
-            return steps[step_number:]
+            return steps[step_number:], False
         elif response == '2':
             acal_3458a(inits[subject_dut_step.instruments[0].name], 'manual_acal')
-            return steps[step_number:]
+            return steps[step_number:], False
         elif response == '3':
-            return steps[step_number+1:]
+            return steps[step_number+1:], False
         elif response == '4':
-            return start_steps + [subject_dut_step] + end_steps
+            return start_steps + [subject_dut_step] + end_steps, False
         elif response == '5':
-            return end_steps
+            return end_steps, False
         elif response == '6':
-            return end_steps + start_steps[1:] + [subject_dut_step] + end_steps
+            return end_steps + start_steps[1:] + [subject_dut_step] + end_steps, False
+        elif response == '7':
+            return steps, True
 
 
 def ask_user_for_procedure_other_step(step_number: int, steps: List[Step3], start_steps: List[Step3], subject_dut_step: Step3, end_steps: List[Step3], inits: dict):
@@ -121,19 +141,22 @@ def ask_user_for_procedure_other_step(step_number: int, steps: List[Step3], star
         print('2. Run acal and continue from interrupted step')
         print('3. Continue from next step')
         print('4. Repeat from the beginning')
+        print('5. Continue from the interrupted step and sample recorded in the journal')
 
-        response = input('Enter 0, 1, 2, 3, or 4: ')
+        response = input('Enter 0, 1, 2, 3, 4 or 5: ')
         if response == '0':
             sys.exit()
         elif response == '1':
-            return steps[step_number:]
+            return steps[step_number:], False
         elif response == '2':
             acal_3458a(inits['ag3458a_2'], 'manual_acal')
-            return steps[step_number:]
+            return steps[step_number:], False
         elif response == '3':
-            return steps[step_number+1:]
+            return steps[step_number+1:], False
         elif response == '4':
-            return start_steps + [subject_dut_step] + end_steps
+            return start_steps + [subject_dut_step] + end_steps, False
+        elif response == '5':
+            return steps, True
 
 
 def step_equal_except_manual_prompt(step1: Step3, step2: Step3):
@@ -193,12 +216,14 @@ def read_row(inits, instruments: List[Instrument]):
         ag3458a_2.measurement.read(360)
     else:
         ag3458a_2.measurement.initiate()
+        wait_for_reading(ag3458a_2)
         row['ag3458a_2_ohm'] = ag3458a_2.measurement.fetch(360)
         row['temp_2'] = None
         row['last_acal_2'] = ag3458a_2.last_acal.isoformat()
         row['last_acal_2_cal72'] = ag3458a_2.last_acal_cal72
-        row['ag3458a_2_range'] = ag3458a_2.range
-        row['ag3458a_2_delay'] = ag3458a_2.trigger.delay
+        ag3458a_2_settings = settings_snapshot(ag3458a_2)
+        row['ag3458a_2_range'] = ag3458a_2_settings['range']
+        row['ag3458a_2_delay'] = ag3458a_2_settings['trigger.delay']
         row['k2000_20_pt100_ohm'] = k2000_20.measurement.fetch(1)
         print(f"{row['ag3458a_2_ohm']}")
     return row, row['temp_2'] is None
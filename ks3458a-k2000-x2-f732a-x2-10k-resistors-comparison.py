@@ -1,141 +1,156 @@
 #!/usr/bin/python3
 
+import argparse
 from typing import Dict, List
 import ivi
 from ivi import dmm
 import datetime
-import csv
-import os
 
-from common_step_execution import (Res4WDutSettings, DcVoltageDutSettings, FourWireResistanceCommand, DcVoltageCommand, run_procedure, Step4, Instrument, Dut)
+from common_step_execution import (Res4WDutSettings, DcVoltageDutSettings, FourWireResistanceCommand, DcVoltageCommand, run_procedure, settings_snapshot, Step3, Instrument, Dut, read_instruments_by_bus,
+                                   acal_cal72, instrument_busy, start_acal_3458a_in_background, ProcedureJournal, StepStatistics, STEP_STATISTICS_FIELDNAMES)
+from log_sink import open_log
 
-OUTPUT_FILE = 'ks3458a-k2000-x2-f732a-x2-10k-resistors-comparison.csv'
+# The trigger time columns were added, a log with the old header is not appended to
+OUTPUT_FILE = 'ks3458a-k2000-x2-f732a-x2-10k-resistors-comparison-2.csv'
+JOURNAL_FILE = 'ks3458a-k2000-x2-f732a-x2-10k-resistors-comparison.journal'
+STEP_STATISTICS_FILE = 'ks3458a-k2000-x2-f732a-x2-10k-resistors-comparison-steps.csv'
 FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'ag3458a_2_ohm_or_dcv', 'temp_2', 'last_acal_2',
               'last_acal_2_cal72', '3458a_2_function', 'ag3458a_2_range', 'ag3458a_2_delay',
-              'k2000_ohm', 'k2000_20_ohm')
-WRITE_INTERVAL_SECONDS = 3600
+              'k2000_ohm', 'k2000_20_ohm', 'ag3458a_2_trigger', 'k2000_trigger', 'k2000_20_trigger')
 SAMPLES_PER_STEP = 16
 STEP_SOAK_TIME = 60
+# The K2000s trigger continuously, unless they are armed for a bus trigger
+CONTINUOUS_METERS = ('k2000', 'k2000_20')
+# Start the readings of all meters in a row with a single GPIB GET, the K2000s are then armed for it too and returned to
+# continuous triggering after every row
+SYNCHRONISED_TRIGGER = True
 DEBUG = False
 
 
 if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
     STEP_SOAK_TIME = 6
     SAMPLES_PER_STEP = 4
 
 
+def comparison_step(duts: List[Dut], instruments: List[Instrument], manual_prompt: bool = False) -> Step3:
+    """
+    A step that measures a resistor on the K2000s and the resistor or the F732As on the 3458A at the same time. A step has a single dut, so the duts are logged as one, with their names and settings joined, and the first dut sets the function for the safe transition of the first instrument.
+    """
+    return Step3(Dut(' / '.join(dut.name for dut in duts), ' / '.join(dut.setting for dut in duts), duts[0].dut_setting_cmd), instruments, manual_prompt)
+
+
 procedure = [
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3, allow_acal=True))], True),
-    # Step4([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10, allow_acal=True))], True),
-    # Step4([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3, allow_acal=True))], True),
-    # Step4([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10, allow_acal=True))], True),
-    # Step4([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3, allow_acal=True))], True),
-    # Step4([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    # Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10, allow_acal=True))], True),
-    Step4([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    Step4([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3, allow_acal=True))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    Step4([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    Step4([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10, allow_acal=True))], True),
-    Step4([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3, allow_acal=True))], True),
-    Step4([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    Step4([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    Step4([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
-    Step4([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3, allow_acal=True))], True),
+    # comparison_step([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('Measurements International 9331', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10, allow_acal=True))], True),
+    # comparison_step([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3, allow_acal=True))], True),
+    # comparison_step([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('RTU-11k-02', '11 kOhm', Res4WDutSettings(range=11e3, value=11e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10, allow_acal=True))], True),
+    # comparison_step([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3, allow_acal=True))], True),
+    # comparison_step([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('UPW50-104b', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    # comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(13e3)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10, allow_acal=True))], True),
+    comparison_step([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    comparison_step([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3, allow_acal=True))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    comparison_step([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    comparison_step([Dut('Guildline 9330 s/n 45809', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10, allow_acal=True))], True),
+    comparison_step([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '+20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=-20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3)), Dut('F732a3+F732a2', '-20 V', DcVoltageDutSettings(value=20, range=20))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', DcVoltageCommand(10))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3, allow_acal=True))], True),
+    comparison_step([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    comparison_step([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    comparison_step([Dut('Guildline 9330 s/n 42709', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
+    comparison_step([Dut('SR104', '10 kOhm', Res4WDutSettings(range=10e3, value=10e3))], [Instrument('k2000', FourWireResistanceCommand(10e3)), Instrument('k2000_20', FourWireResistanceCommand(110)), Instrument('ag3458a_2', FourWireResistanceCommand(10e3))], True),
 ]
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Compare 10k resistors and F732A references using 3458A and K2000s')
+    parser.add_argument('--resume', action='store_true', help='Resume an interrupted run at the step and sample recorded in the journal')
+    args = parser.parse_args()
+
     inits = init_func()
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
-        run_procedure(csvw, procedure, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
+    with open_log(OUTPUT_FILE, FIELDNAMES, index=True) as csvw, open_log(STEP_STATISTICS_FILE, STEP_STATISTICS_FIELDNAMES) as step_statistics_sink:
+        run_procedure(csvw, procedure, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME, journal=ProcedureJournal(JOURNAL_FILE), resume=args.resume,
+                      step_statistics=StepStatistics(step_statistics_sink))
 
 
 def init_func():
@@ -157,7 +172,7 @@ def init_func():
         ag3458a_2.last_acal = datetime.datetime.utcnow()
         ag3458a_2.last_acal_temp = temp_2
         ag3458a_2.last_temp_value = temp_2
-        acal_3458a_2(ag3458a_2)
+        start_acal_3458a_in_background(ag3458a_2)
         # ag3458a_2.last_acal_cal72 = 'keep'
     k2000 = ivi.keithley.keithley2000("TCPIP::gpib1::gpib,16::INSTR",
             id_query=True)
@@ -175,64 +190,37 @@ def init_func():
     k2000_20._write(':FRES:NPLC 10')
     return {'ag3458a_2': ag3458a_2, 'k2000': k2000, 'k2000_20': k2000_20}
 
-def read_row(inits: Dict[str, dmm.Base], instruments: List[Instrument], **kwargs):
-    sample_no = kwargs['sample_no']
+def read_row(inits: Dict[str, dmm.Base], instruments: List[Instrument]):
     ag3458a_2 = inits['ag3458a_2']
-    k2000 = inits['k2000']
-    k2000_20 = inits['k2000_20']
     row = {}
     row['datetime'] = datetime.datetime.utcnow().isoformat()
-    ag3458a_2_instrument = ([instrument for instrument in instruments if instrument.name == 'ag3458a_2'] or [None])[0]
 
     if ((datetime.datetime.utcnow() - ag3458a_2.last_temp).total_seconds()
-            > 30 * 60):
+            > 30 * 60) and not instrument_busy(ag3458a_2):
         temp_2 = ag3458a_2.utility.temp
         ag3458a_2.last_temp = datetime.datetime.utcnow()
         ag3458a_2.last_temp_value = temp_2
         row['temp_2'] = temp_2
         row['last_acal_2'] = ag3458a_2.last_acal.isoformat()
-        row['last_acal_2_cal72'] = ag3458a_2.last_acal_cal72
-        ag3458a_2.measurement.initiate()
-        ag3458a_2.measurement.fetch(360)
-        acal_if_necessary(ag3458a_2, sample_no, ag3458a_2_instrument)
+        row['last_acal_2_cal72'] = acal_cal72(ag3458a_2)
+        read_instruments_by_bus(inits, ['ag3458a_2'], synchronised_trigger=SYNCHRONISED_TRIGGER)
     else:
-        acal_if_necessary(ag3458a_2, sample_no, ag3458a_2_instrument)
+        readings = read_instruments_by_bus(inits, instruments, fetch_only=() if SYNCHRONISED_TRIGGER else CONTINUOUS_METERS,
+                                           synchronised_trigger=SYNCHRONISED_TRIGGER)
         for instrument in instruments:
-            if instrument.name == 'ag3458a_2':
-                ag3458a_2.measurement.initiate()
-        row['k2000_ohm'] = None
-        row['k2000_20_ohm'] = None
-        row['ag3458a_2_ohm_or_dcv'] = None
-        for instrument in instruments:
-            if instrument.name == 'k2000':
-                row['k2000_ohm'] = k2000.measurement.fetch(1)
-            elif instrument.name == 'k2000_20':
-                row['k2000_20_ohm'] = k2000_20.measurement.fetch(1)
-            elif instrument.name == 'ag3458a_2':
-                row['ag3458a_2_ohm_or_dcv'] = ag3458a_2.measurement.fetch(360)
+            last_trigger = inits[instrument.name].last_trigger
+            row[f'{instrument.name}_trigger'] = last_trigger.isoformat() if last_trigger else None
+        row['k2000_ohm'] = readings.get('k2000')
+        row['k2000_20_ohm'] = readings.get('k2000_20')
+        row['ag3458a_2_ohm_or_dcv'] = readings.get('ag3458a_2')
         row['temp_2'] = None
         row['last_acal_2'] = ag3458a_2.last_acal.isoformat()
-        row['last_acal_2_cal72'] = ag3458a_2.last_acal_cal72
-        row['ag3458a_2_range'] = ag3458a_2.range
-        row['ag3458a_2_delay'] = ag3458a_2.trigger.delay
+        row['last_acal_2_cal72'] = acal_cal72(ag3458a_2)
+        ag3458a_2_settings = settings_snapshot(ag3458a_2)
+        row['ag3458a_2_range'] = ag3458a_2_settings['range']
+        row['ag3458a_2_delay'] = ag3458a_2_settings['trigger.delay']
         print(f"ag3458a_2: {row['ag3458a_2_ohm_or_dcv']}, k2000: {row['k2000_ohm']}, k2000_20: {row['k2000_20_ohm']}")
     return row, row['temp_2'] is None
 
-def acal_if_necessary(ag3458a_2, sample_no, ag3458a_2_instrument: Instrument):
-    if sample_no != 1:
-        return
-    do_acal_3458a_2 = False
-    print(f"ACAL if neccessary, last_acal_temp: {ag3458a_2.last_acal_temp}, last_temp_value: {ag3458a_2.last_temp_value}, ag3458a_2_instrument: {ag3458a_2_instrument}, allow_acal: {ag3458a_2_instrument.setting.allow_acal if ag3458a_2_instrument else None}")
-    if ((ag3458a_2_instrument is None) or ag3458a_2_instrument.setting.allow_acal) and (((datetime.datetime.utcnow() - ag3458a_2.last_acal).total_seconds() > 24 * 3600) \
-                or (abs(ag3458a_2.last_acal_temp - ag3458a_2.last_temp_value) >= 0.5)):
-        print(f"Running ACAL, last_acal_temp: {ag3458a_2.last_acal_temp}, last_temp_value: {ag3458a_2.last_temp_value}, ag3458a_2_instrument: {ag3458a_2_instrument}, allow_acal: {ag3458a_2_instrument.setting.allow_acal if ag3458a_2_instrument else None}")
-        do_acal_3458a_2 = True
-    if do_acal_3458a_2:
-        acal_3458a_2(ag3458a_2)
-
-def acal_3458a_2(ag3458a_2):
-    ag3458a_2.acal.start_dcv()
-    ag3458a_2.acal.start_ohms()
-
 if __name__ == '__main__':
     main()
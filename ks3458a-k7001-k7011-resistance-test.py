@@ -3,10 +3,9 @@
 import time
 import ivi
 import datetime
-import csv
-import os
 
-from common_step_execution import beep
+from common_step_execution import beep, wait_for_reading
+from log_sink import open_log
 
 OUTPUT_FILE = 'ks3458a-k7001-k7011-resistance-test.csv'
 FIELDNAMES = ('datetime', 'terminal', 'card', 'bank', 'channel1', 'channel2', 'ag3458a_2_ohm', 'temp_2', 'last_acal_2', 'last_acal_2_cal72')
@@ -59,6 +58,7 @@ def read_row(k7001, ag3458a_2):
         ag3458a_2.measurement.read(360)
     else:
         ag3458a_2.measurement.initiate()
+        wait_for_reading(ag3458a_2)
         row['ag3458a_2_ohm'] = ag3458a_2.measurement.fetch(360)
         row['temp_2'] = None
         row['last_acal_2'] = ag3458a_2.last_acal.isoformat()
@@ -70,13 +70,8 @@ def read_row(k7001, ag3458a_2):
 if __name__ == '__main__':
     inits = init_func()
     k7001 = inits['k7001']
-    last_csvw_write = datetime.datetime(2018, 1, 1)
     try:
-        with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-            initial_size = os.fstat(csv_file.fileno()).st_size
-            csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-            if initial_size == 0:
-                csvw.writeheader()
+        with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
             while True:
                 bank_names = ('A', 'B', 'C', 'D')
                 bank_offset = (0, 10, 20, 30)
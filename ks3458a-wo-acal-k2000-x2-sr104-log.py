@@ -1,21 +1,17 @@
 #!/usr/bin/python3
 
-import csv
 import datetime
 import ivi
 import time
-import os
+
+from log_sink import open_log
 
 OUTPUT_FILE = 'ks3458a-wo-acal-k2000-x2-sr104-log.csv'
 FIELDNAMES = ('datetime', 'ag3458a_2_ohm', 'ag3458a_2_range', 'ag3458a_2_delay', 'temp_2', 'last_acal_2',
               'last_acal_2_cal72', 'k2000_temp_ohm', 'k2000_20_pt100_ohm')
-WRITE_INTERVAL_SECONDS = 900
 DEBUG = False
 SAMPLE_INTERVAL = 0
 
-if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
-
 def acal_3458a(ag3458a, temp):
     ag3458a.acal.start_dcv()
     ag3458a.acal.start_ohms()
@@ -114,16 +110,7 @@ def loop_func(csvw, ag3458a_2, k2000, k2000_20):
 if __name__ == '__main__':
     inits = init_func()
 
-    last_csvw_write = datetime.datetime(2018, 1, 1)
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         while True:
             loop_func(csvw, **inits)
             time.sleep(SAMPLE_INTERVAL)
-            if (datetime.datetime.utcnow() - last_csvw_write) \
-                    > datetime.timedelta(seconds=WRITE_INTERVAL_SECONDS):
-                csv_file.flush()
-                last_csvw_write = datetime.datetime.utcnow()
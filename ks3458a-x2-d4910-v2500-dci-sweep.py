@@ -2,24 +2,21 @@
 
 import ivi
 import datetime
-import csv
-import os
 
-from common_step_execution import Step2, run_procedure, check_valid_value, DcCurrentCommand, Instrument, DcVoltageCommand, \
-    DcCurrentDutSettings
+from common_step_execution import Step2, run_procedure, settings_snapshot, check_valid_value, DcCurrentCommand, Instrument, DcVoltageCommand, \
+    DcCurrentDutSettings, wait_for_reading
+from log_sink import open_log
 
 OUTPUT_FILE = 'ks3458a-x2-d4910-v2500-dci-sweep.csv'
 FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'ag3458a_1_current', 'temp_1', 'last_acal_1',
               'last_acal_1_cal72', '3458a_1_function', 'ag3458a_1_range', 'ag3458a_2_voltage', 'temp_2', 'last_acal_2',
               'last_acal_2_cal72', '3458a_2_function', 'ag3458a_2_range')
-WRITE_INTERVAL_SECONDS = 3600
 SAMPLES_PER_STEP = 16
 STEP_SOAK_TIME = 60
 DEBUG = False
 
 
 if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
     STEP_SOAK_TIME = 6
     SAMPLES_PER_STEP = 4
 
@@ -60,11 +57,7 @@ procedure = [
 
 def main():
     inits = init_func()
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         run_procedure(csvw, procedure, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
 
 
@@ -102,7 +95,7 @@ def init_func():
     return {'ag3458a_1': ag3458a_1, 'ag3458a_2': ag3458a_2}
 
 
-def read_row(inits, retry_count=1):
+def read_row(inits, instruments):
     ag3458a_1 = inits['ag3458a_1']
     ag3458a_2 = inits['ag3458a_2']
     row = {}
@@ -121,21 +114,25 @@ def read_row(inits, retry_count=1):
         row['last_acal_2_cal72'] = ag3458a_2.last_acal_cal72
         ag3458a_1.measurement.initiate()
         ag3458a_2.measurement.initiate()
+        wait_for_reading(ag3458a_1)
         ag3458a_1.measurement.fetch(360)
+        wait_for_reading(ag3458a_2)
         ag3458a_2.measurement.fetch(360)
         return row, False
     ag3458a_1.measurement.initiate()
     ag3458a_2.measurement.initiate()
+    wait_for_reading(ag3458a_1)
     row['ag3458a_1_current'] = ag3458a_1.measurement.fetch(360)
     row['temp_1'] = None
     row['last_acal_1'] = ag3458a_1.last_acal.isoformat()
     row['last_acal_1_cal72'] = ag3458a_1.last_acal_cal72
-    row['ag3458a_1_range'] = ag3458a_1.range
+    row['ag3458a_1_range'] = settings_snapshot(ag3458a_1)['range']
+    wait_for_reading(ag3458a_2)
     row['ag3458a_2_voltage'] = ag3458a_2.measurement.fetch(360)
     row['temp_2'] = None
     row['last_acal_2'] = ag3458a_2.last_acal.isoformat()
     row['last_acal_2_cal72'] = ag3458a_2.last_acal_cal72
-    row['ag3458a_2_range'] = ag3458a_2.range
+    row['ag3458a_2_range'] = settings_snapshot(ag3458a_2)['range']
     print(f"{row['ag3458a_1_current']}", end='')
     print(f", ag3458a_2: {row['ag3458a_2_voltage']}")
     check_valid_value(ag3458a_1, row['ag3458a_1_current'])
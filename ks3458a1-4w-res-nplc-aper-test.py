@@ -3,20 +3,15 @@
 import ivi
 import time
 import datetime
-import csv
-import os
+
+from log_sink import open_log
 
 OUTPUT_FILE = 'ks3458a1-4w-res-nplc-aper-test.csv'
 FIELDNAMES = ('datetime', 'ag3458a_1_ohm', 'temp_1', 'last_acal_1',
               'last_acal_1_cal72', 'ag3458a_1_delay', 'ag3458a_1_range', 'ag3458a_1_aper_or_nplc')
-WRITE_INTERVAL_SECONDS = 3600
 DEBUG = False
 SWITCH_APER_NPLC_TIME = 3600
 
-if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
-
-
 def acal_3458a(ag3458a):
     ag3458a.acal.start_dcv()
     ag3458a.acal.start_ohms()
@@ -77,16 +72,11 @@ def loop_func(csvw, using_nplc, ag3458a_1):
 if __name__ == '__main__':
     inits = init_func()
 
-    last_csvw_write = datetime.datetime(2018,1,1)
     sample_no = 1
     inits['ag3458a_1']._write('NPLC 100')
     using_nplc = True
     last_switch_time = time.time()
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         while True:
             row = loop_func(csvw, using_nplc, **inits)
             print(f"{sample_no:3d}: {row['ag3458a_1_ohm']}")
@@ -99,7 +89,3 @@ if __name__ == '__main__':
                 else:
                     inits['ag3458a_1']._write('APER 1')
                 last_switch_time = time.time()
-            if (datetime.datetime.utcnow() - last_csvw_write) \
-                    > datetime.timedelta(seconds=WRITE_INTERVAL_SECONDS):
-                csv_file.flush()
-                last_csvw_write = datetime.datetime.utcnow()
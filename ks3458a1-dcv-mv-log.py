@@ -3,17 +3,16 @@
 import ivi
 import time
 import datetime
-import csv
-import os
 import readline
 from enum import Enum, auto
 from quantiphy import Quantity
 
+from log_sink import open_log
+
 OUTPUT_FILE = 'ks3458a1-dcv-mv-log.csv'
 SAMPLE_INTERVAL = 0
 FIELDNAMES = ('datetime', 'dut_neg_lead', 'dut_pos_lead', 'ag3458a_1_dcv', 'temp_1', 'last_acal_1',
         'last_acal_1_cal72')
-WRITE_INTERVAL_SECONDS = 3600
 STABLE_THRESHOLD = 1e-2  # Should be stable within 1%
 STABLE_WAIT_TIME_SECONDS = 10
 
@@ -23,10 +22,6 @@ class State(Enum):
     WAITING = auto()
     RECORDING = auto()
 
-if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
-
-
 def acal_3458a(ag3458a):
     ag3458a.acal.start_dcv()
     ag3458a.utility.display = 'on'
@@ -96,12 +91,7 @@ if __name__ == '__main__':
     inits = init_func()
     readline.parse_and_bind('tab: self-insert')
 
-    last_csvw_write = datetime.datetime(2018,1,1)
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         state = State.WAITING
         ag3458a_high_speed(inits['ag3458a_1'])
         last_row = None
@@ -135,8 +125,4 @@ if __name__ == '__main__':
                     row['dut_neg_lead'] = dut_neg_lead
                     row['dut_pos_lead'] = dut_pos_lead
                     csvw.writerow(row)
-                    if (datetime.datetime.utcnow() - last_csvw_write) \
-                            > datetime.timedelta(seconds=WRITE_INTERVAL_SECONDS):
-                        csv_file.flush()
-                        last_csvw_write = datetime.datetime.utcnow()
             last_row = row
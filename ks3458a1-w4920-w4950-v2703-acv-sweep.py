@@ -5,24 +5,22 @@ import time
 
 import ivi
 import datetime
-import csv
-import os
 
-from common_step_execution import (Step3, run_procedure, AcVoltageDutSettings, AcVoltageCommand, check_valid_value, Instrument, Dut)
+from common_step_execution import (Step3, run_procedure, settings_snapshot, AcVoltageDutSettings, AcVoltageCommand, check_valid_value, Instrument, Dut,
+                                   wait_for_reading)
+from log_sink import open_log
 
 OUTPUT_FILE = 'ks3458a1-w4920-w4950-v2703-acv-sweep.csv'
 FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'w4920_function', 'w4920_range', 'w4920_freq',
               'w4920_value', 'w4950_function', 'w4950_range', 'w4950_percentage', 'w4950_freq',
               'w4950_value', 'w4950_nsamples', 'w4950_std_abs', 'w4950_temp', 'ag3458a_1_value',
               'temp_1', 'last_acal_1', 'last_acal_1_cal72', '3458a_1_function', 'ag3458a_1_range')
-WRITE_INTERVAL_SECONDS = 3600
 SAMPLES_PER_STEP = 16
 STEP_SOAK_TIME = 60
 DEBUG = False
 
 
 if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
     STEP_SOAK_TIME = 6
     SAMPLES_PER_STEP = 4
 
@@ -95,11 +93,7 @@ procedure = [
 
 def main():
     inits = init_func()
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         run_procedure(csvw, procedure, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
 
 
@@ -186,7 +180,7 @@ def init_ag3458a(ag3458a_1, row):
 def read_ag3458a(ag3458a, row):
     row['last_acal_1'] = ag3458a.last_acal.isoformat()
     row['last_acal_1_cal72'] = ag3458a.last_acal_cal72
-    row['ag3458a_1_range'] = ag3458a.range
+    row['ag3458a_1_range'] = settings_snapshot(ag3458a)['range']
     value = ag3458a.measurement.read(360)
     if row['temp_1'] is None:
         row['ag3458a_1_value'] = value
@@ -202,14 +196,15 @@ def init_w4950(row, w4950):
 
 
 def read_w4950(row, w4950):
-    row['w4950_function'] = w4950.measurement_function
-    row['w4950_range'] = w4950.range
-    row['w4950_percentage'] = w4950.measurement.percentage
+    w4950_settings = settings_snapshot(w4950)
+    row['w4950_function'] = w4950_settings['measurement_function']
+    row['w4950_range'] = w4950_settings['range']
+    row['w4950_percentage'] = w4950_settings['measurement.percentage']
     row['w4950_value'] = w4950.measurement.fetch(60)
     row['w4950_nsamples'] = w4950.measurement.quality.nsamples
     row['w4950_std_abs'] = w4950.measurement.quality.absolute
     print(f"w4950: {row['w4950_value']}", end='')
-    if w4950.measurement_function in ('ac_volts', 'ac_current'):
+    if w4950_settings['measurement_function'] in ('ac_volts', 'ac_current'):
         row['w4950_freq'] = w4950.measurement.freq
         print(f", freq: {row['w4950_freq']}")
     else:
@@ -220,14 +215,16 @@ def read_w4950(row, w4950):
 
 def init_w4920(w4920, row):
     w4920.measurement.initiate()
+    w4920.last_initiate = time.monotonic()
 
 def read_w4920(w4920, row):
-    row['w4920_function'] = w4920.measurement_function
-    row['w4920_range'] = w4920.range
-    time.sleep(4)
+    w4920_settings = settings_snapshot(w4920)
+    row['w4920_function'] = w4920_settings['measurement_function']
+    row['w4920_range'] = w4920_settings['range']
+    wait_for_reading(w4920, started=w4920.last_initiate)
     row['w4920_value'] = w4920.measurement.fetch(0)
     print(f"w4920: {row['w4920_value']}", end='')
-    if w4920.measurement_function in ('ac_volts', 'ac_millivolts'):
+    if w4920_settings['measurement_function'] in ('ac_volts', 'ac_millivolts'):
         row['w4920_freq'] = w4920.measurement.freq
         print(f", freq: {row['w4920_freq']} Hz")
     else:
@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+import functools
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+LATENCY_STATS_ENV_VAR = 'LATENCY_STATS'
+DEFAULT_STATS_FILE = 'latency_stats.json'
+SNAPSHOT_INTERVAL = 60
+# Histogram buckets: values below 2^SUB_BUCKET_BITS microseconds have a bucket each, above that every power of two is
+# split in SUB_BUCKET_COUNT / 2 buckets, so a recorded latency is within 1/64 (1.6%) of its bucket.
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT // 2
+MAX_SHIFT = 34  # Up to 2^41 us, about 25 days
+BUCKET_COUNT = SUB_BUCKET_COUNT + MAX_SHIFT * SUB_BUCKET_HALF
+MAX_MICROSECONDS = (1 << (MAX_SHIFT + SUB_BUCKET_BITS)) - 1
+IO_METHODS = ('_write', '_ask', '_read', '_read_raw', '_write_raw', '_ask_raw', '_read_stb')
+MEASUREMENT_METHODS = ('fetch', 'read')
+
+
+def bucket_index(microseconds: int) -> int:
+    shift = microseconds.bit_length() - SUB_BUCKET_BITS
+    if shift <= 0:
+        return microseconds
+    return SUB_BUCKET_COUNT + (shift - 1) * SUB_BUCKET_HALF + (microseconds >> shift) - SUB_BUCKET_HALF
+
+
+def bucket_start(index: int) -> int:
+    if index < SUB_BUCKET_COUNT:
+        return index
+    shift, sub_bucket = divmod(index - SUB_BUCKET_COUNT, SUB_BUCKET_HALF)
+    return (sub_bucket + SUB_BUCKET_HALF) << (shift + 1)
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of latencies like HdrHistogram: a fixed number of buckets with a resolution of 1.6% from 1 us to weeks, so memory does not grow with the number of recorded values.
+    """
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds: float):
+        self.counts[bucket_index(min(max(int(seconds * 1e6), 0), MAX_MICROSECONDS))] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def value_at_percentile(self, percentile: float) -> Optional[float]:
+        """
+        The highest latency in seconds of the bucket holding the given percentile of the recorded values, so at most 1.6% more than the actual value.
+        """
+        if not self.count:
+            return None
+        target = max(1, percentile / 100 * self.count)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min((bucket_start(index + 1) - 1) / 1e6, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {'count': self.count, 'mean': self.total / self.count if self.count else None, 'min': self.min,
+                'p50': self.value_at_percentile(50), 'p90': self.value_at_percentile(90), 'p99': self.value_at_percentile(99), 'max': self.max}
+
+
+def command_header(data) -> str:
+    """
+    The command headers of a message without their parameters, e.g. 'FUNC;RANGE' for 'FUNC OHMF;RANGE 10000', to key the histograms by command instead of by every value sent.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode(errors='replace')
+    return ';'.join(re.split(r'[\s,]', command.strip(), maxsplit=1)[0] for command in str(data).split(';') if command.strip())
+
+
+class LatencyRecorder:
+    """
+    Records the latency of the I/O calls of the ivi drivers and the measurement fetch and read per instrument name and command. Instrumenting a session replaces its I/O methods by timed wrappers on the instance, so the driver itself is unchanged. A call costs two perf_counter calls and a histogram update, which is negligible next to a GPIB transaction.
+    """
+    def __init__(self, path: str = DEFAULT_STATS_FILE, interval: float = SNAPSHOT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self.lock = threading.Lock()
+        self.last_write = time.monotonic()
+
+    def histogram(self, name: str, command: str) -> LatencyHistogram:
+        key = (name, command)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def timed(self, name: str, operation: str, method, keyed_by_command=False):
+        @functools.wraps(method)
+        def timed_call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                command = f'{operation} {command_header(args[0])}' if keyed_by_command and args else operation
+                self.histogram(name, command).record(time.perf_counter() - start)
+        timed_call.latency_recorder = self
+        return timed_call
+
+    def instrument(self, session, name: str):
+        if getattr(getattr(session, '_write', None), 'latency_recorder', None) is self:
+            return
+        for operation in IO_METHODS:
+            method = getattr(session, operation, None)
+            if callable(method):
+                setattr(session, operation, self.timed(name, operation, method, keyed_by_command=operation in ('_write', '_ask')))
+        measurement = getattr(session, 'measurement', None)
+        for operation in MEASUREMENT_METHODS:
+            method = getattr(measurement, operation, None)
+            if callable(method):
+                try:
+                    setattr(measurement, operation, self.timed(name, f'measurement.{operation}', method))
+                except AttributeError:
+                    pass
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            items = sorted(self.histograms.items())
+        snapshot = {}
+        for (name, command), histogram in items:
+            snapshot.setdefault(name, {})[command] = histogram.summary()
+        return snapshot
+
+    def write(self):
+        self.last_write = time.monotonic()
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump({'time': time.time(), 'latencies': self.snapshot()}, f, indent=1)
+        os.replace(temporary_path, self.path)
+
+    def write_if_due(self):
+        if time.monotonic() - self.last_write >= self.interval:
+            self.write()
+
+    def print_summary(self):
+        print(f'{"instrument":12s} {"command":28s} {"count":>7s} {"mean":>9s} {"p50":>9s} {"p99":>9s} {"max":>9s} ms')
+        for name, commands in self.snapshot().items():
+            for command, summary in commands.items():
+                print(f'{name:12s} {command:28s} {summary["count"]:7d} ' +
+                      ' '.join(f'{summary[key] * 1e3:9.3f}' for key in ('mean', 'p50', 'p99', 'max')))
+
+
+_recorder: Optional[LatencyRecorder] = None
+
+
+def install(recorder: Optional[LatencyRecorder] = None) -> LatencyRecorder:
+    global _recorder
+    _recorder = recorder or LatencyRecorder()
+    return _recorder
+
+
+def uninstall():
+    global _recorder
+    _recorder = None
+
+
+def install_if_enabled(environ=None) -> Optional[LatencyRecorder]:
+    """
+    Records latencies when LATENCY_STATS is set: to 1 for latency_stats.json, or to the path of the stats file.
+    """
+    value = (os.environ if environ is None else environ).get(LATENCY_STATS_ENV_VAR, '').strip()
+    if value.lower() in ('', '0', 'off', 'false', 'no'):
+        return None
+    return install(LatencyRecorder(DEFAULT_STATS_FILE if value.lower() in ('1', 'on', 'true', 'yes') else value))
+
+
+def get_recorder() -> Optional[LatencyRecorder]:
+    return _recorder
+
+
+def instrument_sessions(inits):
+    if _recorder is not None:
+        for name, session in inits.items():
+            _recorder.instrument(session, name)
+
+
+def write_if_due():
+    if _recorder is not None:
+        _recorder.write_if_due()
+
+
+def finish():
+    """
+    Writes the final snapshot and prints the latencies, at the end of a procedure.
+    """
+    if _recorder is not None and _recorder.histograms:
+        _recorder.write()
+        _recorder.print_summary()
@@ -0,0 +1,418 @@
+#!/usr/bin/python3
+import csv
+import datetime
+import io
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+PARQUET_ROW_GROUP_SIZE = 4096
+# Row groups per Parquet file, a file is only readable once it is closed
+PARQUET_FILE_ROW_GROUPS = 1
+COMMIT_INTERVAL_SECONDS = 1.0
+COMMIT_ROWS = 100
+INDEX_SUFFIX = '.idx'
+INDEX_FIELDNAMES = ('dut', 'dut_setting', 'function', 'hour', 'start', 'end', 'rows')
+STRING_FIELDS = {'dut', 'dut_setting', 'dut_neg_lead', 'dut_pos_lead', 'bank', 'cable', 'card', 'channel1', 'channel2', 'column',
+                 'guard_setting', 'measurement_unit', 'setting', 'terminal', 'test_instrument'}
+
+
+def field_kind(fieldname: str) -> str:
+    """
+    Returns 'timestamp', 'string' or 'float' for a column of one of our logs, based on the naming used in the FIELDNAMES of the scripts.
+    """
+    if fieldname == 'datetime' or re.fullmatch(r'last_acal_\d+', fieldname) or fieldname.endswith('_trigger'):
+        return 'timestamp'
+    if fieldname in STRING_FIELDS or fieldname.endswith('_function') or fieldname.endswith('_cal72'):
+        return 'string'
+    return 'float'
+
+
+def is_number(value) -> bool:
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, (int, float)):
+        return True
+    try:
+        float(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def infer_field_kinds(fieldnames: Sequence[str], rows: Sequence[Dict] = ()) -> Dict[str, str]:
+    """
+    Infers the kind of every column from its name, falling back to string for a float column that contains text in rows.
+    """
+    kinds = {}
+    for fieldname in fieldnames:
+        kind = field_kind(fieldname)
+        if kind == 'float' and not all(is_number(row.get(fieldname)) for row in rows if row.get(fieldname) not in (None, '')):
+            kind = 'string'
+        kinds[fieldname] = kind
+    return kinds
+
+
+def convert_value(kind: str, value):
+    if value in (None, ''):
+        return None
+    if kind == 'timestamp':
+        return value if isinstance(value, datetime.datetime) else datetime.datetime.fromisoformat(value)
+    if kind == 'float':
+        return float(value)
+    return str(value)
+
+
+def truncate_torn_record(path: str) -> int:
+    """
+    Removes a partially written last line, e.g. after a power cut in the middle of a write, so appended rows don't get glued to it. Returns the number of bytes removed.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            chunk = f.read(end - start)
+            newline = chunk.rfind(b'\n')
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        if end != size:
+            f.truncate(end)
+            os.fsync(f.fileno())
+    if end != size:
+        print(f'Removed torn last record ({size - end} bytes) from {path}')
+    return size - end
+
+
+def read_header(path: str) -> List[str]:
+    """
+    The fieldnames in the header of a CSV log, empty if it doesn't exist or is empty.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, newline='') as f:
+        return next(csv.reader(f), [])
+
+
+@dataclass
+class IndexBlock:
+    """
+    A run of consecutive rows of a log with the same dut, dut_setting, instrument functions and hour, as the byte range [start, end) of the log.
+    """
+    dut: str
+    dut_setting: str
+    function: str
+    hour: str
+    start: int
+    end: int
+    rows: int
+
+    @property
+    def key(self) -> Tuple[str, str, str, str]:
+        return self.dut, self.dut_setting, self.function, self.hour
+
+
+def parse_csv_line(line: bytes) -> List[str]:
+    return next(csv.reader([line.decode()]), [])
+
+
+class LogIndex:
+    """
+    Sidecar index of an append-only CSV log in path + INDEX_SUFFIX, so the rows of a dut, setting, instrument function or time range can be read by seeking to their blocks instead of scanning the whole log.
+
+    The index is a CSV of IndexBlocks: a block per run of rows with the same dut, dut_setting, values of the *_function columns and hour of the datetime column. A step of a procedure gives one block per hour, temperature and ACAL rows (without dut) a block of their own. update() only scans the rows appended since the end of the last block and appends their blocks to the sidecar, a torn last row is left for the next update. A log that became shorter than the index is reindexed from the start.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.blocks: List[IndexBlock] = []
+        if os.path.exists(self.index_path):
+            truncate_torn_record(self.index_path)
+            with open(self.index_path, newline='') as f:
+                self.blocks = [IndexBlock(row['dut'], row['dut_setting'], row['function'], row['hour'], int(row['start']), int(row['end']), int(row['rows']))
+                               for row in csv.DictReader(f)]
+
+    @property
+    def end(self) -> int:
+        return self.blocks[-1].end if self.blocks else 0
+
+    def scan(self, offset: int) -> List[IndexBlock]:
+        blocks: List[IndexBlock] = []
+        with open(self.path, 'rb') as f:
+            fieldnames = parse_csv_line(f.readline())
+            position = max(offset, f.tell())
+            f.seek(position)
+            columns = {fieldname: index for index, fieldname in enumerate(fieldnames)}
+            function_columns = [index for fieldname, index in columns.items() if fieldname.endswith('_function')]
+
+            def column(values: List[str], fieldname: str) -> str:
+                index = columns.get(fieldname)
+                return values[index] if index is not None and index < len(values) else ''
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                values = parse_csv_line(line)
+                key = (column(values, 'dut'), column(values, 'dut_setting'),
+                       '|'.join(values[index] for index in function_columns if index < len(values)), column(values, 'datetime')[:13])
+                if blocks and blocks[-1].key == key:
+                    blocks[-1].end += len(line)
+                    blocks[-1].rows += 1
+                else:
+                    blocks.append(IndexBlock(*key, position, position + len(line), 1))
+                position += len(line)
+        return blocks
+
+    def update(self) -> List[IndexBlock]:
+        """
+        Indexes the rows appended since the last update and returns their blocks.
+        """
+        if not os.path.exists(self.path):
+            return []
+        if self.end > os.path.getsize(self.path):
+            print(f'{self.path} is shorter than its index, reindexing')
+            self.blocks = []
+            os.remove(self.index_path)
+        blocks = self.scan(self.end)
+        if blocks:
+            new_index = not os.path.exists(self.index_path)
+            with open(self.index_path, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=INDEX_FIELDNAMES)
+                if new_index:
+                    writer.writeheader()
+                writer.writerows(vars(block) for block in blocks)
+            self.blocks.extend(blocks)
+        return blocks
+
+    def find(self, dut: Optional[str] = None, dut_setting: Optional[str] = None, function: Optional[str] = None,
+             start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None) -> List[Tuple[int, int]]:
+        """
+        The byte ranges of the blocks that can contain rows matching all given filters, with adjacent blocks merged. The time range is matched by hour, rows in [start, end) are selected by rows().
+        """
+        start_hour = start.isoformat()[:13] if start else None
+        end_hour = end.isoformat()[:13] if end else None
+        ranges: List[Tuple[int, int]] = []
+        for block in self.blocks:
+            if ((dut is not None and block.dut != dut) or (dut_setting is not None and block.dut_setting != dut_setting)
+                    or (function is not None and function not in block.function.split('|'))
+                    or (start_hour is not None and block.hour < start_hour) or (end_hour is not None and block.hour > end_hour)):
+                continue
+            if ranges and ranges[-1][1] == block.start:
+                ranges[-1] = (ranges[-1][0], block.end)
+            else:
+                ranges.append((block.start, block.end))
+        return ranges
+
+    def rows(self, dut: Optional[str] = None, dut_setting: Optional[str] = None, function: Optional[str] = None,
+             start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None) -> Iterator[Dict[str, str]]:
+        """
+        The rows of the log matching all given filters, read by seeking to the blocks found by find() after updating the index.
+        """
+        self.update()
+        with open(self.path, 'rb') as f:
+            fieldnames = parse_csv_line(f.readline())
+            function_columns = [fieldname for fieldname in fieldnames if fieldname.endswith('_function')]
+            for block_start, block_end in self.find(dut, dut_setting, function, start, end):
+                f.seek(block_start)
+                for row in csv.DictReader(io.StringIO(f.read(block_end - block_start).decode(), newline=''), fieldnames=fieldnames):
+                    if ((dut is not None and row.get('dut') != dut) or (dut_setting is not None and row.get('dut_setting') != dut_setting)
+                            or (function is not None and function not in [row.get(column) for column in function_columns])):
+                        continue
+                    if start or end:
+                        timestamp = datetime.datetime.fromisoformat(row['datetime']) if row.get('datetime') else None
+                        if timestamp is None or (start and timestamp < start) or (end and timestamp >= end):
+                            continue
+                    yield row
+
+
+class CsvSink:
+    """
+    The append-only CSV log all scripts use, made crash safe: rows are group committed with a single write and fsync once commit_rows rows are pending or commit_interval seconds after the first pending row, whichever comes first. This costs a bounded number of syscalls per second instead of one per row, and loses at most commit_interval seconds of rows on a crash. A torn last record from an earlier crash is removed when the log is opened, and the header is only written to a new file. An existing log with other fieldnames is refused with a ValueError, as rows appended under the wrong header would be misread; change the output file when the fieldnames of a script change.
+
+    With index, the sidecar LogIndex of the log is updated after every commit. rows_written counts the rows passed to writerow and rows_committed those of them that are on disk, the callbacks registered with on_commit are called with rows_committed after every commit, e.g. so a ProcedureJournal only records samples that are on disk.
+    """
+    def __init__(self, path: str, fieldnames: Sequence[str], commit_interval: float = COMMIT_INTERVAL_SECONDS, commit_rows: int = COMMIT_ROWS,
+                 index: bool = False):
+        truncate_torn_record(path)
+        header = read_header(path)
+        if header and header != list(fieldnames):
+            raise ValueError(f'{path} has fieldnames {header}, not {list(fieldnames)}, log to a new file')
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.buffer = io.StringIO()
+        self.writer = csv.DictWriter(self.buffer, fieldnames=fieldnames)
+        self.commit_interval = commit_interval
+        self.commit_rows = commit_rows
+        self.pending_rows = 0
+        self.lock = threading.RLock()
+        self.timer: Optional[threading.Timer] = None
+        self.index = LogIndex(path) if index else None
+        self.rows_written = 0
+        self.rows_committed = 0
+        self.commit_callbacks: List[Callable[[int], None]] = []
+        if os.fstat(self.fd).st_size == 0:
+            self.writer.writeheader()
+            self.flush()
+        elif self.index:
+            self.index.update()
+
+    def writerow(self, row: Dict):
+        with self.lock:
+            self.writer.writerow(row)
+            self.rows_written += 1
+            self.pending_rows += 1
+            if self.pending_rows >= self.commit_rows:
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.commit_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            data = self.buffer.getvalue().encode()
+            if not data:
+                return
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self.fd, view):]
+            os.fsync(self.fd)
+            self.buffer.seek(0)
+            self.buffer.truncate()
+            self.rows_committed += self.pending_rows
+            self.pending_rows = 0
+            if self.index:
+                self.index.update()
+            for callback in self.commit_callbacks:
+                callback(self.rows_committed)
+
+    def on_commit(self, callback: Callable[[int], None]):
+        with self.lock:
+            if callback not in self.commit_callbacks:
+                self.commit_callbacks.append(callback)
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ParquetSink:
+    """
+    Buffers rows and writes them as typed row groups to Parquet, so a log reloads as columns instead of being parsed as text.
+
+    A Parquet file is only readable once its footer is written and cannot be appended to afterwards, so path is a directory (a Parquet dataset) of part files. Rows are written as a row group every row_group_size rows, and a part file is closed after file_row_groups row groups, on flush() and at the end of the run, so a crash only loses the rows of the part file being written. The buffered rows are lost too, use a CsvSink where every row counts and compact it later (see compact_logs.py).
+
+    Column types are fixed from the fieldnames with field_kind: the datetime columns become timestamps, measurements float64 and the rest dictionary-encoded strings. Empty values, like the measurement columns of temperature/ACAL rows, become nulls, and so do values that don't fit their column, like OVLD in a measurement column.
+
+    Like for CsvSink, rows_committed counts the rows in closed part files and the on_commit callbacks are called with it whenever a part file is closed.
+    """
+    def __init__(self, path: str, fieldnames: Sequence[str], row_group_size: int = PARQUET_ROW_GROUP_SIZE, file_row_groups: int = PARQUET_FILE_ROW_GROUPS):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError('ParquetSink requires pyarrow, install it with: pip install pyarrow') from e
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.fieldnames = tuple(fieldnames)
+        self.row_group_size = row_group_size
+        self.file_row_groups = file_row_groups
+        self.rows: List[Dict] = []
+        self.rows_written = 0
+        self.rows_committed = 0
+        self.file_rows = 0
+        self.commit_callbacks: List[Callable[[int], None]] = []
+        self.kinds = {fieldname: field_kind(fieldname) for fieldname in self.fieldnames}
+        self.schema = self.pa.schema([(fieldname, self.arrow_type(kind)) for fieldname, kind in self.kinds.items()])
+        self.writer = None
+        self.file_number = 0
+        self.file_row_group_count = 0
+        self.run_name = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        os.makedirs(path, exist_ok=True)
+
+    def arrow_type(self, kind: str):
+        if kind == 'timestamp':
+            return self.pa.timestamp('us')
+        if kind == 'float':
+            return self.pa.float64()
+        return self.pa.dictionary(self.pa.int32(), self.pa.string())
+
+    def convert(self, fieldname: str, value):
+        try:
+            return convert_value(self.kinds[fieldname], value)
+        except (TypeError, ValueError):
+            print(f'Writing {value!r} in {self.kinds[fieldname]} column {fieldname} as null')
+            return None
+
+    def writerow(self, row: Dict):
+        self.rows.append(row)
+        self.rows_written += 1
+        if len(self.rows) >= self.row_group_size:
+            self.write_row_group()
+
+    def write_row_group(self):
+        if not self.rows:
+            return
+        if self.writer is None:
+            self.file_number += 1
+            file_path = os.path.join(self.path, f'{self.run_name}-{self.file_number:04d}.parquet')
+            self.writer = self.pq.ParquetWriter(file_path, self.schema)
+        columns = {fieldname: [self.convert(fieldname, row.get(fieldname)) for row in self.rows] for fieldname in self.fieldnames}
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+        self.file_rows += len(self.rows)
+        self.rows = []
+        self.file_row_group_count += 1
+        if self.file_row_group_count >= self.file_row_groups:
+            self.close_file()
+
+    def close_file(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.file_row_group_count = 0
+            self.rows_committed += self.file_rows
+            self.file_rows = 0
+            for callback in self.commit_callbacks:
+                callback(self.rows_committed)
+
+    def on_commit(self, callback: Callable[[int], None]):
+        if callback not in self.commit_callbacks:
+            self.commit_callbacks.append(callback)
+
+    def flush(self):
+        self.write_row_group()
+        self.close_file()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_log(path: str, fieldnames: Sequence[str], index: bool = False):
+    """
+    Opens the log sink for path, a ParquetSink for a path ending in .parquet and a CsvSink otherwise. Sinks can be passed anywhere a csv.DictWriter is used, e.g. as csvw to run_procedure. index keeps a LogIndex of a CSV log, Parquet files have their own column statistics.
+    """
+    if path.endswith('.parquet'):
+        return ParquetSink(path, fieldnames)
+    return CsvSink(path, fieldnames, index=index)
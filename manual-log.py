@@ -3,11 +3,11 @@
 import ivi
 import time
 import datetime
-import csv
-import os
 import readline
 from enum import Enum, auto
 
+from log_sink import open_log
+
 OUTPUT_FILE = 'manual-log.csv'
 FIELDNAMES = ('datetime', 'test_instrument', 'setting', 'measurement_unit', 'dut', 'dut_setting', 'value')
 
@@ -31,12 +31,7 @@ if __name__ == '__main__':
     inits = init_func()
     readline.parse_and_bind('tab: self-insert')
 
-    last_csvw_write = datetime.datetime(2018, 1, 1)
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         setting = None
         dut = None
         dut_setting = None
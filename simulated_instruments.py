@@ -0,0 +1,469 @@
+#!/usr/bin/python3
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import types
+from collections import deque
+from dataclasses import dataclass, field, fields
+from typing import Callable, Dict, List, Optional, Tuple
+
+import ivi
+import numpy
+
+SIMULATION_ENV_VAR = 'INSTRUMENT_SIMULATION'
+COMMAND_HISTORY = 1000
+OVERLOAD_VALUE = 9.9e37
+
+
+@dataclass
+class SimulationConfig:
+    """
+    Timing and signal model of the simulated instruments. Times are in seconds, noise and drift are relative to the reading.
+
+    clock and sleep can be replaced by a virtual clock, so a long procedure can be run in no time while still accounting for the time it would take on the bench.
+    """
+    integration_time: float = 0.02
+    gpib_latency: float = 0.001
+    noise_ppm: float = 1.0
+    drift_ppm_per_hour: float = 0.0
+    settle_ppm: float = 0.0
+    settle_time_constant: float = 60.0
+    temperature: float = 36.0
+    temperature_drift_per_hour: float = 0.0
+    acal_time: float = 0.0
+    seed: Optional[int] = None
+    clock: Callable[[], float] = field(default=time.monotonic, repr=False)
+    sleep: Callable[[float], None] = field(default=time.sleep, repr=False)
+
+    @classmethod
+    def from_env(cls, value: str) -> 'SimulationConfig':
+        """
+        Parses the value of INSTRUMENT_SIMULATION: 1 for the defaults, or comma separated settings such as integration_time=0.1,noise_ppm=2.
+        """
+        config = cls()
+        if value.strip().lower() in ('1', 'on', 'true', 'yes'):
+            return config
+        numeric_fields = {f.name for f in fields(cls) if f.name not in ('clock', 'sleep')}
+        for setting in filter(None, (s.strip() for s in value.split(','))):
+            name, _, setting_value = setting.partition('=')
+            name = name.strip()
+            if name not in numeric_fields:
+                raise ValueError(f'Unknown {SIMULATION_ENV_VAR} setting {name}, expected one of {", ".join(sorted(numeric_fields))}')
+            setattr(config, name, int(setting_value) if name == 'seed' else float(setting_value))
+        return config
+
+
+class SimulatedBench:
+    """
+    State shared by all simulated instruments of a run: the clock, the source that is connected to the meters and the GPIB transaction count.
+
+    A meter reads the output of the last enabled source, or its own range when no source is enabled (a passive standard such as an SR104 is measured on a range matching its value). Every setting change on the bench restarts the exponential settling of the readings.
+    """
+    def __init__(self, config: SimulationConfig):
+        self.config = config
+        self.start_time = config.clock()
+        self.last_change = self.start_time
+        self.sources: List['SimulatedSource'] = []
+        self.transactions = 0
+        self.random = random.Random(config.seed)
+        self.lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return self.config.clock() - self.start_time
+
+    def transaction(self):
+        with self.lock:
+            self.transactions += 1
+        if self.config.gpib_latency:
+            self.config.sleep(self.config.gpib_latency)
+
+    def wait_until(self, deadline: float):
+        remaining = deadline - self.config.clock()
+        if remaining > 0:
+            self.config.sleep(remaining)
+
+    def disturb(self):
+        self.last_change = self.config.clock()
+
+    def temperature(self) -> float:
+        return self.config.temperature + self.config.temperature_drift_per_hour * self.elapsed() / 3600
+
+    def enabled_source(self) -> Optional['SimulatedSource']:
+        for source in reversed(self.sources):
+            if source.output_value() is not None:
+                return source
+        return None
+
+    def reading(self, nominal: float) -> float:
+        config = self.config
+        settling = config.settle_ppm * math.exp(-(config.clock() - self.last_change) / config.settle_time_constant) if config.settle_time_constant else 0
+        relative_error = (config.drift_ppm_per_hour * self.elapsed() / 3600 + settling) * 1e-6
+        with self.lock:
+            noise = self.random.gauss(0, config.noise_ppm * 1e-6)
+        # Zero readings still get the noise of the range instead of none at all
+        return nominal * (1 + relative_error) + noise * (abs(nominal) or 1)
+
+
+_bench: Optional[SimulatedBench] = None
+_original_drivers: Dict[Tuple[str, str], object] = {}
+
+
+def get_bench() -> SimulatedBench:
+    global _bench
+    if _bench is None:
+        _bench = SimulatedBench(SimulationConfig())
+    return _bench
+
+
+class SimulatedInterface:
+    def __init__(self, name: str):
+        self.name = name
+        self.timeout = 10
+
+    def clear(self):
+        pass
+
+
+class SimulatedSettings:
+    """
+    Group of driver settings such as advanced or trigger. Setting one costs a GPIB write like in the driver, reading one is answered from the driver cache.
+    """
+    def __init__(self, instrument: 'SimulatedInstrument', **settings):
+        object.__setattr__(self, '_instrument', instrument)
+        self.__dict__.update(settings)
+
+    def __setattr__(self, name, value):
+        self._instrument._write(f'{name} {value}')
+        self.__dict__[name] = value
+
+
+class SimulatedInstrument:
+    """
+    Base of the simulated drivers, constructed like the ivi drivers. Setting one of SETTINGS costs a GPIB transaction, other attributes (last_acal, background_job, ...) are plain attributes like on the driver.
+    """
+    SETTINGS: Tuple[str, ...] = ()
+
+    def __init__(self, resource: str = '', id_query=False, reset=False, bench: Optional[SimulatedBench] = None, **kwargs):
+        self._bench = bench or get_bench()
+        self._interface = SimulatedInterface(resource)
+        self._transactions = 0
+        self.commands = deque(maxlen=COMMAND_HISTORY)
+        if reset:
+            self._write('RESET')
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self._interface.name}>'
+
+    def __setattr__(self, name, value):
+        if name in self.SETTINGS:
+            self._write(f'{name} {value}')
+            self._bench.disturb()
+        object.__setattr__(self, name, value)
+
+    def _transaction(self):
+        self._transactions += 1
+        self._bench.transaction()
+
+    def _write(self, data: str):
+        self._transaction()
+        self.commands.append(data)
+        self._handle_write(data)
+
+    def _ask(self, data: str) -> str:
+        self._transaction()
+        self.commands.append(data)
+        return self._handle_query(data)
+
+    def _read_raw(self, num=-1) -> bytes:
+        self._transaction()
+        return self._handle_read_raw(num)
+
+    def _read_stb(self) -> int:
+        self._transaction()
+        return self._status_byte()
+
+    def _clear(self):
+        self._transaction()
+        self._interface.clear()
+
+    def _trigger(self):
+        self._transaction()
+        self._handle_trigger()
+
+    def _handle_write(self, data: str):
+        pass
+
+    def _handle_query(self, data: str) -> str:
+        return ''
+
+    def _handle_read_raw(self, num) -> bytes:
+        return b''
+
+    def _handle_trigger(self):
+        pass
+
+    def _status_byte(self) -> int:
+        return 0
+
+
+class SimulatedMeasurement:
+    def __init__(self, meter: 'SimulatedMeter'):
+        self._meter = meter
+        self._trigger_time: Optional[float] = None
+        self.percentage = 100
+        self.quality = types.SimpleNamespace(nsamples=1, absolute=0.0)
+        self.temp = types.SimpleNamespace(internal=meter._bench.config.temperature)
+
+    def initiate(self):
+        self._meter._write('INIT')
+        self._trigger_time = self._meter._bench.config.clock()
+
+    def fetch(self, max_time):
+        if self._trigger_time is None:
+            self.initiate()
+        self._meter._bench.wait_until(self._trigger_time + self._meter._integration_time())
+        self._trigger_time = None
+        return float(self._meter._ask('FETCH?'))
+
+    def read(self, max_time):
+        self.initiate()
+        return self.fetch(max_time)
+
+    def ready(self) -> bool:
+        return self._trigger_time is not None and self._meter._bench.config.clock() >= self._trigger_time + self._meter._integration_time()
+
+    @property
+    def freq(self) -> float:
+        return float(self._meter._ask('FREQ?'))
+
+    def measure_gain(self):
+        self.read(0)
+
+    def is_over_range(self, value) -> bool:
+        return value is None or value >= OVERLOAD_VALUE
+
+    def is_under_range(self, value) -> bool:
+        return value is None or value <= -OVERLOAD_VALUE
+
+
+class SimulatedMeter(SimulatedInstrument):
+    SETTINGS = ('measurement_function', 'range', 'auto_range')
+    # Status byte bit of the driver that is set while a reading is ready to be fetched
+    READY_STATUS = 0
+
+    def __init__(self, resource: str = '', id_query=False, reset=False, bench: Optional[SimulatedBench] = None, **kwargs):
+        super().__init__(resource, id_query, reset, bench, **kwargs)
+        object.__setattr__(self, 'measurement_function', 'dc_volts')
+        object.__setattr__(self, 'range', 10.0)
+        object.__setattr__(self, 'auto_range', 'off')
+        self.measurement = SimulatedMeasurement(self)
+        self.trigger = SimulatedSettings(self, delay=0.0, count=1)
+        self.advanced = SimulatedSettings(self, aperture_time=10, offset_compensation='off')
+        self.ac = SimulatedSettings(self, frequency_min=20.0)
+
+    def _integration_time(self) -> float:
+        return self._bench.config.integration_time
+
+    def _status_byte(self) -> int:
+        return self.READY_STATUS if self.measurement.ready() else 0
+
+    def _handle_trigger(self):
+        # A bus trigger starts a reading like initiate
+        self.measurement._trigger_time = self._bench.config.clock()
+
+    def _nominal_value(self) -> float:
+        source = self._bench.enabled_source()
+        return source.output_value() if source else (self.range or 1.0)
+
+    def _handle_query(self, data: str) -> str:
+        if data.startswith('FETCH?'):
+            return repr(self._bench.reading(self._nominal_value()))
+        if data.startswith('FREQ?'):
+            source = self._bench.enabled_source()
+            return repr(source.output.frequency if source else 1000.0)
+        return super()._handle_query(data)
+
+
+class SimulatedUtility3458A:
+    def __init__(self, ag3458a: 'Agilent3458A'):
+        self._ag3458a = ag3458a
+
+    @property
+    def temp(self) -> float:
+        return float(self._ag3458a._ask('TEMP?'))
+
+
+class Agilent3458A(SimulatedMeter):
+    """
+    Simulated 3458A, including ACAL, TEMP?, the binary reading memory burst used by read_burst_3458a and TRIG HOLD until a bus trigger.
+    """
+    READY_STATUS = 0x80
+    def __init__(self, resource: str = '', id_query=False, reset=False, bench: Optional[SimulatedBench] = None, **kwargs):
+        super().__init__(resource, id_query, reset, bench, **kwargs)
+        self.utility = SimulatedUtility3458A(self)
+        self.acal = types.SimpleNamespace(start_dcv=lambda: self._acal('DCV'), start_ohms=lambda: self._acal('OHMS'),
+                                          start_ac=lambda: self._acal('AC'))
+        # start_* blocks for the ACAL time of the bench, so there is nothing left to wait for afterwards
+        self.acal_seconds = {}
+        self._readings = 1
+        self._output_format = 'ASCII'
+        self._trigger_event = 'AUTO'
+
+    def _acal(self, acal_type: str):
+        self._write(f'ACAL {acal_type}')
+        self._bench.config.sleep(self._bench.config.acal_time)
+
+    def _handle_write(self, data: str):
+        for command in data.split(';'):
+            if match := re.fullmatch(r'\s*NRDGS (\d+)(,\w+)?\s*', command):
+                self._readings = int(match.group(1))
+            elif match := re.fullmatch(r'\s*OFORMAT (\w+)\s*', command):
+                self._output_format = match.group(1)
+            elif match := re.fullmatch(r'\s*TRIG (\w+)\s*', command):
+                self._trigger_event = match.group(1)
+            elif re.fullmatch(r'\s*TARM SGL\s*', command) and self._trigger_event != 'HOLD':
+                self.measurement._trigger_time = self._bench.config.clock()
+
+    def _handle_query(self, data: str) -> str:
+        if data.startswith('TEMP?'):
+            return f'{self._bench.temperature():.1f}'
+        if data.startswith('CAL? 72'):
+            return '"simulated"'
+        return super()._handle_query(data)
+
+    def _handle_read_raw(self, num) -> bytes:
+        dtype = {'SREAL': '>f4', 'DREAL': '>f8'}[self._output_format]
+        trigger_time = self.measurement._trigger_time or self._bench.config.clock()
+        self.measurement._trigger_time = None
+        self._bench.wait_until(trigger_time + self._readings * self._integration_time())
+        values = numpy.array([self._bench.reading(self._nominal_value()) for _ in range(self._readings)], dtype=dtype)
+        data = values.tobytes()
+        return data if num < 0 else data[:num]
+
+
+class Keithley2000(SimulatedMeter):
+    pass
+
+
+class Keithley182(SimulatedMeter):
+    READY_STATUS = 0x08
+
+
+class Wavetek4950(SimulatedMeter):
+    pass
+
+
+class Wavetek4920(SimulatedMeter):
+    pass
+
+
+class SimulatedSource(SimulatedInstrument):
+    SETTINGS = ('output_function', 'range')
+
+    def __init__(self, resource: str = '', id_query=False, reset=False, bench: Optional[SimulatedBench] = None, **kwargs):
+        super().__init__(resource, id_query, reset, bench, **kwargs)
+        object.__setattr__(self, 'output_function', 'dc_volts')
+        object.__setattr__(self, 'range', 0.0)
+        self.output = SimulatedSettings(self, value=0.0, enabled=False, full_range_or_zero='zero', frequency=1000.0)
+        self._bench.sources.append(self)
+
+    def _write(self, data: str):
+        super()._write(data)
+        self._bench.disturb()
+
+    def output_value(self) -> Optional[float]:
+        if self.output.enabled in (False, 'off', 0):
+            return None
+        return self.output.value
+
+
+class Fluke5450A(SimulatedSource):
+    pass
+
+
+class Datron4700(SimulatedSource):
+    def output_value(self) -> Optional[float]:
+        value = super().output_value()
+        if value is not None and self.output_function in ('two_wire_resistance', 'four_wire_resistance'):
+            return self.range if self.output.full_range_or_zero == '+full_range' else 0.0
+        return value
+
+
+class Keithley7001(SimulatedInstrument):
+    def __init__(self, resource: str = '', id_query=False, reset=False, bench: Optional[SimulatedBench] = None, **kwargs):
+        super().__init__(resource, id_query, reset, bench, **kwargs)
+        self.config = SimulatedSettings(self, single_channel='off')
+        self.cards = [types.SimpleNamespace(model='7011') for _ in range(2)]
+        self._channel_name = [f'{card}!{channel}' for card in (1, 2) for channel in range(1, 41)]
+        self.path = types.SimpleNamespace(connect=self._connect, disconnect_all=self._disconnect_all, wait_for_debounce=self._wait_for_debounce)
+        self.connections: List[Tuple[str, str]] = []
+
+    def _connect(self, channel1: str, channel2: str):
+        self._write(f'CLOSE {channel1},{channel2}')
+        self.connections.append((channel1, channel2))
+        self._bench.disturb()
+
+    def _disconnect_all(self):
+        self._write('OPEN ALL')
+        self.connections = []
+        self._bench.disturb()
+
+    def _wait_for_debounce(self, maximum_time):
+        self._ask('*OPC?')
+
+
+SIMULATED_DRIVERS = {
+    ('agilent', 'agilent3458A'): Agilent3458A,
+    ('keithley', 'keithley2000'): Keithley2000,
+    ('keithley', 'Keithley182'): Keithley182,
+    ('keithley', 'keithley7001'): Keithley7001,
+    ('datron_wavetek', 'wavetek4950'): Wavetek4950,
+    ('datron_wavetek', 'wavetek4920'): Wavetek4920,
+    ('datron_wavetek', 'datron4700'): Datron4700,
+    ('fluke', 'fluke5450a'): Fluke5450A,
+}
+
+
+def install(config: Optional[SimulationConfig] = None) -> SimulatedBench:
+    """
+    Replaces the ivi drivers of SIMULATED_DRIVERS by simulated instruments, so init_func of any script creates simulated instruments and isinstance checks on the driver classes keep working. Returns the bench shared by the instruments.
+    """
+    global _bench
+    _bench = SimulatedBench(config or SimulationConfig())
+    for (module_name, class_name), simulated_driver in SIMULATED_DRIVERS.items():
+        module = getattr(ivi, module_name, None)
+        if module is None:
+            module = types.ModuleType(f'ivi.{module_name}')
+            setattr(ivi, module_name, module)
+            sys.modules[module.__name__] = module
+        _original_drivers.setdefault((module_name, class_name), getattr(module, class_name, None))
+        setattr(module, class_name, simulated_driver)
+    return _bench
+
+
+def uninstall():
+    global _bench
+    for (module_name, class_name), original_driver in _original_drivers.items():
+        module = getattr(ivi, module_name)
+        if original_driver is None:
+            delattr(module, class_name)
+        else:
+            setattr(module, class_name, original_driver)
+    _original_drivers.clear()
+    _bench = None
+
+
+def install_if_requested(environ=None) -> Optional[SimulatedBench]:
+    """
+    Installs the simulated instruments if INSTRUMENT_SIMULATION is set, see SimulationConfig.from_env for its value.
+    """
+    value = (os.environ if environ is None else environ).get(SIMULATION_ENV_VAR)
+    if not value:
+        return None
+    config = SimulationConfig.from_env(value)
+    print(f'Using simulated instruments: {config}')
+    return install(config)
@@ -0,0 +1,72 @@
+import csv
+import datetime
+
+import numpy
+import pytest
+
+from allan_deviation import DeviationSums, allan_deviations, analyse_column, octave_factors, read_log_columns, split_at_gaps
+
+
+def naive_deviations(values, m):
+    # Straight from the definitions on averages over m readings
+    averages = [sum(values[i:i + m]) / m for i in range(len(values) - m + 1)]
+    adev_terms = [(averages[i + m] - averages[i]) ** 2 / 2 for i in range(len(averages) - m)]
+    hdev_terms = [(averages[i + 2 * m] - 2 * averages[i + m] + averages[i]) ** 2 / 6 for i in range(len(averages) - 2 * m)]
+    mdev_terms = [(sum(averages[j + m + i] - averages[j + i] for i in range(m)) / m) ** 2 / 2 for j in range(len(averages) - 2 * m + 1)]
+    return [(sum(terms) / len(terms)) ** 0.5 if terms else None for terms in (adev_terms, mdev_terms, hdev_terms)]
+
+
+class TestAllanDeviation:
+    @pytest.mark.parametrize('m', [1, 2, 3, 4, 8])
+    def test_matches_definition(self, m):
+        values = 10 + numpy.random.default_rng(m).normal(0, 1e-6, 50)
+        sums = DeviationSums(m)
+        sums.add_segment(values)
+        for result, expected in zip((sums.adev, sums.mdev, sums.hdev), naive_deviations(list(values), m)):
+            assert result == pytest.approx(expected, rel=1e-6)
+
+    # For white noise the ADEV falls with the square root of the averaging factor, the MDEV faster
+    def test_white_noise(self):
+        values = 10 + numpy.random.default_rng(1).normal(0, 1e-6, 100000)
+        results = allan_deviations([values])
+        assert [sums.factor for sums in results] == octave_factors(100000)
+        assert results[0].adev == pytest.approx(1e-6, rel=0.01)
+        assert results[4].adev == pytest.approx(1e-6 / 4, rel=0.03)
+        assert results[4].mdev == pytest.approx(1e-6 / 4 / 2 ** 0.5, rel=0.05)
+
+    def test_octave_factors(self):
+        assert octave_factors(1) == []
+        assert octave_factors(8) == [1, 2, 4]
+        assert octave_factors(9) == [1, 2, 4]
+
+    # Readings on both sides of a gap are not differenced
+    def test_gaps(self):
+        times = numpy.array([0, 1, 2, 3, 100, 101, 102, 103], dtype=float)
+        values = numpy.array([1, 1, 1, 1, 2, 2, 2, 2], dtype=float)
+        segments = split_at_gaps(times, values, 1.0)
+        assert [len(segment) for segment in segments] == [4, 4]
+        assert allan_deviations(segments)[0].adev == 0
+        assert allan_deviations([values])[0].adev > 0
+
+
+def test_read_log_columns(tmp_path):
+    path = tmp_path / 'log.csv'
+    start = datetime.datetime(2024, 1, 1)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=('datetime', 'k182_dcv', 'temp_2'))
+        writer.writeheader()
+        for i in range(10):
+            row = {'datetime': (start + datetime.timedelta(seconds=2 * i)).isoformat()}
+            # Every fifth row is a temperature row
+            row.update({'temp_2': 36.5} if i % 5 == 4 else {'k182_dcv': 1e-3 + i * 1e-9})
+            writer.writerow(row)
+    data = read_log_columns(str(path), ['k182_dcv', 'temp_2'])
+    times, values = data['k182_dcv']
+    assert len(values) == 8
+    assert times[:4].tolist() == [0, 2, 4, 6]
+    assert data['temp_2'][1].tolist() == [36.5, 36.5]
+    tau0, results = analyse_column(times, values)
+    assert tau0 == 2
+    assert results[0].adev_terms == 7
+    with pytest.raises(ValueError):
+        read_log_columns(str(path), ['k2000_dcv'])
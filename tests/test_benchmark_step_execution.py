@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import ivi
+import pytest
+
+import common_step_execution
+import simulated_instruments
+from benchmark_step_execution import PHASES, SCENARIOS, VirtualClock, run_benchmarks
+
+
+class TestBenchmark:
+    # Every scenario runs on the virtual clock and the engine is restored afterwards
+    @pytest.mark.parametrize('scenario', list(SCENARIOS))
+    def test_scenario(self, scenario):
+        time_module = common_step_execution.time
+        results = run_benchmarks([scenario], samples_per_step=2, step_soak_time=60)
+        result = results['scenarios'][scenario]
+        assert result['rows'] >= 2 * result['steps']
+        # Soak and integration times pass on the virtual clock only
+        assert result['wall_seconds'] < result['bench_seconds']
+        assert set(result['phases']) == set(PHASES)
+        assert 'retained_bytes_per_row' in result
+        assert common_step_execution.time is time_module
+        assert getattr(ivi.agilent, 'agilent3458A', None) is not simulated_instruments.Agilent3458A
+
+    # Reads on their own threads overlap on the virtual clock, the slowest one sets the time of the row
+    def test_concurrent_reads(self):
+        clock = VirtualClock()
+        clock.sleep(1.0)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [clock.executor(executor).submit(clock.sleep, seconds) for seconds in (2.0, 1.5)]
+            clock.wait(futures)
+        assert clock.now == pytest.approx(3.0)
+
+    # The three meters of a comparison row are read at the same time, so a row takes about one 2 s integration
+    def test_three_instrument_comparison_is_concurrent(self):
+        result = run_benchmarks(['three_instrument_comparison'], samples_per_step=2, step_soak_time=60)['scenarios']['three_instrument_comparison']
+        assert result['phases']['sample']['bench_seconds'] / result['rows'] == pytest.approx(2.0, rel=0.1)
@@ -1,5 +1,28 @@
+import asyncio
+import datetime
+import itertools
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import wait
 from pprint import pprint
-from common_step_execution import (FourWireResistanceCommand, Instrument, Dut, Res4WDutSettings, TransferDirection, decade_transfer_range, decade_transfer_unidirectional, generate_resistance_transfer_steps, get_value_decade_for_instrument, generate_resistance_steps, Step3)
+from types import SimpleNamespace
+
+import numpy
+import pytest
+import vxi11
+
+import common_step_execution
+from log_sink import CsvSink
+from common_step_execution import (FourWireResistanceCommand, Instrument, Dut, Res4WDutSettings, TransferDirection, decade_transfer_range, decade_transfer_unidirectional, generate_resistance_transfer_steps, get_value_decade_for_instrument, generate_resistance_steps, Step3, read_instruments_concurrently, run_procedure_async, execute_step_async, input_async, StepInterrupted,
+                                   acal_cal72, instrument_busy, run_in_background, schedule_acal, start_acal_3458a_in_background,
+                                   acal_3458a, acal_3458a_if_due, ACAL_SECONDS, DISPLAY_OFF_COMMAND_3458A,
+                                   SettleDetector, estimate_remaining_drift, read_burst_3458a, sample_input_burst,
+                                   ProcedureJournal, run_procedure, write_setting, invalidate_state_cache, setup_instrument, set_instrument_and_dut_safe,
+                                   command_batches, settings_snapshot, snapshot_step_settings, wait_for_reading,
+                                   ErrorKind, OverRangeError, RetryPolicy, is_measurement_column, classify_error, take_single_sample, gpib_address, gpib_bus, read_instruments_by_bus,
+                                   RunningStatistics, StepStatistics, STEP_STATISTICS_FIELDNAMES)
 
 class TestGenerateResistanceTransferSteps:
     def test_forward_transfer_direction_from_large_to_small_one_decade(self):
@@ -524,3 +547,993 @@ class TestDecadeTransferRange:
     def test_start_decade_3_end_decade_1(self):
         result = decade_transfer_range(3, 1)
         assert result == [1000.0, 100.0, 10.0]
+
+
+class FakeMeasurement:
+    def __init__(self, value, integration_time, error=None):
+        self.value = value
+        self.integration_time = integration_time
+        self.error = error
+        self.initiated = False
+
+    def initiate(self):
+        self.initiated = True
+
+    def fetch(self, max_time):
+        time.sleep(self.integration_time)
+        if self.error:
+            raise self.error
+        return self.value
+
+
+def fake_session(value, integration_time=0.0, error=None):
+    return SimpleNamespace(measurement=FakeMeasurement(value, integration_time, error))
+
+
+class TestReadInstrumentsConcurrently:
+    # Returns one reading per instrument, keyed by instrument name
+    def test_readings_by_instrument_name(self):
+        inits = {'ag3458a_2': fake_session(10e3), 'k2000': fake_session(100.1)}
+        instruments = [Instrument('ag3458a_2', FourWireResistanceCommand(10e3)), Instrument('k2000', FourWireResistanceCommand(100))]
+        assert read_instruments_concurrently(inits, instruments) == {'ag3458a_2': 10e3, 'k2000': 100.1}
+        assert inits['ag3458a_2'].measurement.initiated
+        assert inits['k2000'].measurement.initiated
+
+    # Row time is close to the slowest instrument instead of the sum
+    def test_instruments_integrate_in_parallel(self):
+        inits = {name: fake_session(1.0, 0.2) for name in ('ag3458a_2', 'k2000', 'k2000_20')}
+        instruments = [Instrument(name, FourWireResistanceCommand(10e3)) for name in inits]
+        start = time.monotonic()
+        read_instruments_concurrently(inits, instruments)
+        assert time.monotonic() - start < 0.5
+
+    # Only instruments in the step are read
+    def test_only_step_instruments_are_read(self):
+        inits = {'ag3458a_2': fake_session(1.0), 'k2000': fake_session(2.0)}
+        result = read_instruments_concurrently(inits, [Instrument('k2000', FourWireResistanceCommand(100))])
+        assert result == {'k2000': 2.0}
+        assert not inits['ag3458a_2'].measurement.initiated
+
+    # Custom read function is called with the session and the instrument
+    def test_custom_read_instrument(self):
+        inits = {'k2000': fake_session(2.0)}
+        result = read_instruments_concurrently(inits, [Instrument('k2000', FourWireResistanceCommand(100))],
+                                               lambda session, instrument: (instrument.name, session.measurement.fetch(1)))
+        assert result == {'k2000': ('k2000', 2.0)}
+        assert not inits['k2000'].measurement.initiated
+
+    # Errors are raised only after all other instruments have finished
+    def test_error_raised_after_all_reads_finish(self):
+        slow = fake_session(1.0, 0.2)
+        inits = {'ag3458a_2': fake_session(None, error=IOError('timeout')), 'k2000': slow}
+        instruments = [Instrument(name, FourWireResistanceCommand(10e3)) for name in inits]
+        start = time.monotonic()
+        with pytest.raises(IOError):
+            read_instruments_concurrently(inits, instruments)
+        assert time.monotonic() - start >= 0.2
+
+
+class BusMeasurement:
+    # Integrates from initiate, a fetch before the reading is done blocks the bus until it is. Without initiate it
+    # returns the last reading like a meter that triggers continuously.
+    def __init__(self, name, value, integration_time, fetches):
+        self.name = name
+        self.value = value
+        self.integration_time = integration_time
+        self.fetches = fetches
+        self.trigger_time = None
+
+    def initiate(self):
+        self.trigger_time = time.monotonic()
+
+    def fetch(self, max_time):
+        if self.trigger_time is not None:
+            time.sleep(max(0.0, self.trigger_time + self.integration_time - time.monotonic()))
+        self.trigger_time = None
+        self.fetches.append(self.name)
+        return self.value
+
+
+def bus_session(name, address, integration_time, fetches, host='gpib1'):
+    return SimpleNamespace(_interface=SimpleNamespace(host=host, name=f'gpib,{address}'), measurement=BusMeasurement(name, address, integration_time, fetches))
+
+
+class keithley199:
+    # Armed for a bus trigger by T3X, its reading starts on the GET
+    def __init__(self, name, address, integration_time, fetches):
+        self._interface = vxi11.Instrument('gpib1', f'gpib,{address}')
+        self.measurement = BusMeasurement(name, address, integration_time, fetches)
+        self.writes = []
+
+    def _write(self, data, encoding='utf-8'):
+        self.writes.append(data)
+
+
+# The trigger commands are picked by driver class name
+bus_keithley2000 = type('keithley2000', (keithley199,), {})
+
+
+def fake_interface_device(send_command, bus_address=5):
+    # The bus address of the gateway is read when its link is opened
+    interface_device = vxi11.vxi11.InterfaceDevice('gpib1', 'gpib')
+
+    def open():
+        interface_device._bus_address = bus_address
+    interface_device.open = open
+    interface_device.send_command = send_command
+    return interface_device
+
+
+class TestReadInstrumentsByBus:
+    def test_gpib_bus(self):
+        assert gpib_bus(bus_session('k199_25', 25, 0, [])) == 'gpib1/gpib'
+        assert gpib_bus(SimpleNamespace(_interface=SimpleNamespace(name='TCPIP::gpib4::gpib0,10::INSTR'))) == 'gpib4/gpib0'
+        assert gpib_bus(SimpleNamespace(_interface=SimpleNamespace(name='TCPIP::192.168.1.5::INSTR'))) == '192.168.1.5/inst0'
+        assert gpib_bus(fake_session(1.0)) is None
+
+    def test_gpib_address(self):
+        assert gpib_address(vxi11.Instrument('gpib1', 'gpib,25')) == (25,)
+        assert gpib_address(vxi11.Instrument('gpib4', 'gpib0,10,2')) == (10, 2)
+        assert gpib_address(vxi11.Instrument('192.168.1.5', 'inst0')) is None
+
+    # The armed meters are triggered by one GET to all of them, a meter that cannot be armed is initiated just before
+    def test_synchronised_trigger(self, monkeypatch):
+        fetches, commands = [], []
+        inits = {'k199_25': keithley199('k199_25', 25, 0.05, fetches), 'k199_26': keithley199('k199_26', 26, 0.05, fetches),
+                 'prema6031a': bus_session('prema6031a', 7, 0.05, fetches)}
+
+        def send_command(data):
+            commands.append(data)
+            inits['k199_25'].measurement.initiate()
+            inits['k199_26'].measurement.initiate()
+        monkeypatch.setitem(common_step_execution._bus_interface_devices, ('gpib1', 'gpib'), fake_interface_device(send_command))
+        assert read_instruments_by_bus(inits, list(inits), synchronised_trigger=True) == {'k199_25': 25, 'k199_26': 26, 'prema6031a': 7}
+        # The gateway talks from its own bus address, all armed meters listen to the GET
+        assert commands == [bytes([0x40 | 5, 0x3f, 0x20 | 25, 0x20 | 26, 0x08])]
+        # Armed for the GET, and back to their own trigger after the fetch
+        assert inits['k199_25'].writes == inits['k199_26'].writes == ['T3X', 'T0X']
+        assert inits['k199_25'].last_trigger == inits['k199_26'].last_trigger
+        assert inits['prema6031a'].last_trigger <= inits['k199_25'].last_trigger
+
+    # A meter that is only fetched is not armed, so it keeps triggering continuously
+    def test_synchronised_trigger_fetch_only(self, monkeypatch):
+        fetches = []
+        inits = {'k199_25': keithley199('k199_25', 25, 0, fetches), 'k199_26': keithley199('k199_26', 26, 0, fetches)}
+        monkeypatch.setitem(common_step_execution._bus_interface_devices, ('gpib1', 'gpib'),
+                            fake_interface_device(lambda data: inits['k199_25'].measurement.initiate()))
+        assert read_instruments_by_bus(inits, list(inits), fetch_only=('k199_26',), synchronised_trigger=True) == {'k199_25': 25, 'k199_26': 26}
+        assert inits['k199_25'].writes == ['T3X', 'T0X']
+        assert inits['k199_26'].writes == []
+        assert inits['k199_26'].last_trigger is None
+
+    # A K2000 is taken off continuous initiation for the GET and put back on it after the fetch
+    def test_synchronised_trigger_k2000(self, monkeypatch):
+        fetches = []
+        inits = {'k2000': bus_keithley2000('k2000', 16, 0, fetches), 'k2000_20': bus_keithley2000('k2000_20', 17, 0, fetches)}
+        monkeypatch.setitem(common_step_execution._bus_interface_devices, ('gpib1', 'gpib'), fake_interface_device(lambda data: None))
+        assert read_instruments_by_bus(inits, list(inits), synchronised_trigger=True) == {'k2000': 16, 'k2000_20': 17}
+        assert inits['k2000'].writes == [':INIT:CONT OFF;:TRIG:SOUR BUS;:INIT', ':TRIG:SOUR IMM;:INIT:CONT ON']
+        assert inits['k2000'].last_trigger == inits['k2000_20'].last_trigger is not None
+
+    # Once the reading times are known, the readings are fetched as they complete and the row takes as long as the slowest meter
+    def test_fetch_in_order_of_completion(self):
+        fetches = []
+        inits = {'ag3458a_1': bus_session('ag3458a_1', 21, 0.15, fetches), 'k199_25': bus_session('k199_25', 25, 0.05, fetches),
+                 'prema6031a': bus_session('prema6031a', 7, 0.1, fetches)}
+        assert read_instruments_by_bus(inits, list(inits)) == {'ag3458a_1': 21, 'k199_25': 25, 'prema6031a': 7}
+        fetches.clear()
+        start = time.monotonic()
+        read_instruments_by_bus(inits, list(inits))
+        assert time.monotonic() - start < 0.25
+        assert fetches == ['k199_25', 'prema6031a', 'ag3458a_1']
+        assert inits['k199_25'].expected_reading_time == pytest.approx(0.05, abs=0.05)
+
+    def test_fetch_only(self):
+        fetches = []
+        inits = {'k2000': bus_session('k2000', 16, 0, fetches), 'k199_25': bus_session('k199_25', 25, 0, fetches)}
+        inits['k2000'].measurement.initiate = lambda: pytest.fail('k2000 triggered')
+        assert read_instruments_by_bus(inits, list(inits), fetch_only=('k2000',)) == {'k2000': 16, 'k199_25': 25}
+
+    # An error on one bus does not keep the other readings from finishing
+    def test_error_raised_after_all_reads_finish(self):
+        fetches = []
+        inits = {'ag3458a_2': fake_session(None, error=IOError('timeout')), 'k199_25': bus_session('k199_25', 25, 0.1, fetches)}
+        with pytest.raises(IOError):
+            read_instruments_by_bus(inits, list(inits))
+        assert fetches == ['k199_25']
+
+
+class ListWriter:
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+
+
+def fake_read_row(inits, instruments):
+    return {'value': inits[instruments[0].name].measurement.fetch(1)}, True
+
+
+class TestRunProcedureAsync:
+    @pytest.fixture(autouse=True)
+    def no_beep_or_dut(self, monkeypatch):
+        monkeypatch.setattr(common_step_execution, 'beep', lambda: None)
+        monkeypatch.setattr(common_step_execution, 'setup_dut', lambda step, inits: None)
+
+    # Every step is sampled samples_per_step times and rows are tagged with the dut
+    def test_rows_written_per_step(self):
+        inits = {'k2000': fake_session(1.5)}
+        instrument = Instrument('k2000', FourWireResistanceCommand(100))
+        procedure = [Step3(Dut('DUT1', '100 Ohm', Res4WDutSettings(value=100, range=100)), [instrument]),
+                     Step3(Dut('DUT2', '100 Ohm', Res4WDutSettings(value=100, range=100)), [instrument])]
+        csvw = ListWriter()
+        asyncio.run(run_procedure_async(csvw, procedure, inits, fake_read_row, 3, 0))
+        assert [row['dut'] for row in csvw.rows] == ['DUT1'] * 3 + ['DUT2'] * 3
+        assert all(row['value'] == 1.5 for row in csvw.rows)
+
+    # Cancelling during the soak returns immediately instead of waiting for the soak time
+    def test_cancel_during_soak(self):
+        inits = {'k2000': fake_session(1.5)}
+        step = Step3(Dut('DUT1', '100 Ohm', Res4WDutSettings(value=100, range=100)), [Instrument('k2000', FourWireResistanceCommand(100))])
+
+        async def cancel_step():
+            task = asyncio.create_task(execute_step_async(ListWriter(), 0, step, None, inits, fake_read_row, 3, 60))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        start = time.monotonic()
+        asyncio.run(cancel_step())
+        assert time.monotonic() - start < 1
+
+    # Below run_procedure_async, cancelling while sampling stays a CancelledError, so the steps work with asyncio.timeout
+    def test_cancel_during_sampling(self):
+        inits = {'k2000': fake_session(1.5, 0.01)}
+        step = Step3(Dut('DUT1', '100 Ohm', Res4WDutSettings(value=100, range=100)), [Instrument('k2000', FourWireResistanceCommand(100))], run_until_interrupted=True)
+
+        async def time_out_step():
+            with pytest.raises(TimeoutError):
+                async with asyncio.timeout(0.1):
+                    await execute_step_async(ListWriter(), 7, step, None, inits, fake_read_row, 3, 0)
+
+        asyncio.run(time_out_step())
+
+    # run_procedure_async raises StepInterrupted with the running step, whether it is cancelled while sampling or during the soak
+    @pytest.mark.parametrize('step_soak_time, cancel_after', [(0, 0.1), (60, 0.05)])
+    def test_cancel_interrupts_procedure(self, step_soak_time, cancel_after):
+        inits = {'k2000': fake_session(1.5, 0.01)}
+        instrument = Instrument('k2000', FourWireResistanceCommand(100))
+        procedure = [Step3(Dut('DUT1', '100 Ohm', Res4WDutSettings(value=100, range=100)), [instrument]),
+                     Step3(Dut('DUT2', '100 Ohm', Res4WDutSettings(value=100, range=100)), [instrument], run_until_interrupted=True)]
+
+        async def cancel_procedure():
+            task = asyncio.create_task(run_procedure_async(ListWriter(), procedure, inits, fake_read_row, 1, step_soak_time))
+            await asyncio.sleep(cancel_after)
+            task.cancel()
+            with pytest.raises(StepInterrupted) as step_interrupted:
+                await task
+            return step_interrupted.value.step_number
+
+        assert asyncio.run(cancel_procedure()) == (1 if step_soak_time == 0 else 0)
+
+    # The settle detector is read one reading at a time, so cancelling the soak stops reading the instrument
+    def test_cancel_during_settle_detection(self):
+        reads = []
+        detector = SettleDetector(read_instrument=lambda session, instrument: reads.append(time.sleep(0.01)) or len(reads))
+        step = Step3(Dut('DUT1', '100 Ohm', Res4WDutSettings(value=100, range=100)), [Instrument('k2000', FourWireResistanceCommand(100))])
+
+        async def cancel_soak():
+            task = asyncio.create_task(detector.wait_for_settle_async(step, {'k2000': fake_session(1.5)}, 60))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            reads_at_cancel = len(reads)
+            await asyncio.sleep(0.1)
+            return reads_at_cancel
+
+        assert len(reads) <= asyncio.run(cancel_soak()) + 1
+
+
+# The manual prompt waits for stdin in the event loop, so it can be cancelled
+def test_input_async(monkeypatch):
+    read_fd, write_fd = os.pipe()
+    with open(read_fd) as stdin:
+        monkeypatch.setattr(sys, 'stdin', stdin)
+
+        async def prompt():
+            with pytest.raises(TimeoutError):
+                async with asyncio.timeout(0.05):
+                    await input_async('Press enter to continue...')
+            os.write(write_fd, b'ok\n')
+            return await input_async('Press enter to continue...')
+
+        assert asyncio.run(prompt()) == 'ok'
+    os.close(write_fd)
+
+
+class FakeAcal:
+    def __init__(self, duration):
+        self.duration = duration
+        self.started = []
+
+    def start_dcv(self):
+        self.started.append('dcv')
+        time.sleep(self.duration)
+
+    def start_ohms(self):
+        self.started.append('ohms')
+        time.sleep(self.duration)
+
+
+def fake_3458a(value, acal_duration):
+    ag3458a = fake_session(value)
+    ag3458a.acal = FakeAcal(acal_duration)
+    ag3458a.acal_seconds = {}
+    ag3458a._ask = lambda command: ' 1.0E-6\r\n' if command == 'CAL? 72' else ''
+    return ag3458a
+
+
+class TestBackgroundAcal:
+    # The 3458A is skipped while ACAL runs, the other instruments keep being read
+    def test_busy_instrument_reads_none(self):
+        ag3458a = fake_3458a(10e3, 0.2)
+        inits = {'ag3458a_2': ag3458a, 'k2000': fake_session(100.1)}
+        instruments = [Instrument('ag3458a_2', FourWireResistanceCommand(10e3)), Instrument('k2000', FourWireResistanceCommand(100))]
+        job = start_acal_3458a_in_background(ag3458a)
+        assert instrument_busy(ag3458a)
+        assert read_instruments_concurrently(inits, instruments) == {'ag3458a_2': None, 'k2000': 100.1}
+        assert not ag3458a.measurement.initiated
+        assert acal_cal72(ag3458a) is None
+        job.result()
+        assert not instrument_busy(ag3458a)
+        assert ag3458a.acal.started == ['dcv', 'ohms']
+        assert acal_cal72(ag3458a) == '1.0E-6'
+        assert read_instruments_concurrently(inits, instruments) == {'ag3458a_2': 10e3, 'k2000': 100.1}
+
+    # A failed background ACAL is raised instead of silently measuring on
+    def test_failed_background_job_is_raised(self):
+        session = fake_session(1.0)
+        job = run_in_background(session, lambda: 1 / 0)
+        wait([job])
+        with pytest.raises(ZeroDivisionError):
+            instrument_busy(session)
+        assert not instrument_busy(session)
+
+    # ACAL is only scheduled for instruments that allow it and when it is due
+    def test_schedule_acal(self):
+        ag3458a = fake_3458a(10e3, 0)
+        ag3458a.last_acal = datetime.datetime.utcnow()
+        ag3458a.last_acal_temp = 36.0
+        ag3458a.last_temp_value = 36.2
+        step = Step3(Dut('SR104', '10 kOhm', Res4WDutSettings(value=10e3, range=10e3)), [Instrument('ag3458a_2', FourWireResistanceCommand(10e3, allow_acal=True))])
+        schedule_acal(step, {'ag3458a_2': ag3458a})
+        assert not instrument_busy(ag3458a) and ag3458a.acal.started == []
+
+        ag3458a.last_temp_value = 36.6
+        schedule_acal(step, {'ag3458a_2': ag3458a})
+        ag3458a.background_job.result()
+        assert ag3458a.acal.started == ['dcv', 'ohms']
+        # The ACAL just run is the new reference, so it is not due again
+        assert ag3458a.last_acal_temp == 36.6
+        ag3458a.acal.started = []
+        schedule_acal(step, {'ag3458a_2': ag3458a})
+        assert ag3458a.acal.started == []
+
+        ag3458a.last_temp_value = 37.2
+        step.instruments[0].setting.allow_acal = False
+        ag3458a.acal.started = []
+        schedule_acal(step, {'ag3458a_2': ag3458a})
+        assert ag3458a.acal.started == []
+
+    # The threshold of the internal temperature change is up to the caller
+    def test_max_temp_change(self):
+        ag3458a = fake_3458a(10e3, 0)
+        ag3458a.last_acal = datetime.datetime.utcnow()
+        ag3458a.last_acal_temp = 36.0
+        ag3458a.last_temp_value = 36.6
+        assert acal_3458a_if_due(ag3458a, ('dcv',), max_temp_change=1) is None
+        acal_3458a_if_due(ag3458a, ('dcv',)).result()
+        assert ag3458a.acal.started == ['dcv']
+
+    # CAL? 72 is only asked once every ACAL type had its time to finish, and the display is turned off again after it
+    def test_acal_waits_before_cal72(self, monkeypatch):
+        events = []
+        ag3458a = fake_3458a(10e3, 0)
+        del ag3458a.acal_seconds
+        ag3458a.acal = SimpleNamespace(start_dcv=lambda: events.append('ACAL DCV'), start_ohms=lambda: events.append('ACAL OHMS'))
+        ag3458a.display_off = True
+        ag3458a._ask = lambda command: events.append(command) or ' 1.0E-6\r\n'
+        ag3458a._write = events.append
+        monkeypatch.setattr(common_step_execution.time, 'sleep', lambda seconds: events.append(seconds))
+        acal_3458a(ag3458a)
+        assert events == ['ACAL DCV', ACAL_SECONDS['dcv'], 'ACAL OHMS', ACAL_SECONDS['ohms'], 'CAL? 72', DISPLAY_OFF_COMMAND_3458A]
+        assert ag3458a.last_acal_cal72 == '1.0E-6'
+
+
+class TestSettleDetector:
+    # A constant reading has no remaining drift
+    def test_no_drift_for_constant_reading(self):
+        times = list(range(9))
+        assert estimate_remaining_drift(times, [10.0] * 9) == 0
+
+    # A linear ramp is extrapolated over one window length
+    def test_linear_drift(self):
+        times = list(range(9))
+        values = [10 + 1e-3 * t for t in times]
+        assert estimate_remaining_drift(times, values) == pytest.approx(8e-3)
+
+    # An exponential decay is extrapolated to its asymptote
+    def test_exponential_drift(self):
+        times = list(range(9))
+        values = [10 + 1e-3 * 0.5 ** t for t in times]
+        remaining_from_last_block = sum(values[-3:]) / 3 - 10
+        assert estimate_remaining_drift(times, values) == pytest.approx(remaining_from_last_block)
+
+    # Settled only once a full window is below the threshold
+    def test_is_settled(self):
+        detector = SettleDetector(threshold_ppm=10, window=6)
+        times = list(range(6))
+        assert not detector.is_settled(times[:5], [10.0] * 5)
+        assert detector.is_settled(times, [10.0] * 6)
+        assert not detector.is_settled(times, [10 + 1e-3 * t for t in times])
+        assert detector.is_settled(times, [10 + 1e-6 * t for t in times])
+
+    # A window too short to estimate the drift from is refused
+    def test_short_window(self):
+        with pytest.raises(ValueError):
+            SettleDetector(window=2)
+
+    # Readings around zero are compared against the instrument range
+    def test_is_settled_around_zero(self):
+        detector = SettleDetector(threshold_ppm=10, window=6)
+        times = list(range(6))
+        assert detector.is_settled(times, [0.0] * 6, 10)
+        # A null measurement with 1e-9 of noise on the 0.1 range settles, a real drift near zero does not
+        noise = [1e-9, -1e-9, 0.0, 1e-9, -1e-9, 0.0]
+        assert detector.is_settled(times, [1e-9 + n for n in noise], 0.1)
+        assert not detector.is_settled(times, [1e-9 + 1e-6 * t for t in times], 0.1)
+
+    # The soak ends as soon as the reading is settled
+    def test_wait_for_settle_ends_early(self):
+        inits = {'k2000': fake_session(100.0)}
+        step = Step3(Dut('DUT1', '100 Ohm', Res4WDutSettings(value=100, range=100)), [Instrument('k2000', FourWireResistanceCommand(100))])
+        start = time.monotonic()
+        SettleDetector().wait_for_settle(step, inits, 60, manual_prompt=True)
+        assert time.monotonic() - start < 1
+
+    # The step soak time is an upper bound for a reading that keeps drifting
+    def test_wait_for_settle_upper_bound(self):
+        drifting_values = iter(range(1, 1000000))
+        session = SimpleNamespace(measurement=SimpleNamespace(initiate=lambda: None, fetch=lambda max_time: next(drifting_values)))
+        step = Step3(Dut('DUT1', '100 Ohm', Res4WDutSettings(value=100, range=100)), [Instrument('k2000', FourWireResistanceCommand(100))])
+        start = time.monotonic()
+        SettleDetector().wait_for_settle(step, {'k2000': session}, 0.2)
+        assert 0.2 <= time.monotonic() - start < 1
+
+
+class Fake3458A:
+    def __init__(self, readings, dtype='>f8'):
+        self.data = numpy.array(readings, dtype=dtype).tobytes()
+        self.writes = []
+        self._interface = SimpleNamespace(timeout=10)
+        self.read_timeout = None
+
+    def _write(self, command):
+        self.writes.append(command)
+
+    def _read_raw(self, num=-1):
+        self.read_timeout = self._interface.timeout
+        return self.data[:num]
+
+
+class TestBurst3458A:
+    # DREAL readings come back as one float array with full resolution
+    def test_read_burst_dreal(self):
+        readings = [10000.01234567, 10000.01234589, 10000.01234512]
+        ag3458a = Fake3458A(readings)
+        values = read_burst_3458a(ag3458a, 3)
+        assert values.tolist() == readings
+        assert ag3458a.writes[0] == 'MEM FIFO;MFORMAT DREAL;OFORMAT DREAL;NRDGS 3,AUTO;TARM SGL'
+        assert ag3458a.writes[-1] == 'NRDGS 1,AUTO;MEM OFF;MFORMAT SREAL;OFORMAT ASCII'
+
+    # The timeout covers the integration time of all readings for the transfer only
+    def test_read_burst_timeout(self):
+        ag3458a = Fake3458A([1.0] * 16)
+        read_burst_3458a(ag3458a, 16, reading_time=4)
+        assert ag3458a.read_timeout == 16 * 4 + common_step_execution.BURST_TIMEOUT_MARGIN
+        assert ag3458a._interface.timeout == 10
+        # A longer timeout is kept
+        ag3458a._interface.timeout = 120
+        read_burst_3458a(ag3458a, 2, reading_time=0.1)
+        assert ag3458a.read_timeout == 120
+
+    # SREAL readings are decoded from 4 byte big-endian floats
+    def test_read_burst_sreal(self):
+        ag3458a = Fake3458A([1.5, -2.25], dtype='>f4')
+        assert read_burst_3458a(ag3458a, 2, 'SREAL').tolist() == [1.5, -2.25]
+
+    # A short transfer is an error instead of a short step
+    def test_read_burst_short_transfer(self):
+        ag3458a = Fake3458A([1.5])
+        with pytest.raises(IOError):
+            read_burst_3458a(ag3458a, 2)
+        assert ag3458a.writes[-1] == 'NRDGS 1,AUTO;MEM OFF;MFORMAT SREAL;OFORMAT ASCII'
+
+    # All rows of a burst are written and tagged with the dut
+    def test_sample_input_burst(self):
+        step = Step3(Dut('SR104', '10 kOhm', Res4WDutSettings(value=10e3, range=10e3)), [Instrument('ag3458a_2', FourWireResistanceCommand(10e3))])
+        csvw = ListWriter()
+        sample_input_burst(0, step, {}, csvw, lambda inits, instruments, count: [({'temp_2': 36.0}, False)] + [({'value': i}, True) for i in range(count)], 4)
+        assert [row.get('value') for row in csvw.rows] == [None, 0, 1, 2, 3]
+        assert all(row['dut'] == 'SR104' for row in csvw.rows[1:])
+        # Temperature rows are not tagged, like in take_single_sample
+        assert 'dut' not in csvw.rows[0]
+
+
+def interrupting_read_row(calls):
+    count = 0
+
+    def read_row(inits, instruments):
+        nonlocal count
+        count += 1
+        if count == calls:
+            raise KeyboardInterrupt
+        return {'value': count}, True
+    return read_row
+
+
+class TestProcedureJournal:
+    @pytest.fixture(autouse=True)
+    def no_beep_or_dut(self, monkeypatch):
+        monkeypatch.setattr(common_step_execution, 'beep', lambda: None)
+        monkeypatch.setattr(common_step_execution, 'setup_dut', lambda step, inits: None)
+
+    @pytest.fixture
+    def procedure(self):
+        instrument = Instrument('k2000', FourWireResistanceCommand(100))
+        return [Step3(Dut(f'DUT{n}', '100 Ohm', Res4WDutSettings(value=100, range=100)), [instrument]) for n in range(1, 4)]
+
+    # An interrupted run resumes at the first incomplete step and sample
+    def test_resume_after_interrupt(self, tmp_path, procedure):
+        journal = ProcedureJournal(str(tmp_path / 'run.journal'))
+        csvw = ListWriter()
+        inits = {'k2000': fake_session(1.5)}
+        with pytest.raises(StepInterrupted) as step_interrupted:
+            run_procedure(csvw, procedure, inits, interrupting_read_row(5), 3, 0, journal=journal)
+        assert step_interrupted.value.step_number == 1
+        assert journal.read()['step_number'] == 1
+        assert journal.read()['samples_taken'] == 1
+
+        run_procedure(csvw, procedure, inits, fake_read_row, 3, 0, journal=journal, resume=True)
+        assert [row['dut'] for row in csvw.rows] == ['DUT1'] * 3 + ['DUT2'] * 3 + ['DUT3'] * 3
+        assert journal.read() is None
+
+    # With a sink that reports its commits, progress is only recorded once the rows of the samples are committed, without a commit per sample
+    def test_record_on_commit(self, tmp_path, procedure):
+        journal = ProcedureJournal(str(tmp_path / 'run.journal'))
+        sink = CsvSink(str(tmp_path / 'log.csv'), ('datetime', 'dut', 'dut_setting', 'value'), commit_interval=60, commit_rows=2)
+        inits = {'k2000': fake_session(1.5)}
+        with pytest.raises(StepInterrupted):
+            run_procedure(sink, procedure, inits, interrupting_read_row(6), 3, 0, journal=journal)
+        assert (sink.rows_written, sink.rows_committed) == (5, 4)
+        assert (journal.read()['step_number'], journal.read()['samples_taken']) == (1, 1)
+        sink.close()
+        assert (journal.read()['step_number'], journal.read()['samples_taken']) == (1, 2)
+
+    # The step statistics writer passes the commits of the sink through
+    def test_record_on_commit_with_statistics(self, tmp_path, procedure):
+        journal = ProcedureJournal(str(tmp_path / 'run.journal'))
+        sink = CsvSink(str(tmp_path / 'log.csv'), ('datetime', 'dut', 'dut_setting', 'value'), commit_interval=60, commit_rows=100)
+        run_procedure(sink, procedure[:1], {'k2000': fake_session(1.5)}, fake_read_row, 2, 0, journal=journal, step_statistics=StepStatistics(ListWriter()))
+        assert journal.read() is None
+        sink.close()
+        assert journal.read() is None
+
+    # A step whose samples were all taken continues with the next step
+    def test_resume_after_last_sample_of_step(self, tmp_path, procedure):
+        journal = ProcedureJournal(str(tmp_path / 'run.journal'))
+        journal.start(procedure, 3)
+        journal.record(0, 3)
+        assert journal.start(procedure, 3, resume=True) == (1, 1)
+
+    # Without resume, or with a journal of another procedure, the procedure starts from the beginning
+    def test_start_from_beginning(self, tmp_path, procedure):
+        journal = ProcedureJournal(str(tmp_path / 'run.journal'))
+        journal.start(procedure, 3)
+        journal.record(2, 1)
+        assert journal.start(procedure[1:], 3, resume=True) == (0, 1)
+        journal.record(1, 1)
+        assert journal.start(procedure[1:], 3) == (0, 1)
+
+    # Bursts resume with the remaining samples of the step
+    def test_resume_burst(self, tmp_path, procedure):
+        journal = ProcedureJournal(str(tmp_path / 'run.journal'))
+        journal.start(procedure, 4)
+        journal.record(0, 1)
+        csvw = ListWriter()
+        sample_input_burst(0, procedure[0], {}, csvw, lambda inits, instruments, count: [({'value': i}, True) for i in range(count)], 4, 2, journal)
+        assert len(csvw.rows) == 3
+        assert journal.read()['samples_taken'] == 4
+
+
+class RecordingSession:
+    def __init__(self):
+        self.writes = []
+        self.ac = SimpleNamespace()
+
+    def __setattr__(self, name, value):
+        if name in ('measurement_function', 'range'):
+            self.writes.append((name, value))
+        object.__setattr__(self, name, value)
+
+
+class TestStateCache:
+    def test_unchanged_setting_not_written(self):
+        session = RecordingSession()
+        assert write_setting(session, 'range', 10e3)
+        assert not write_setting(session, 'range', 10000)
+        assert write_setting(session, 'range', 1e3)
+        assert session.writes == [('range', 10e3), ('range', 1e3)]
+
+    def test_nested_setting(self):
+        session = RecordingSession()
+        assert write_setting(session, 'ac.frequency_min', 20)
+        assert not write_setting(session, 'ac.frequency_min', 20)
+        assert session.ac.frequency_min == 20
+
+    def test_invalidate(self):
+        session = RecordingSession()
+        write_setting(session, 'range', 10e3)
+        invalidate_state_cache(session)
+        assert write_setting(session, 'range', 10e3)
+
+    # A step transition on the same range only writes what setup_instrument changes
+    def test_step_transition_sends_deltas(self):
+        inits = {'ag3458a_2': RecordingSession()}
+        instrument = Instrument('ag3458a_2', FourWireResistanceCommand(10e3))
+        step1 = Step3(Dut('SR104', '10 kOhm', Res4WDutSettings(value=10e3, range=10e3)), [instrument])
+        step2 = Step3(Dut('Guildline 9330', '10 kOhm', Res4WDutSettings(value=10e3, range=10e3)), [instrument])
+        set_instrument_and_dut_safe(step1, None, inits)
+        setup_instrument(step1, None, inits, 0)
+        set_instrument_and_dut_safe(step2, step1, inits)
+        setup_instrument(step2, step1, inits, 0)
+        assert inits['ag3458a_2'].writes == [('measurement_function', 'four_wire_resistance'), ('range', 10e3)]
+
+    # An interrupted step forgets the cached state, as the operator may have changed the instruments
+    def test_invalidated_on_step_interrupted(self, monkeypatch):
+        monkeypatch.setattr(common_step_execution, 'beep', lambda: None)
+        monkeypatch.setattr(common_step_execution, 'setup_dut', lambda step, inits: None)
+        session = fake_session(1.0)
+        write_setting(session, 'range', 10e3)
+        step = Step3(Dut('SR104', '10 kOhm', Res4WDutSettings(value=10e3, range=10e3)), [Instrument('k2000', FourWireResistanceCommand(10e3))])
+        with pytest.raises(StepInterrupted):
+            run_procedure(ListWriter(), [step], {'k2000': session}, interrupting_read_row(1), 3, 0)
+        assert not session.state_cache
+
+
+class agilent3458a:
+    # Counts the queries of the settings that are logged with every row
+    def __init__(self):
+        self.queries = 0
+        self.measurement_function = 'four_wire_resistance'
+        self._range = 10e3
+        self.trigger = SimpleNamespace(delay=0.1)
+
+    @property
+    def range(self):
+        self.queries += 1
+        return self._range
+
+    @range.setter
+    def range(self, value):
+        self._range = value
+
+    def _write(self, data, encoding='utf-8'):
+        pass
+
+
+class TestSettingsSnapshot:
+    def test_read_once_per_step(self, monkeypatch):
+        monkeypatch.setattr(common_step_execution, 'beep', lambda: None)
+        monkeypatch.setattr(common_step_execution, 'setup_dut', lambda step, inits: None)
+        ag3458a = agilent3458a()
+        step = Step3(Dut('SR104', '10 kOhm', Res4WDutSettings(value=10e3, range=10e3)), [Instrument('ag3458a_2', FourWireResistanceCommand(10e3))])
+        csvw = ListWriter()
+        run_procedure(csvw, [step], {'ag3458a_2': ag3458a}, lambda inits, instruments: ({'range': settings_snapshot(inits['ag3458a_2'])['range']}, True), 3, 0)
+        assert [row['range'] for row in csvw.rows] == [10e3] * 3
+        assert ag3458a.queries == 1
+
+    def test_write_setting_drops_snapshot(self):
+        ag3458a = agilent3458a()
+        assert settings_snapshot(ag3458a) == {'range': 10e3, 'trigger.delay': 0.1}
+        write_setting(ag3458a, 'range', 100)
+        assert settings_snapshot(ag3458a)['range'] == 100
+        assert ag3458a.queries == 2
+
+    # A meter running ACAL in the background is not waited for, its snapshot is taken on the first row
+    def test_busy_instrument_snapshot_deferred(self):
+        ag3458a = agilent3458a()
+        ag3458a.background_job = SimpleNamespace(done=lambda: False)
+        snapshot_step_settings({'ag3458a_2': ag3458a})
+        assert ag3458a.settings_snapshot is None
+        assert ag3458a.queries == 0
+
+
+class keithley182:
+    def __init__(self, status_bytes):
+        self.status_bytes = iter(status_bytes)
+        self.writes = []
+        self.polls = 0
+
+    def _write(self, data, encoding='utf-8'):
+        self.writes.append(data)
+
+    def _read_stb(self):
+        self.polls += 1
+        return next(self.status_bytes)
+
+
+class SleepRecorder:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestWaitForReading:
+    def test_polls_with_increasing_interval(self, monkeypatch):
+        clock = SleepRecorder()
+        monkeypatch.setattr(common_step_execution, 'time', clock)
+        k182 = keithley182([0, 0, 0, 0x08])
+        assert wait_for_reading(k182)
+        assert k182.polls == 4
+        assert clock.sleeps == [0.005, 0.01, 0.02]
+        # The reading done bit is enabled in the SRQ mask once
+        assert wait_for_reading(keithley182([0x08])) and k182.writes == ['M8X']
+        k182.status_bytes = iter([0x08])
+        wait_for_reading(k182)
+        assert k182.writes == ['M8X']
+
+    def test_timeout(self, monkeypatch):
+        monkeypatch.setattr(common_step_execution, 'time', SleepRecorder())
+        k182 = keithley182(itertools.repeat(0))
+        with pytest.raises(vxi11.vxi11.Vxi11Exception):
+            wait_for_reading(k182, timeout=1)
+
+    # Drivers without a known ready bit are left to their blocking fetch
+    def test_unknown_driver(self):
+        assert not wait_for_reading(fake_session(1.0))
+
+    # The W4920 has no ready bit, its reading time is counted from the initiate
+    def test_reading_time(self, monkeypatch):
+        clock = SleepRecorder()
+        monkeypatch.setattr(common_step_execution, 'time', clock)
+        wavetek4920 = type('wavetek4920', (), {})
+        assert wait_for_reading(wavetek4920())
+        clock.now = 10.0
+        assert wait_for_reading(wavetek4920(), started=9.0)
+        clock.now = 20.0
+        assert wait_for_reading(wavetek4920(), started=15.0)
+        assert clock.sleeps == [4, 3.0]
+
+
+def failing_read_row(errors):
+    errors = iter(errors)
+
+    def read_row(inits, instruments):
+        error = next(errors, None)
+        if error:
+            raise error
+        return {'value': 1.0}, True
+    return read_row
+
+
+class ClearRecorder:
+    def __init__(self):
+        self.clears = 0
+
+    def _clear(self):
+        self.clears += 1
+
+
+class TestRetryPolicy:
+    def test_classify_error(self):
+        assert classify_error(OverRangeError('9.9e37')) == ErrorKind.OVER_RANGE
+        assert classify_error(vxi11.vxi11.Vxi11Exception(15, 'read')) == ErrorKind.TIMEOUT
+        assert classify_error(vxi11.vxi11.Vxi11Exception(17, 'read')) == ErrorKind.TRANSIENT
+        assert classify_error(ConnectionResetError()) == ErrorKind.TRANSIENT
+        assert classify_error(KeyError('k2000')) is None
+
+    def test_retry_with_backoff(self, monkeypatch):
+        clock = SleepRecorder()
+        monkeypatch.setattr(common_step_execution, 'time', clock)
+        session = ClearRecorder()
+        step = Step3(Dut('SR104', '10 kOhm', Res4WDutSettings(value=10e3, range=10e3)), [Instrument('k2000', FourWireResistanceCommand(10e3))])
+        policy = RetryPolicy()
+        csvw = ListWriter()
+        errors = [vxi11.vxi11.Vxi11Exception(17, 'read'), vxi11.vxi11.Vxi11Exception(15, 'read'), OverRangeError('9.9e37')]
+        take_single_sample(step, {'k2000': session}, csvw, failing_read_row(errors), 1, policy)
+        assert len(csvw.rows) == 1
+        assert clock.sleeps == [1, 2, 4]
+        # Only the timeout clears the instrument
+        assert session.clears == 1
+        assert policy.counters == {'transient': 1, 'timeout': 1, 'over_range': 1}
+        # The backoff starts again after a good reading
+        assert policy.backoff() == 1
+
+    # An instrument that does not recover fails the step instead of stalling it
+    def test_retries_per_step(self, monkeypatch):
+        monkeypatch.setattr(common_step_execution, 'time', SleepRecorder())
+        step = Step3(Dut('SR104', '10 kOhm', Res4WDutSettings(value=10e3, range=10e3)), [Instrument('k2000', FourWireResistanceCommand(10e3))])
+        policy = RetryPolicy(retries_per_step=3)
+        with pytest.raises(OverRangeError):
+            take_single_sample(step, {'k2000': ClearRecorder()}, ListWriter(), failing_read_row(itertools.repeat(OverRangeError('9.9e37'))), 1, policy)
+        assert policy.counters == {'over_range': 4, 'exhausted': 1}
+        policy.start_step()
+        take_single_sample(step, {'k2000': ClearRecorder()}, ListWriter(), failing_read_row([OverRangeError('9.9e37')]), 1, policy)
+
+    # Errors that are not I/O errors are raised at once, without going through the policy
+    def test_other_errors_not_retried(self):
+        step = Step3(Dut('SR104', '10 kOhm', Res4WDutSettings(value=10e3, range=10e3)), [Instrument('k2000', FourWireResistanceCommand(10e3))])
+        policy = RetryPolicy()
+        policy.retry = lambda error, sessions=(): pytest.fail(f'{error!r} passed to the retry policy')
+        for error in (KeyError('k2000'), ValueError('could not convert string to float'), AttributeError('measurement')):
+            def read_burst(inits, instruments, count):
+                raise error
+            with pytest.raises(type(error)):
+                take_single_sample(step, {}, ListWriter(), failing_read_row([error]), 1, policy)
+            with pytest.raises(type(error)):
+                sample_input_burst(0, step, {}, ListWriter(), read_burst, 4, retry_policy=policy)
+        assert not policy.counters
+
+
+def readings_read_row(readings):
+    # A temperature row without measurement before every reading
+    readings = iter(readings)
+    rows = itertools.cycle([False, True])
+
+    def read_row(inits, instruments):
+        if not next(rows):
+            return {'datetime': 'temp', 'temp_2': 36.5}, False
+        value = next(readings)
+        return {'datetime': f'{value}', 'k2000_ohm': value, 'ag3458a_2_range': 10e3, '3458a_2_function': 'OHMF', 'temp_2': None}, True
+    return read_row
+
+
+class TestStepStatistics:
+    def test_running_statistics(self):
+        values = [10e3 + 1e-3 * i for i in (3, -1, 4, -1, 5, -9, 2, -6)]
+        running = RunningStatistics()
+        for value in values:
+            running.add(value)
+        assert running.n == 8
+        assert running.mean == pytest.approx(statistics.fmean(values), rel=1e-15)
+        assert running.std == pytest.approx(statistics.stdev(values), rel=1e-9)
+        assert running.sem == pytest.approx(statistics.stdev(values) / 8 ** 0.5, rel=1e-9)
+        assert (running.min, running.max) == (min(values), max(values))
+        assert RunningStatistics(n=1).std is None
+
+    # One record per numeric column and step, the rows without measurement are not counted
+    def test_summary_per_step(self, monkeypatch):
+        monkeypatch.setattr(common_step_execution, 'beep', lambda: None)
+        monkeypatch.setattr(common_step_execution, 'setup_dut', lambda step, inits: None)
+        instrument = Instrument('k2000', FourWireResistanceCommand(100))
+        procedure = [Step3(Dut('DUT1', '100 Ohm', Res4WDutSettings(value=100, range=100)), [instrument]),
+                     Step3(Dut('DUT2', '100 Ohm', Res4WDutSettings(value=100, range=100)), [instrument])]
+        csvw, sink = ListWriter(), ListWriter()
+        run_procedure(csvw, procedure, {'k2000': fake_session(1.5)}, readings_read_row([1, 2, 3, 4, 6, 8]), 3, 0, step_statistics=StepStatistics(sink))
+        assert len(csvw.rows) == 12
+        # Only the measurements of the instruments of the step, not the settings or the columns of other instruments
+        assert [(record['step'], record['dut'], record['column']) for record in sink.rows] == [(1, 'DUT1', 'k2000_ohm'), (2, 'DUT2', 'k2000_ohm')]
+        assert sink.rows[1]['n'] == 3
+        assert sink.rows[1]['mean'] == pytest.approx(6)
+        assert sink.rows[1]['std'] == pytest.approx(2)
+        assert (sink.rows[1]['min'], sink.rows[1]['max'], sink.rows[1]['first'], sink.rows[1]['last']) == (4, 8, '4', '8')
+        assert set(sink.rows[0]) == set(STEP_STATISTICS_FIELDNAMES)
+
+    def test_is_measurement_column(self):
+        assert is_measurement_column('ag3458a_2_ohm', ['ag3458a_2', 'k2000'])
+        assert is_measurement_column('k2000_d4910_avg_f732a1', ['k2000'])
+        assert is_measurement_column('k2000_20_ohm', ['k2000', 'k2000_20'])
+        assert not is_measurement_column('k2000_20_ohm', ['k2000'])
+        assert not is_measurement_column('ag3458a_2_range', ['ag3458a_2'])
+        assert not is_measurement_column('ag3458a_2_delay', ['ag3458a_2'])
+        assert not is_measurement_column('ag3458a_2_trigger', ['ag3458a_2'])
+        assert not is_measurement_column('temp_2', ['ag3458a_2'])
+
+    # The writer of a step has the csv.DictWriter interface of the log
+    def test_statistics_writer(self):
+        csvw, sink = ListWriter(), ListWriter()
+        csvw.writeheader = lambda: csvw.rows.append('header')
+        step_statistics = StepStatistics(sink)
+        writer = step_statistics.start_step(0, Step3(Dut('DUT1', '100 Ohm', Res4WDutSettings(value=100, range=100)), [Instrument('k2000', FourWireResistanceCommand(100))]), csvw)
+        writer.writeheader()
+        writer.writerows([{'dut': 'DUT1', 'k2000_ohm': 1.0}, {'dut': 'DUT1', 'k2000_ohm': 3.0}])
+        step_statistics.end_step()
+        assert csvw.rows[0] == 'header'
+        assert len(csvw.rows) == 3
+        assert sink.rows[0]['mean'] == 2.0
+
+
+class FakeDriver:
+    def __init__(self, messages, error=None):
+        self.messages = messages
+        self.error = error
+
+    def _write(self, data, encoding='utf-8'):
+        if self.error:
+            raise self.error
+        self.messages.append((self, data))
+
+    def _ask(self, data, num=-1, encoding='utf-8'):
+        self.messages.append((self, data))
+        return '1'
+
+
+class agilent3458A(FakeDriver):
+    pass
+
+
+class keithley2000(FakeDriver):
+    pass
+
+
+class wavetek4950(FakeDriver):
+    pass
+
+
+class TestCommandBatches:
+    def test_hp_ml_commands_joined(self):
+        messages = []
+        ag3458a = agilent3458A(messages)
+        with command_batches([ag3458a]):
+            ag3458a._write('FUNC OHMF')
+            ag3458a._write('RANGE 10000')
+            assert messages == []
+        assert messages == [(ag3458a, 'FUNC OHMF;RANGE 10000')]
+        assert '_write' not in vars(ag3458a)
+
+    def test_scpi_commands_from_root(self):
+        messages = []
+        k2000 = keithley2000(messages)
+        with command_batches([k2000]):
+            k2000._write(':SENS:FUNC "FRES"')
+            k2000._write('FRES:RANG 10000')
+            k2000._write('*CLS')
+        assert messages == [(k2000, ':SENS:FUNC "FRES";:FRES:RANG 10000;*CLS')]
+
+    # Other command languages are written one command at a time as before
+    def test_unknown_language_not_batched(self):
+        messages = []
+        w4950 = wavetek4950(messages)
+        with command_batches([w4950, None]):
+            w4950._write('DCV')
+            assert messages == [(w4950, 'DCV')]
+
+    # A query sends the pending commands of all instruments first, in the order they were changed
+    def test_query_flushes_in_order(self):
+        messages = []
+        ag3458a, k2000 = agilent3458A(messages), keithley2000(messages)
+        with command_batches([k2000, ag3458a]):
+            ag3458a._write('FUNC OHMF')
+            k2000._write(':FRES:RANG 10000')
+            k2000._ask(':FRES:RANG?')
+            ag3458a._write('RANGE 10000')
+        assert messages == [(ag3458a, 'FUNC OHMF'), (k2000, ':FRES:RANG 10000'), (k2000, ':FRES:RANG?'), (ag3458a, 'RANGE 10000')]
+
+    def test_failed_batch_invalidates_state_cache(self):
+        ag3458a = agilent3458A([], error=IOError('timeout'))
+        ag3458a.state_cache = {'range': 10e3}
+        with pytest.raises(IOError):
+            with command_batches([ag3458a]):
+                ag3458a._write('RANGE 10000')
+        assert ag3458a.state_cache == {}
@@ -0,0 +1,83 @@
+import datetime
+import os
+
+import pytest
+
+from compact_logs import LogCompactor, log_columns, scan_kinds, script_fieldnames
+from log_sink import CsvSink
+
+FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'ag3458a_2_ohm', 'temp_2', 'last_acal_2', '3458a_2_function')
+
+SCRIPT = f"""#!/usr/bin/python3
+import ivi
+
+OUTPUT_FILE = 'comparison.csv'
+FIELDNAMES = {FIELDNAMES + ('k2000_ohm',)!r}
+DEBUG = False
+"""
+
+
+@pytest.fixture
+def pyarrow():
+    return pytest.importorskip('pyarrow')
+
+
+def write_log(path, count, torn=False):
+    start = datetime.datetime(2024, 1, 31, 20)
+    with CsvSink(str(path), FIELDNAMES) as sink:
+        for i in range(count):
+            timestamp = (start + datetime.timedelta(hours=i)).isoformat()
+            if i % 4 == 3:
+                sink.writerow({'datetime': timestamp, 'temp_2': 36.1, 'last_acal_2': start.isoformat()})
+            else:
+                sink.writerow({'datetime': timestamp, 'dut': 'SR104' if i % 2 else 'F732A', 'dut_setting': '10 kOhm',
+                               'ag3458a_2_ohm': 10e3 + i * 1e-3, '3458a_2_function': 'OHMF'})
+    if torn:
+        with open(path, 'ab') as f:
+            f.write(b'2024-02-03T00:00:00,SR104,10 k')
+
+
+def test_script_fieldnames(tmp_path):
+    (tmp_path / 'comparison-log.py').write_text(SCRIPT)
+    (tmp_path / 'helper.py').write_text('FIELDNAMES = ("a",)\n')
+    assert script_fieldnames(str(tmp_path)) == {'comparison.csv': FIELDNAMES + ('k2000_ohm',)}
+
+
+def test_log_columns():
+    assert log_columns(('datetime', 'old', 'value'), ('datetime', 'value', 'new')) == ['datetime', 'value', 'new', 'old']
+    assert log_columns(('datetime', 'value'), None) == ['datetime', 'value']
+
+
+def test_scan_kinds(tmp_path):
+    path = tmp_path / 'log.csv'
+    path.write_text('datetime,k2000_ohm,value\r\n2024-01-01T00:00:00,100.1,open\r\n2024-01-01T00:00:01,,1.0\r\n2024-01-01T00:0')
+    assert scan_kinds(str(path), ['datetime', 'k2000_ohm', 'value']) == ({'datetime': 'timestamp', 'k2000_ohm': 'float', 'value': 'string'}, 2, 1)
+
+
+class TestLogCompactor:
+    # Rows are partitioned by month and dut, typed by the FIELDNAMES of the script, and a torn last row is left out
+    def test_compact(self, tmp_path, pyarrow):
+        import pyarrow.dataset
+        (tmp_path / 'comparison-log.py').write_text(SCRIPT)
+        write_log(tmp_path / 'comparison.csv', 60, torn=True)
+        output_path = str(tmp_path / 'comparison.parquet')
+        assert LogCompactor(str(tmp_path), batch_rows=16).compact(str(tmp_path / 'comparison.csv'), output_path) == 60
+        assert sorted(os.listdir(output_path)) == ['month=2024-01', 'month=2024-02']
+        assert sorted(os.listdir(os.path.join(output_path, 'month=2024-02'))) == ['dut=F732A', 'dut=SR104', 'dut=__HIVE_DEFAULT_PARTITION__']
+        dataset = pyarrow.dataset.dataset(output_path, format='parquet', partitioning='hive')
+        schema = dataset.schema
+        assert schema.field('datetime').type == pyarrow.timestamp('us')
+        assert schema.field('ag3458a_2_ohm').type == pyarrow.float64()
+        assert schema.field('dut_setting').type == pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        table = dataset.to_table(filter=pyarrow.dataset.field('dut') == 'SR104')
+        assert table.num_rows == 15
+        assert table.column('k2000_ohm').null_count == 15
+        assert sorted(table.column('ag3458a_2_ohm').to_pylist())[0] == pytest.approx(10e3 + 1e-3)
+
+    def test_existing_dataset_not_overwritten(self, tmp_path, pyarrow):
+        write_log(tmp_path / 'log.csv', 8)
+        compactor = LogCompactor(str(tmp_path))
+        compactor.compact(str(tmp_path / 'log.csv'), str(tmp_path / 'log.parquet'))
+        with pytest.raises(pyarrow.ArrowInvalid):
+            compactor.compact(str(tmp_path / 'log.csv'), str(tmp_path / 'log.parquet'))
+        assert compactor.compact(str(tmp_path / 'log.csv'), str(tmp_path / 'log.parquet'), overwrite=True) == 8
@@ -0,0 +1,96 @@
+import json
+
+import ivi
+import pytest
+
+import common_step_execution
+import latency_stats
+from common_step_execution import Dut, FourWireResistanceCommand, Instrument, Res4WDutSettings, Step3, initiate_and_fetch, run_procedure
+from latency_stats import BUCKET_COUNT, LatencyHistogram, LatencyRecorder, bucket_index, bucket_start, command_header, install_if_enabled
+from simulated_instruments import SimulationConfig, install, uninstall
+
+
+class ListWriter:
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+
+
+@pytest.fixture
+def bench():
+    yield install(SimulationConfig(integration_time=0, gpib_latency=0, seed=1))
+    uninstall()
+
+
+@pytest.fixture
+def recorder(tmp_path):
+    yield latency_stats.install(LatencyRecorder(str(tmp_path / 'latency_stats.json')))
+    latency_stats.uninstall()
+
+
+class TestLatencyHistogram:
+    @pytest.mark.parametrize('microseconds', [0, 1, 127, 128, 255, 256, 1000, 123456, 10 ** 9])
+    def test_bucket_holds_value(self, microseconds):
+        index = bucket_index(microseconds)
+        assert bucket_start(index) <= microseconds < bucket_start(index + 1)
+        assert bucket_start(index + 1) - bucket_start(index) <= max(1, microseconds / 64)
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        for milliseconds in range(1, 1001):
+            histogram.record(milliseconds / 1e3)
+        assert histogram.value_at_percentile(50) == pytest.approx(0.5, rel=0.016)
+        assert histogram.value_at_percentile(99) == pytest.approx(0.99, rel=0.016)
+        assert histogram.value_at_percentile(100) == 1.0
+        assert histogram.summary()['mean'] == pytest.approx(0.5005)
+        assert len(histogram.counts) == BUCKET_COUNT
+
+    def test_out_of_range_values_clamped(self):
+        histogram = LatencyHistogram()
+        histogram.record(-1)
+        histogram.record(1e9)
+        assert sum(histogram.counts) == 2
+        assert histogram.max == 1e9
+
+
+def test_command_header():
+    assert command_header('FUNC OHMF;RANGE 10000') == 'FUNC;RANGE'
+    assert command_header(b':SENS:FUNC "FRES"') == ':SENS:FUNC'
+    assert command_header('TEMP?') == 'TEMP?'
+    assert command_header('NRDGS 8,AUTO') == 'NRDGS'
+
+
+class TestLatencyRecorder:
+    def test_instrument_session(self, bench, recorder):
+        k2000 = ivi.keithley.keithley2000('TCPIP::gpib1::gpib,16::INSTR')
+        recorder.instrument(k2000, 'k2000')
+        recorder.instrument(k2000, 'k2000')
+        k2000.range = 10e3
+        k2000.measurement.read(360)
+        snapshot = recorder.snapshot()['k2000']
+        assert snapshot['_write range']['count'] == 1
+        assert snapshot['_ask FETCH?']['count'] == 1
+        assert snapshot['measurement.read']['count'] == 1
+
+    def test_install_if_enabled(self):
+        try:
+            assert install_if_enabled({}) is None
+            assert install_if_enabled({'LATENCY_STATS': '1'}).path == 'latency_stats.json'
+            assert install_if_enabled({'LATENCY_STATS': '/tmp/stats.json'}).path == '/tmp/stats.json'
+        finally:
+            latency_stats.uninstall()
+
+    # The stats file is written during the procedure and at the end, where the latencies are also printed
+    def test_run_procedure(self, bench, recorder, monkeypatch, capsys):
+        monkeypatch.setattr(common_step_execution, 'beep', lambda: None)
+        recorder.interval = 0
+        inits = {'ag3458a_2': ivi.agilent.agilent3458A('TCPIP::gpib1::gpib,20::INSTR')}
+        step = Step3(Dut('SR104', '10 kOhm', Res4WDutSettings(value=10e3, range=10e3)), [Instrument('ag3458a_2', FourWireResistanceCommand(10e3))])
+        run_procedure(ListWriter(), [step], inits, lambda inits, instruments: ({'value': initiate_and_fetch(inits['ag3458a_2'], instruments[0])}, True), 3, 0)
+        with open(recorder.path) as f:
+            latencies = json.load(f)['latencies']
+        assert latencies['ag3458a_2']['measurement.fetch']['count'] == 3
+        assert latencies['ag3458a_2']['_read_stb']['count'] >= 3
+        assert 'measurement.fetch' in capsys.readouterr().out
@@ -0,0 +1,251 @@
+import csv
+import datetime
+import os
+import time
+
+import pytest
+
+import log_sink
+from log_sink import CsvSink, LogIndex, ParquetSink, field_kind, infer_field_kinds, open_log, truncate_torn_record
+
+FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'ag3458a_2_ohm', 'temp_2', 'last_acal_2', 'last_acal_2_cal72', '3458a_2_function')
+
+
+class TestFieldKinds:
+    # Kinds follow the naming of the FIELDNAMES of the scripts
+    def test_field_kind(self):
+        assert field_kind('datetime') == 'timestamp'
+        assert field_kind('last_acal_2') == 'timestamp'
+        assert field_kind('last_acal_2_cal72') == 'string'
+        assert field_kind('3458a_2_function') == 'string'
+        assert field_kind('dut') == 'string'
+        assert field_kind('ag3458a_2_ohm') == 'float'
+        assert field_kind('lm399-1-20') == 'float'
+        assert field_kind('k2000_trigger') == 'timestamp'
+        assert field_kind('column') == 'string'
+
+    # A float column with text in it falls back to string
+    def test_infer_field_kinds_with_text(self):
+        kinds = infer_field_kinds(('value', 'k2000_ohm'), [{'value': 'open', 'k2000_ohm': 100.0}, {'value': 1.0, 'k2000_ohm': ''}])
+        assert kinds == {'value': 'string', 'k2000_ohm': 'float'}
+
+
+class TestCsvSink:
+    # The header is only written to a new file
+    def test_header_written_once(self, tmp_path):
+        path = str(tmp_path / 'log.csv')
+        for value in (1.0, 2.0):
+            with CsvSink(path, ('datetime', 'value')) as sink:
+                sink.writerow({'datetime': '2024-01-01T00:00:00', 'value': value})
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+        assert [row['value'] for row in rows] == ['1.0', '2.0']
+
+    # A log written with other fieldnames is not appended to
+    def test_other_fieldnames_refused(self, tmp_path):
+        path = tmp_path / 'log.csv'
+        with CsvSink(str(path), ('datetime', 'value')) as sink:
+            sink.writerow({'datetime': '2024-01-01T00:00:00', 'value': 1.0})
+        with pytest.raises(ValueError):
+            CsvSink(str(path), ('datetime', 'value', 'k2000_trigger'))
+        assert path.read_bytes() == b'datetime,value\r\n2024-01-01T00:00:00,1.0\r\n'
+
+    # A torn last record from a crash is removed before appending
+    def test_torn_record_removed_on_open(self, tmp_path):
+        path = tmp_path / 'log.csv'
+        path.write_bytes(b'datetime,value\r\n2024-01-01T00:00:00,1.0\r\n2024-01-01T00:0')
+        with CsvSink(str(path), ('datetime', 'value')) as sink:
+            sink.writerow({'datetime': '2024-01-01T00:00:02', 'value': 2.0})
+        assert path.read_bytes() == b'datetime,value\r\n2024-01-01T00:00:00,1.0\r\n2024-01-01T00:00:02,2.0\r\n'
+
+    # A file with only a torn header is emptied, and a complete file is left alone
+    def test_truncate_torn_record(self, tmp_path):
+        path = tmp_path / 'log.csv'
+        path.write_bytes(b'datetime,va')
+        assert truncate_torn_record(str(path)) == 11
+        assert path.read_bytes() == b''
+        path.write_bytes(b'datetime,value\r\n')
+        assert truncate_torn_record(str(path)) == 0
+        assert truncate_torn_record(str(tmp_path / 'missing.csv')) == 0
+
+    # Rows are committed in groups, with one fsync per group instead of per row
+    def test_group_commit(self, tmp_path, monkeypatch):
+        fsyncs = []
+        real_fsync = os.fsync
+        monkeypatch.setattr(log_sink.os, 'fsync', lambda fd: fsyncs.append(fd) or real_fsync(fd))
+        path = tmp_path / 'log.csv'
+        sink = CsvSink(str(path), ('datetime', 'value'), commit_interval=60, commit_rows=10)
+        for i in range(25):
+            sink.writerow({'datetime': '2024-01-01T00:00:00', 'value': i})
+        assert len(fsyncs) == 3
+        assert len(path.read_text().splitlines()) == 21
+        sink.close()
+        assert len(fsyncs) == 4
+        assert len(path.read_text().splitlines()) == 26
+
+    # Pending rows are committed after the commit interval even if no more rows arrive
+    def test_commit_after_interval(self, tmp_path):
+        path = tmp_path / 'log.csv'
+        sink = CsvSink(str(path), ('datetime', 'value'), commit_interval=0.05)
+        sink.writerow({'datetime': '2024-01-01T00:00:00', 'value': 1.0})
+        assert len(path.read_text().splitlines()) == 1
+        time.sleep(0.3)
+        assert len(path.read_text().splitlines()) == 2
+        sink.close()
+
+    # Commit callbacks get the number of rows on disk after every commit
+    def test_commit_callback(self, tmp_path):
+        commits = []
+        sink = CsvSink(str(tmp_path / 'log.csv'), ('datetime', 'value'), commit_interval=60, commit_rows=2)
+        sink.on_commit(commits.append)
+        sink.on_commit(commits.append)
+        for i in range(3):
+            sink.writerow({'datetime': '2024-01-01T00:00:00', 'value': i})
+        assert (sink.rows_written, sink.rows_committed, commits) == (3, 2, [2])
+        sink.close()
+        assert commits == [2, 3]
+
+
+def comparison_rows(start, hours, dut):
+    # A row every 20 minutes, with a temperature row without dut every hour
+    for i in range(hours * 3):
+        timestamp = (start + datetime.timedelta(minutes=20 * i)).isoformat()
+        if i % 3 == 2:
+            yield {'datetime': timestamp, 'temp_2': 36.1}
+        else:
+            yield {'datetime': timestamp, 'dut': dut, 'dut_setting': '10 kOhm', 'ag3458a_2_ohm': 10e3 + i * 1e-3, '3458a_2_function': 'OHMF'}
+
+
+class TestLogIndex:
+    # Blocks are runs of rows with the same dut, setting, function and hour
+    def test_blocks(self, tmp_path):
+        path = str(tmp_path / 'log.csv')
+        start = datetime.datetime(2024, 1, 1)
+        with CsvSink(path, FIELDNAMES, index=True) as sink:
+            for row in comparison_rows(start, 2, 'SR104'):
+                sink.writerow(row)
+        blocks = LogIndex(path).blocks
+        assert [block.key for block in blocks] == [('SR104', '10 kOhm', 'OHMF', '2024-01-01T00'), ('', '', '', '2024-01-01T00'),
+                                                   ('SR104', '10 kOhm', 'OHMF', '2024-01-01T01'), ('', '', '', '2024-01-01T01')]
+        assert [block.rows for block in blocks] == [2, 1, 2, 1]
+        assert blocks[-1].end == os.path.getsize(path)
+
+    # Appended rows are indexed from the end of the last block, a torn row only once it is complete
+    def test_incremental_update(self, tmp_path):
+        path = str(tmp_path / 'log.csv')
+        start = datetime.datetime(2024, 1, 1)
+        with open_log(path, FIELDNAMES, index=True) as sink:
+            for row in comparison_rows(start, 1, 'SR104'):
+                sink.writerow(row)
+        with open_log(path, FIELDNAMES, index=True) as sink:
+            for row in comparison_rows(start + datetime.timedelta(hours=1), 1, 'F732A'):
+                sink.writerow(row)
+        index = LogIndex(path)
+        assert len(index.blocks) == 4
+        with open(path, 'ab') as f:
+            f.write(b'2024-01-01T02:00:00,F732A,10 kOhm,10000.5')
+        assert index.update() == []
+        with open(path, 'ab') as f:
+            f.write(b',,,,OHMF\r\n')
+        assert [block.key for block in index.update()] == [('F732A', '10 kOhm', 'OHMF', '2024-01-01T02')]
+        assert index.end == os.path.getsize(path)
+
+    # Only the blocks of the dut and hours are read
+    def test_rows(self, tmp_path):
+        path = str(tmp_path / 'log.csv')
+        start = datetime.datetime(2024, 1, 1)
+        with CsvSink(path, FIELDNAMES) as sink:
+            for dut in ('SR104', 'F732A', 'SR104'):
+                for row in comparison_rows(start, 2, dut):
+                    sink.writerow(row)
+                start += datetime.timedelta(hours=2)
+        index = LogIndex(path)
+        rows = list(index.rows(dut='SR104', start=datetime.datetime(2024, 1, 1, 1), end=datetime.datetime(2024, 1, 1, 5, 20)))
+        assert [row['datetime'] for row in rows] == ['2024-01-01T01:00:00', '2024-01-01T01:20:00', '2024-01-01T04:00:00', '2024-01-01T04:20:00',
+                                                     '2024-01-01T05:00:00']
+        assert len(index.find(dut='SR104', start=datetime.datetime(2024, 1, 1, 1), end=datetime.datetime(2024, 1, 1, 5, 20))) == 3
+        assert len(list(index.rows(function='OHMF'))) == 12
+        assert len(list(index.rows(dut='F732A', dut_setting='1 kOhm'))) == 0
+
+    # A log that was replaced by a shorter one is reindexed
+    def test_reindex_shorter_log(self, tmp_path):
+        path = str(tmp_path / 'log.csv')
+        with CsvSink(path, FIELDNAMES, index=True) as sink:
+            for row in comparison_rows(datetime.datetime(2024, 1, 1), 2, 'SR104'):
+                sink.writerow(row)
+        os.remove(path)
+        with CsvSink(path, FIELDNAMES, index=True) as sink:
+            sink.writerow({'datetime': '2024-02-01T00:00:00', 'dut': 'F732A'})
+        assert [block.dut for block in LogIndex(path).blocks] == ['F732A']
+
+
+class TestParquetSink:
+    @pytest.fixture(autouse=True)
+    def pyarrow(self):
+        return pytest.importorskip('pyarrow')
+
+    def rows(self, count):
+        start = datetime.datetime(2024, 1, 1)
+        for i in range(count):
+            yield {'datetime': (start + datetime.timedelta(seconds=i)).isoformat(), 'dut': 'SR104', 'dut_setting': '10 kOhm',
+                   'ag3458a_2_ohm': 10e3 + i * 1e-3 if i % 5 else None, 'temp_2': None if i % 5 else 36.1,
+                   'last_acal_2': start.isoformat(), 'last_acal_2_cal72': 'keep'}
+
+    # Rows come back typed, with empty measurements as nulls
+    def test_typed_columns(self, tmp_path):
+        import pyarrow.parquet
+        path = str(tmp_path / 'log.parquet')
+        with open_log(path, FIELDNAMES) as sink:
+            assert isinstance(sink, ParquetSink)
+            for row in self.rows(10):
+                sink.writerow(row)
+        table = pyarrow.parquet.read_table(path)
+        assert table.num_rows == 10
+        assert str(table.schema.field('datetime').type) == 'timestamp[us]'
+        assert str(table.schema.field('ag3458a_2_ohm').type) == 'double'
+        assert str(table.schema.field('dut').type) == 'dictionary<values=string, indices=int32, ordered=0>'
+        assert table.column('ag3458a_2_ohm').null_count == 2
+        assert table.column('temp_2').to_pylist()[0] == 36.1
+        assert table.column('3458a_2_function').null_count == 10
+
+    # Row groups are written as they fill up, and a part file is closed every file_row_groups row groups and on every flush
+    def test_row_groups_and_flush(self, tmp_path):
+        import pyarrow.parquet
+        path = tmp_path / 'log.parquet'
+        sink = ParquetSink(str(path), FIELDNAMES, row_group_size=4, file_row_groups=2)
+        for row in list(self.rows(10))[:6]:
+            sink.writerow(row)
+        sink.flush()
+        assert pyarrow.parquet.read_table(str(path)).num_rows == 6
+        for row in self.rows(10):
+            sink.writerow(row)
+        # The first two row groups of the second batch are readable before the sink is closed
+        assert pyarrow.parquet.read_table(str(path)).num_rows == 14
+        sink.close()
+        files = sorted(path.iterdir())
+        assert [pyarrow.parquet.ParquetFile(str(file)).num_row_groups for file in files] == [2, 2, 1]
+        assert pyarrow.parquet.read_table(str(path)).num_rows == 16
+
+    # Rows count as committed once their part file is closed
+    def test_commit_callback(self, tmp_path):
+        commits = []
+        sink = ParquetSink(str(tmp_path / 'log.parquet'), FIELDNAMES, row_group_size=4, file_row_groups=2)
+        sink.on_commit(commits.append)
+        for row in self.rows(10):
+            sink.writerow(row)
+        assert (sink.rows_written, sink.rows_committed, commits) == (10, 8, [8])
+        sink.close()
+        assert commits == [8, 10]
+
+    # The schema follows the fieldnames, a value that doesn't fit its column is written as null instead of failing the run
+    def test_bad_values_are_null(self, tmp_path):
+        import pyarrow.parquet
+        path = str(tmp_path / 'log.parquet')
+        rows = list(self.rows(4))
+        rows[2]['ag3458a_2_ohm'] = 'OVLD'
+        with ParquetSink(path, FIELDNAMES, row_group_size=2) as sink:
+            for row in rows:
+                sink.writerow(row)
+        table = pyarrow.parquet.read_table(path)
+        assert str(table.schema.field('ag3458a_2_ohm').type) == 'double'
+        assert table.column('ag3458a_2_ohm').to_pylist() == [None, 10e3 + 1e-3, None, 10e3 + 3e-3]
@@ -0,0 +1,63 @@
+import datetime
+
+import numpy
+import pytest
+
+from log_sink import CsvSink
+from mapped_log import MappedLog, find_newlines
+
+FIELDNAMES = ('datetime', 'dut', 'k182_dcv', 'temp_2')
+START = datetime.datetime(2024, 1, 1)
+
+
+def write_log(path, count, torn=False):
+    with CsvSink(str(path), FIELDNAMES) as sink:
+        for i in range(count):
+            row = {'datetime': (START + datetime.timedelta(seconds=5 * i)).isoformat()}
+            # Every fifth row is a temperature row
+            row.update({'temp_2': 36.5} if i % 5 == 4 else {'dut': 'F7001bat, 10 V' if i % 2 else 'SR104', 'k182_dcv': 1e-3 + i * 1e-9})
+            sink.writerow(row)
+    if torn:
+        with open(path, 'ab') as f:
+            f.write(b'2024-01-02T00:00:00,SR104,1.0')
+
+
+def test_find_newlines():
+    data = numpy.frombuffer(b'a\nbc\n\nd\n', dtype=numpy.uint8)
+    assert find_newlines(data).tolist() == [1, 4, 5, 7]
+    assert find_newlines(data, chunk_size=3).tolist() == [1, 4, 5, 7]
+    assert find_newlines(data[:0]).tolist() == []
+
+
+class TestMappedLog:
+    def test_columns(self, tmp_path):
+        write_log(tmp_path / 'log.csv', 100, torn=True)
+        with MappedLog(str(tmp_path / 'log.csv'), chunk_size=64) as log:
+            assert log.fieldnames == list(FIELDNAMES)
+            assert len(log) == 100
+            assert log.row(1) == {'datetime': '2024-01-01T00:00:05', 'dut': 'F7001bat, 10 V', 'k182_dcv': '0.001000001', 'temp_2': ''}
+            values = log.column('k182_dcv', slice(2, 6))
+            assert values[:2].tolist() == [1e-3 + 2e-9, 1e-3 + 3e-9]
+            assert numpy.isnan(values[2])
+            assert numpy.count_nonzero(~numpy.isnan(log.column('temp_2'))) == 20
+            timestamps = log.timestamps(slice(98, None))
+            assert timestamps.dtype == numpy.dtype('datetime64[us]')
+            assert timestamps.tolist() == [START + datetime.timedelta(seconds=490), START + datetime.timedelta(seconds=495)]
+
+    def test_time_slice(self, tmp_path):
+        write_log(tmp_path / 'log.csv', 100)
+        with MappedLog(str(tmp_path / 'log.csv')) as log:
+            assert log.time_slice() == slice(0, 100)
+            assert log.time_slice(START + datetime.timedelta(seconds=12), START + datetime.timedelta(seconds=30)) == slice(3, 6)
+            assert log.time_slice(START + datetime.timedelta(hours=1)) == slice(100, 100)
+            arrays = log.read(['k182_dcv'], end=START + datetime.timedelta(seconds=10))
+            assert arrays['datetime'].tolist() == [START, START + datetime.timedelta(seconds=5)]
+            assert arrays['k182_dcv'].tolist() == [1e-3, 1e-3 + 1e-9]
+            with pytest.raises(KeyError):
+                log.column('k2000_dcv')
+
+    def test_empty(self, tmp_path):
+        (tmp_path / 'empty.csv').write_bytes(b'')
+        with MappedLog(str(tmp_path / 'empty.csv')) as log:
+            assert log.fieldnames == []
+            assert len(log) == 0
@@ -0,0 +1,151 @@
+import ivi
+import pytest
+
+import common_step_execution
+import simulated_instruments
+from common_step_execution import Dut, FourWireResistanceCommand, Instrument, Res4WDutSettings, Step3, initiate_and_fetch, read_burst_3458a, read_instruments_by_bus, run_procedure, wait_for_reading
+from simulated_instruments import SimulationConfig, install, install_if_requested, uninstall
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    monotonic = time
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ListWriter:
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+
+
+@pytest.fixture
+def clock():
+    return VirtualClock()
+
+
+@pytest.fixture
+def bench(clock):
+    yield install(SimulationConfig(integration_time=1.0, gpib_latency=0.01, noise_ppm=1, seed=1, clock=clock.time, sleep=clock.sleep))
+    uninstall()
+
+
+class TestSimulationConfig:
+    def test_defaults(self):
+        assert SimulationConfig.from_env('1') == SimulationConfig()
+
+    def test_settings(self):
+        config = SimulationConfig.from_env('integration_time=0.1, noise_ppm=2,seed=3')
+        assert config.integration_time == 0.1
+        assert config.noise_ppm == 2
+        assert config.seed == 3
+
+    def test_unknown_setting(self):
+        with pytest.raises(ValueError):
+            SimulationConfig.from_env('integration=0.1')
+
+
+class TestInstall:
+    # Scripts keep constructing ivi drivers and the isinstance checks in setup_dut keep working
+    def test_drivers_replaced_and_restored(self, bench):
+        assert isinstance(ivi.fluke.fluke5450a('TCPIP::gpib4::gpib0,10::INSTR'), ivi.fluke.fluke5450a)
+        assert ivi.agilent.agilent3458A is simulated_instruments.Agilent3458A
+        uninstall()
+        assert getattr(ivi.agilent, 'agilent3458A', None) is not simulated_instruments.Agilent3458A
+
+    def test_install_if_requested(self):
+        assert install_if_requested({}) is None
+        try:
+            assert install_if_requested({'INSTRUMENT_SIMULATION': 'noise_ppm=0'}).config.noise_ppm == 0
+        finally:
+            uninstall()
+
+
+class TestSimulatedInstruments:
+    # Without a source the meter reads its range, with noise of about noise_ppm
+    def test_reading_without_source(self, bench):
+        ag3458a = ivi.agilent.agilent3458A('TCPIP::gpib1::gpib,20::INSTR', reset=True)
+        ag3458a.range = 10e3
+        assert ag3458a.measurement.read(360) == pytest.approx(10e3, rel=10e-6)
+
+    def test_reading_enabled_source(self, bench):
+        ag3458a = ivi.agilent.agilent3458A('TCPIP::gpib1::gpib,20::INSTR')
+        f5450a = ivi.fluke.fluke5450a('TCPIP::gpib4::gpib0,10::INSTR')
+        f5450a.output.value = 1e3
+        f5450a.output.enabled = 'on'
+        assert ag3458a.measurement.read(360) == pytest.approx(1e3, rel=10e-6)
+        f5450a.output.enabled = False
+        assert ag3458a.measurement.read(360) == pytest.approx(ag3458a.range, rel=10e-6)
+
+    # A reading takes the integration time plus the GPIB transactions
+    def test_integration_time_and_latency(self, bench, clock):
+        k2000 = ivi.keithley.keithley2000('TCPIP::gpib1::gpib,16::INSTR')
+        k2000.measurement.initiate()
+        k2000.measurement.fetch(360)
+        assert clock.now == pytest.approx(1.01 + 0.01)
+
+    # Setting writes cost a transaction, reading back a setting does not
+    def test_transactions_counted(self, bench):
+        k2000 = ivi.keithley.keithley2000('TCPIP::gpib1::gpib,16::INSTR')
+        k2000.measurement_function = 'four_wire_resistance'
+        k2000.range = 10e3
+        assert k2000.range == 10e3
+        assert bench.transactions == 2
+        assert list(k2000.commands) == ['measurement_function four_wire_resistance', 'range 10000.0']
+
+    def test_temp_and_acal(self, bench, clock):
+        bench.config.acal_time = 150
+        ag3458a = ivi.agilent.agilent3458A('TCPIP::gpib1::gpib,20::INSTR')
+        assert ag3458a.utility.temp == 36.0
+        ag3458a.acal.start_dcv()
+        assert clock.now >= 150
+
+    def test_read_burst(self, bench, clock):
+        ag3458a = ivi.agilent.agilent3458A('TCPIP::gpib1::gpib,20::INSTR')
+        ag3458a.range = 100
+        values = read_burst_3458a(ag3458a, 8, 'SREAL')
+        assert len(values) == 8
+        assert values == pytest.approx([100] * 8, rel=10e-6)
+        assert clock.now >= 8
+
+    # The ready bit is set once the integration time has passed, and cleared by fetching the reading
+    def test_status_byte(self, bench, clock, monkeypatch):
+        monkeypatch.setattr(common_step_execution, 'time', clock)
+        ag3458a = ivi.agilent.agilent3458A('TCPIP::gpib1::gpib,20::INSTR')
+        ag3458a.measurement.initiate()
+        assert not ag3458a._read_stb() & 0x80
+        assert wait_for_reading(ag3458a)
+        assert clock.now == pytest.approx(1.0, abs=0.2)
+        ag3458a.measurement.fetch(360)
+        assert not ag3458a._read_stb() & 0x80
+
+    # Meters armed for a bus trigger integrate together, so the row takes one integration time
+    def test_synchronised_trigger(self, bench, clock, monkeypatch):
+        monkeypatch.setattr(common_step_execution, 'time', clock)
+        inits = {'ag3458a_1': ivi.agilent.agilent3458A('TCPIP::gpib1::gpib,21::INSTR'), 'ag3458a_2': ivi.agilent.agilent3458A('TCPIP::gpib1::gpib,20::INSTR'),
+                 'k182': ivi.keithley.Keithley182('TCPIP::gpib1::gpib,8::INSTR')}
+        readings = read_instruments_by_bus(inits, list(inits), synchronised_trigger=True)
+        assert all(reading == pytest.approx(10.0, rel=1e-4) for reading in readings.values())
+        assert clock.now == pytest.approx(1.0, abs=0.2)
+        assert len({session.last_trigger for session in inits.values()}) == 1
+        assert [command for command in inits['ag3458a_1'].commands if command.startswith('TRIG')] == ['TRIG HOLD;TARM SGL', 'TRIG AUTO']
+
+    # The step engine runs on simulated instruments end to end
+    def test_run_procedure(self, bench, clock, monkeypatch):
+        monkeypatch.setattr(common_step_execution, 'beep', lambda: None)
+        monkeypatch.setattr(common_step_execution, 'time', clock)
+        inits = {'ag3458a_2': ivi.agilent.agilent3458A('TCPIP::gpib1::gpib,20::INSTR'), 'f5450a': ivi.fluke.fluke5450a('TCPIP::gpib4::gpib0,10::INSTR')}
+        procedure = [Step3(Dut('Fluke 5450A', '1 kOhm', Res4WDutSettings(range=1e3, value=1e3)), [Instrument('ag3458a_2', FourWireResistanceCommand(1e3))]),
+                     Step3(Dut('Fluke 5450A', '100 Ohm', Res4WDutSettings(range=100, value=100)), [Instrument('ag3458a_2', FourWireResistanceCommand(100))])]
+        csvw = ListWriter()
+        run_procedure(csvw, procedure, inits, lambda inits, instruments: ({'value': initiate_and_fetch(inits['ag3458a_2'], instruments[0])}, True), 2, 0)
+        assert [row['value'] for row in csvw.rows] == pytest.approx([1e3, 1e3, 100, 100], rel=10e-6)
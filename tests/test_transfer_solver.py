@@ -0,0 +1,125 @@
+import datetime
+
+import numpy
+import pytest
+
+from common_step_execution import Dut, FourWireResistanceCommand, Instrument, Res4WDutSettings, Step3, TransferDirection, generate_resistance_transfer_steps
+from log_sink import CsvSink
+from transfer_solver import chain_links, match_segments, read_transfer_log, solve_transfer, step_key
+
+REFERENCE = Dut('SR104', '10 kOhm', Res4WDutSettings(value=10e3))
+TRANSFER = Dut('Fluke 5450A', '', Res4WDutSettings())
+REFERENCE_VALUE = 10000.05
+# Gain of the meter per range
+GAINS = {10e3: 1 + 10e-6, 1e3: 1 - 5e-6, 100: 1 + 3e-6}
+SAMPLES_PER_STEP = 4
+
+
+def tempco_procedure(target: Dut):
+    # Like ks3458a-k2000-20-res-tempco-log.py: forward transfer, subject step, reverse transfer
+    instrument = Instrument('ag3458a_2', FourWireResistanceCommand(range=target.dut_setting_cmd.value))
+    start_steps = generate_resistance_transfer_steps(instrument, REFERENCE, TRANSFER, target, TransferDirection.FORWARD)[:-1]
+    subject_step = Step3(target, [instrument], True, True)
+    end_steps = generate_resistance_transfer_steps(instrument, REFERENCE, TRANSFER, target, TransferDirection.REVERSE)[1:]
+    return start_steps + [subject_step] + end_steps
+
+
+def log_rows(procedure, values, cycles, drift=0.0, noise=0.0):
+    """
+    Rows of cycles runs of procedure, with the true value of every dut by name, the target drifting by drift per row.
+    """
+    rng = numpy.random.default_rng(1)
+    rows = []
+    start = datetime.datetime(2024, 1, 1)
+    for _ in range(cycles):
+        for step in procedure:
+            for sample in range(10 if step.run_until_interrupted else SAMPLES_PER_STEP):
+                value = values[step.dut.name, step.dut.setting] + (drift * len(rows) if step.dut.name == 'X' else 0.0)
+                row = {'datetime': (start + datetime.timedelta(seconds=10 * len(rows))).isoformat(), 'dut': step.dut.name, 'dut_setting': step.dut.setting,
+                       'ag3458a_2_ohm': value * GAINS[step.instruments[0].setting.range] * (1 + rng.normal(0, noise)),
+                       'ag3458a_2_range': float(step.instruments[0].setting.range)}
+                rows.append(row)
+                if sample == 1:
+                    rows.append({'datetime': row['datetime'], 'temp_2': 36.0})
+    return rows
+
+
+def row_arrays(rows):
+    return {'datetime': numpy.array([row['datetime'] for row in rows], dtype='datetime64[us]'),
+            'dut': numpy.array([row.get('dut', '') for row in rows]), 'dut_setting': numpy.array([row.get('dut_setting', '') for row in rows]),
+            'value': numpy.array([row.get('ag3458a_2_ohm', numpy.nan) for row in rows]), 'range': numpy.array([row.get('ag3458a_2_range', numpy.nan) for row in rows])}
+
+
+def test_match_segments():
+    keys = [('a', '', 4), ('b', '', 4), ('b', '', 3), ('a', '', 4)]
+    # The last step of the first cycle and the first step of the second one form one segment
+    chunks, unmatched = match_segments(keys, [('a', '', 4), ('b', '', 4), ('b', '', 3), ('a', '', 4), ('c', '', 4), ('b', '', 4)],
+                                       [2, 2, 5, 4, 3, 2], [2, 2, None, 2])
+    assert chunks == [(0, 0, 0, 2), (0, 1, 2, 2), (0, 2, 4, 5), (0, 3, 9, 2), (1, 0, 11, 2), (1, 1, 16, 2)]
+    assert unmatched == 3
+
+
+def test_chain_links():
+    keys = [('ref', '10k', 4), ('t', '10k', 4), ('t', '1k', 4), ('t', '1k', 3), ('x', '1k', 3)]
+    assert chain_links(keys, ('ref', '10k'), ('x', '1k')) == [(('t', '1k', 4), ('ref', '10k', 4)), (('x', '1k', 3), ('t', '1k', 3))]
+    with pytest.raises(ValueError):
+        chain_links(keys[:2], ('ref', '10k'), ('x', '1k'))
+
+
+class TestSolveTransfer:
+    # The ratios on one range cancel the gain of the meter, so the target is found exactly without noise and drift
+    @pytest.mark.parametrize('target_value', [1e3, 100])
+    def test_exact(self, target_value):
+        target = Dut('X', str(target_value), Res4WDutSettings(value=target_value, range=target_value))
+        procedure = tempco_procedure(target)
+        values = {(REFERENCE.name, REFERENCE.setting): REFERENCE_VALUE, ('X', str(target_value)): target_value * (1 + 20e-6)}
+        values.update({(TRANSFER.name, step.dut.setting): step.dut.dut_setting_cmd.value * (1 - 7e-6) for step in procedure if step.dut.name == TRANSFER.name})
+        solution = solve_transfer(procedure, row_arrays(log_rows(procedure, values, 3)), REFERENCE, target, REFERENCE_VALUE,
+                                  samples_per_step=SAMPLES_PER_STEP)
+        assert solution.unmatched_rows == 0
+        assert len(solution.start) == 3
+        assert solution.forward == pytest.approx([target_value * (1 + 20e-6)] * 3, rel=1e-12)
+        assert solution.reverse == pytest.approx(solution.forward, rel=1e-12)
+        assert solution.steps['step'].tolist() == list(range(1, len(procedure) + 1)) * 3
+        assert set(solution.steps['n'].tolist()) == {SAMPLES_PER_STEP, 10}
+        assert [link.direction for link in solution.links].count(TransferDirection.REVERSE) == len(solution.links) // 2
+
+    # A drifting target makes forward and reverse differ, the average removes the drift
+    def test_drift(self):
+        target = Dut('X', '1 kOhm', Res4WDutSettings(value=1e3, range=1e3))
+        procedure = tempco_procedure(target)
+        values = {(REFERENCE.name, REFERENCE.setting): REFERENCE_VALUE, ('X', '1 kOhm'): 1e3}
+        rows = log_rows(procedure, values, 2, drift=1e-6, noise=1e-7)
+        solution = solve_transfer(procedure, row_arrays(rows), REFERENCE, target, REFERENCE_VALUE, reference_uncertainty=0.01,
+                                  samples_per_step=SAMPLES_PER_STEP)
+        assert solution.forward[0] < solution.reverse[0]
+        assert solution.value[0] == pytest.approx((solution.forward[0] + solution.reverse[0]) / 2)
+        assert solution.uncertainty[0] > abs(solution.reverse[0] - solution.forward[0]) / 4
+        assert solution.uncertainty[0] > 1e3 * 1e-6
+        assert solution.rows()[1]['cycle'] == 2
+
+    # A cycle without its reverse pass only has a forward value
+    def test_incomplete_cycle(self, tmp_path):
+        target = Dut('X', '1 kOhm', Res4WDutSettings(value=1e3, range=1e3))
+        procedure = tempco_procedure(target)
+        values = {(REFERENCE.name, REFERENCE.setting): REFERENCE_VALUE, ('X', '1 kOhm'): 1e3}
+        rows = log_rows(procedure, values, 2, noise=1e-7)
+        with CsvSink(str(tmp_path / 'log.csv'), ('datetime', 'dut_setting', 'dut', 'ag3458a_2_ohm', 'ag3458a_2_range', 'temp_2')) as sink:
+            for row in rows[:-SAMPLES_PER_STEP - 1]:
+                sink.writerow(row)
+        solution = solve_transfer(procedure, read_transfer_log(str(tmp_path / 'log.csv'), 'ag3458a_2_ohm', 'ag3458a_2_range'),
+                                  REFERENCE, target, REFERENCE_VALUE, samples_per_step=SAMPLES_PER_STEP)
+        assert numpy.isfinite(solution.reverse).tolist() == [True, False]
+        assert solution.value[1] == solution.forward[1]
+        assert solution.value[1] == pytest.approx(1e3, rel=1e-6)
+
+    def test_single_pass(self):
+        target = Dut('X', '100', Res4WDutSettings(value=100, range=100))
+        instrument = Instrument('ag3458a_2', FourWireResistanceCommand(range=100))
+        procedure = generate_resistance_transfer_steps(instrument, REFERENCE, TRANSFER, target, TransferDirection.REVERSE)
+        assert step_key(procedure[0]) == ('X', '100', 2)
+        values = {(REFERENCE.name, REFERENCE.setting): REFERENCE_VALUE, ('X', '100'): 100.001}
+        values.update({(TRANSFER.name, step.dut.setting): step.dut.dut_setting_cmd.value for step in procedure if step.dut.name == TRANSFER.name})
+        solution = solve_transfer(procedure, row_arrays(log_rows(procedure, values, 1)), REFERENCE, target, REFERENCE_VALUE)
+        assert numpy.isnan(solution.forward[0])
+        assert solution.value[0] == pytest.approx(100.001, rel=1e-12)
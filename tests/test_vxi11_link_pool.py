@@ -0,0 +1,216 @@
+import threading
+import time
+
+import ivi
+import pytest
+import vxi11
+
+import vxi11_link_pool
+from vxi11_link_pool import LinkPool, install, uninstall
+
+
+class FakeSocket:
+    def __init__(self):
+        self.timeout = None
+        self.options = {}
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def setsockopt(self, level, option, value):
+        self.options[option] = value
+
+
+class FakeCoreClient:
+    instances = []
+
+    def __init__(self, host):
+        self.host = host
+        self.sock = FakeSocket()
+        self.links = []
+        self.writes = []
+        self.fail_next_call = None
+        self.active_calls = 0
+        self.max_active_calls = 0
+        self.closed = False
+        FakeCoreClient.instances.append(self)
+
+    def create_link(self, id, lock_device, lock_timeout, name):
+        if self.fail_next_call:
+            error, self.fail_next_call = self.fail_next_call, None
+            raise error
+        self.links.append(name)
+        return 0, len(self.links), 0, 1024
+
+    def device_write(self, link, timeout, lock_timeout, flags, data):
+        if self.fail_next_call:
+            error, self.fail_next_call = self.fail_next_call, None
+            raise error
+        self.active_calls += 1
+        self.max_active_calls = max(self.max_active_calls, self.active_calls)
+        time.sleep(0.01)
+        self.active_calls -= 1
+        self.writes.append((link, self.sock.timeout, data))
+        return 0, len(data)
+
+    def device_read(self, link, request_size, timeout, lock_timeout, flags, term_char):
+        return 0, vxi11.vxi11.RX_END, b'1.0\n'
+
+    def device_docmd(self, link, flags, timeout, lock_timeout, cmd, network_order, datasize, data_in):
+        if cmd == vxi11.vxi11.CMD_BUS_STATUS:
+            return 0, b'\x00\x15'
+        self.writes.append((link, self.sock.timeout, data_in))
+        return 0, data_in
+
+    def destroy_link(self, link):
+        return 0
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool():
+    FakeCoreClient.instances = []
+    pool = LinkPool(FakeCoreClient)
+    yield pool
+    pool.close()
+
+
+class TestLinkPool:
+    # Instruments on one gateway share one connection, each with its own link
+    def test_one_channel_per_gateway(self, pool):
+        k2000 = pool.instrument('TCPIP::gpib1::gpib,16::INSTR')
+        ag3458a = pool.instrument('TCPIP::gpib1::gpib,20::INSTR')
+        w4920 = pool.instrument('TCPIP::gpib4::gpib0,4::INSTR')
+        for instrument in (k2000, ag3458a, w4920):
+            instrument.write('*CLS')
+        assert [client.host for client in FakeCoreClient.instances] == ['gpib1', 'gpib4']
+        assert FakeCoreClient.instances[0].links == [b'gpib,16', b'gpib,20']
+        assert FakeCoreClient.instances[0].sock.options
+
+    # A second init_func gets the same open instrument
+    def test_reuse_across_init(self, pool):
+        instrument = pool.instrument('TCPIP::gpib1::gpib,16::INSTR')
+        instrument.write('*CLS')
+        assert pool.instrument('TCPIP::gpib1::gpib,16::INSTR') is instrument
+        instrument.ask('READ?')
+        assert len(FakeCoreClient.instances[0].links) == 1
+
+    # Calls from different threads are serialised on the channel, with the timeout of the calling instrument
+    def test_calls_serialised(self, pool):
+        instruments = [pool.instrument(f'TCPIP::gpib1::gpib,{address}::INSTR') for address in (16, 17, 20)]
+        instruments[2].timeout = 120
+        threads = [threading.Thread(target=instrument.write, args=('INIT',)) for instrument in instruments]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        client = FakeCoreClient.instances[0]
+        assert client.max_active_calls == 1
+        assert sorted(timeout for link, timeout, data in client.writes) == [11, 11, 121]
+
+    # The interface device of a gateway, used for the GET, has a link on the same channel as the instruments
+    def test_interface_device(self, pool):
+        k2000 = pool.instrument('TCPIP::gpib1::gpib,16::INSTR')
+        k2000.write('*CLS')
+        interface_device = pool.interface_device('gpib1', 'gpib')
+        assert pool.interface_device('gpib1', 'gpib') is interface_device
+        interface_device.open()
+        interface_device.send_setup([16])
+        assert len(FakeCoreClient.instances) == 1
+        assert FakeCoreClient.instances[0].links == [b'gpib,16', b'gpib']
+        assert FakeCoreClient.instances[0].writes[-1][2] == bytes([0x40 | 21, 0x3f, 0x20 | 16])
+
+    # Closing an instrument destroys its link but keeps the channel
+    def test_close_keeps_channel(self, pool):
+        instrument = pool.instrument('TCPIP::gpib1::gpib,16::INSTR')
+        instrument.write('*CLS')
+        instrument.close()
+        assert not FakeCoreClient.instances[0].closed
+        instrument.write('*CLS')
+        assert len(FakeCoreClient.instances) == 1
+
+    # A broken connection is reconnected, and the links are recreated on the new connection. The write that found it
+    # broken is not repeated, it may have reached the instrument.
+    def test_reconnect(self, pool):
+        k2000 = pool.instrument('TCPIP::gpib1::gpib,16::INSTR')
+        ag3458a = pool.instrument('TCPIP::gpib1::gpib,20::INSTR')
+        k2000.write('*CLS')
+        ag3458a.write('*CLS')
+        FakeCoreClient.instances[0].fail_next_call = ConnectionResetError()
+        with pytest.raises(ConnectionResetError):
+            k2000.write('INIT')
+        assert FakeCoreClient.instances[0].closed
+        ag3458a.write('INIT')
+        k2000.write('INIT')
+        assert len(FakeCoreClient.instances) == 2
+        assert FakeCoreClient.instances[1].links == [b'gpib,20', b'gpib,16']
+        assert [data for link, timeout, data in FakeCoreClient.instances[1].writes] == [b'INIT', b'INIT']
+
+    # Link management is repeated on the new connection
+    def test_reconnect_retries_create_link(self, pool):
+        pool.instrument('TCPIP::gpib1::gpib,16::INSTR').write('*CLS')
+        FakeCoreClient.instances[0].fail_next_call = ConnectionResetError()
+        pool.instrument('TCPIP::gpib1::gpib,20::INSTR').write('*CLS')
+        assert len(FakeCoreClient.instances) == 2
+        assert FakeCoreClient.instances[1].links == [b'gpib,20']
+
+    # A timeout only fails the call that timed out, the channel and the links of the other instruments are kept
+    def test_timeout_keeps_channel(self, pool):
+        k2000 = pool.instrument('TCPIP::gpib1::gpib,16::INSTR')
+        ag3458a = pool.instrument('TCPIP::gpib1::gpib,20::INSTR')
+        k2000.write('*CLS')
+        ag3458a.write('*CLS')
+        FakeCoreClient.instances[0].fail_next_call = TimeoutError()
+        with pytest.raises(TimeoutError):
+            k2000.write('INIT')
+        assert not FakeCoreClient.instances[0].closed
+        ag3458a.write('INIT')
+        k2000.write('INIT')
+        assert len(FakeCoreClient.instances) == 1
+        assert len(FakeCoreClient.instances[0].links) == 2
+
+    # A reply that cannot be parsed disconnects, the next call reconnects
+    def test_rpc_error_disconnects(self, pool):
+        instrument = pool.instrument('TCPIP::gpib1::gpib,16::INSTR')
+        instrument.write('*CLS')
+        FakeCoreClient.instances[0].fail_next_call = vxi11.vxi11.rpc.RPCError('wrong xid')
+        with pytest.raises(vxi11.vxi11.rpc.RPCError):
+            instrument.write('INIT')
+        assert FakeCoreClient.instances[0].closed
+        instrument.write('INIT')
+        assert len(FakeCoreClient.instances) == 2
+
+
+class TestInstall:
+    def test_ivi_uses_pool(self, pool):
+        install(pool)
+        try:
+            assert ivi.ivi.vxi11.Instrument('TCPIP::gpib1::gpib,16::INSTR') is pool.instrument('TCPIP::gpib1::gpib,16::INSTR')
+            assert ivi.ivi.vxi11.vxi11 is vxi11.vxi11
+        finally:
+            uninstall()
+        assert ivi.ivi.vxi11 is vxi11
+
+    # The pool is closed at exit once it is installed, importing the module registers nothing
+    def test_closed_at_exit(self, pool, monkeypatch):
+        registered = []
+        monkeypatch.setattr(vxi11_link_pool.atexit, 'register', registered.append)
+        monkeypatch.setattr(vxi11_link_pool.atexit, 'unregister', registered.remove)
+        install(pool)
+        assert registered == [uninstall]
+        uninstall()
+        assert registered == []
+
+    # The pool is opt-in
+    def test_disabled_by_environment(self):
+        assert vxi11_link_pool.install_if_enabled({}) is None
+        assert vxi11_link_pool.install_if_enabled({'VXI11_LINK_POOL': '0'}) is None
+
+    def test_enabled_by_environment(self):
+        try:
+            assert vxi11_link_pool.install_if_enabled({'VXI11_LINK_POOL': '1'}) is not None
+            assert ivi.ivi.vxi11 is not vxi11
+        finally:
+            uninstall()
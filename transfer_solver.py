@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy
+from quantiphy import Quantity
+
+from common_step_execution import Dut, Step3, TransferDirection, get_value_decade_for_instrument
+from mapped_log import MappedLog
+
+TRANSFER_FIELDNAMES = ('cycle', 'start', 'forward', 'forward_uncertainty', 'reverse', 'reverse_uncertainty', 'value', 'uncertainty')
+# A standard is a dut at a setting, a measurement a standard on the meter range of a decade (see get_value_decade_for_instrument)
+StandardKey = Tuple[str, str]
+MeasurementKey = Tuple[str, str, int]
+
+
+def standard_key(dut: Dut) -> StandardKey:
+    return dut.name, str(dut.setting)
+
+
+def step_key(step: Step3) -> MeasurementKey:
+    instrument = step.instruments[0]
+    return (*standard_key(step.dut), get_value_decade_for_instrument(instrument, instrument.setting.range))
+
+
+def read_transfer_log(path: str, value_column: str, range_column: str) -> Dict[str, numpy.ndarray]:
+    """
+    The columns of a log that solve_transfer needs, read through a MappedLog.
+    """
+    with MappedLog(path) as log:
+        return {'datetime': log.timestamps(), 'dut': numpy.array(log.values('dut')), 'dut_setting': numpy.array(log.values('dut_setting')),
+                'value': log.column(value_column), 'range': log.column(range_column)}
+
+
+def match_segments(procedure_keys: Sequence[MeasurementKey], segment_keys: Sequence[MeasurementKey], segment_lengths: Sequence[int],
+                   step_lengths: Sequence[Optional[int]]) -> Tuple[List[Tuple[int, int, int, int]], int]:
+    """
+    Assigns the segments of consecutive rows with the same key to the steps of the procedure, which is run over and over: returns (cycle, step index, first row, rows) in log order and the number of rows that match no step.
+
+    A segment goes to the next step of the procedure if that has its key, else it continues the previous step (a step resumed after an interruption), else it goes to the next step with its key (steps skipped), else it starts a new cycle. A segment longer than the step_lengths of its step, like the last reference step of a cycle followed by the first one of the next, is split over several steps.
+    """
+    chunks = []
+    unmatched = 0
+    cycle, position = -1, len(procedure_keys)
+    start = 0
+    for key, length in zip(segment_keys, segment_lengths):
+        while length:
+            if position == len(procedure_keys) and procedure_keys[0] == key:
+                cycle, step_index = cycle + 1, 0
+            elif position < len(procedure_keys) and procedure_keys[position] == key:
+                step_index = position
+            elif chunks and procedure_keys[chunks[-1][1]] == key and chunks[-1][2] + chunks[-1][3] == start:
+                chunk_cycle, step_index, chunk_start, rows = chunks.pop()
+                chunks.append((chunk_cycle, step_index, chunk_start, rows + length))
+                start += length
+                break
+            elif key in procedure_keys[position:]:
+                step_index = procedure_keys.index(key, position)
+            elif key in procedure_keys:
+                cycle, step_index = cycle + 1, procedure_keys.index(key)
+            else:
+                unmatched += length
+                start += length
+                break
+            rows = length if step_lengths[step_index] is None else min(length, step_lengths[step_index])
+            chunks.append((cycle, step_index, start, rows))
+            start += rows
+            length -= rows
+            position = step_index + 1
+    return chunks, unmatched
+
+
+def chain_links(keys: Sequence[MeasurementKey], reference: StandardKey, target: StandardKey) -> List[Tuple[MeasurementKey, MeasurementKey]]:
+    """
+    The shortest chain of ratios from reference to target through the measurements keys, as (numerator, denominator) pairs: each link is a standard over the previous standard on the same range, a 1:10 ratio where the chain changes decade. Raises ValueError if the measurements don't connect the reference to the target.
+    """
+    previous: Dict[StandardKey, Optional[Tuple[MeasurementKey, MeasurementKey]]] = {reference: None}
+    queue = deque([reference])
+    while queue and target not in previous:
+        standard = queue.popleft()
+        for decade in [key[2] for key in keys if key[:2] == standard]:
+            for name, setting, other_decade in keys:
+                if other_decade == decade and (name, setting) not in previous:
+                    previous[name, setting] = ((name, setting, decade), (*standard, decade))
+                    queue.append((name, setting))
+    if target not in previous:
+        raise ValueError(f'The steps {list(keys)} do not connect {reference} to {target}')
+    links = []
+    standard = target
+    while previous[standard]:
+        numerator, denominator = previous[standard]
+        links.append((numerator, denominator))
+        standard = denominator[:2]
+    return links[::-1]
+
+
+@dataclass
+class TransferLink:
+    """
+    One ratio of the chain of a pass, per cycle.
+    """
+    direction: TransferDirection
+    numerator: MeasurementKey
+    denominator: MeasurementKey
+    range: float
+    ratio: numpy.ndarray
+    relative_uncertainty: numpy.ndarray
+
+
+@dataclass
+class TransferSolution:
+    """
+    The target value per cycle of the procedure from the forward and the reverse pass and combined, with standard uncertainties, the links of the chains and the statistics of every step (arrays by the name of the STEP_STATISTICS_FIELDNAMES and cycle).
+    """
+    start: numpy.ndarray
+    forward: numpy.ndarray
+    forward_uncertainty: numpy.ndarray
+    reverse: numpy.ndarray
+    reverse_uncertainty: numpy.ndarray
+    value: numpy.ndarray
+    uncertainty: numpy.ndarray
+    links: List[TransferLink]
+    steps: Dict[str, numpy.ndarray]
+    unmatched_rows: int = 0
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """
+        Records with TRANSFER_FIELDNAMES, one per cycle.
+        """
+        return [{'cycle': cycle + 1, 'start': str(self.start[cycle]),
+                 **{name: float(getattr(self, name)[cycle]) for name in TRANSFER_FIELDNAMES[2:]}}
+                for cycle in range(len(self.start))]
+
+
+def pooled_statistics(group: numpy.ndarray, n: numpy.ndarray, mean: numpy.ndarray, m2: numpy.ndarray, groups: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Mean and standard error of the mean of the readings of all steps in a group, from the count, mean and sum of squared deviations of every step.
+    """
+    total = numpy.bincount(group, n, minlength=groups)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        pooled_mean = numpy.bincount(group, n * mean, minlength=groups) / total
+        pooled_m2 = numpy.bincount(group, m2 + n * (mean - pooled_mean[group]) ** 2, minlength=groups)
+        sem = numpy.where(total > 1, numpy.sqrt(pooled_m2 / (total - 1) / total), numpy.nan)
+    return pooled_mean, sem
+
+
+def solve_transfer(procedure: Sequence[Step3], rows: Dict[str, numpy.ndarray], reference: Dut, target: Dut, reference_value: Optional[float] = None,
+                   reference_uncertainty: float = 0.0, pivot: Optional[int] = None, samples_per_step: Optional[int] = None) -> TransferSolution:
+    """
+    Reduces the rows logged by runs of a resistance transfer procedure (see generate_resistance_transfer_steps) to the value of target: the rows are matched to the steps by their dut, dut_setting and range (see match_segments), and per cycle of the procedure the target value of each pass is reference_value times the chain of ratios of the mean readings of the pass (see chain_links).
+
+    The procedure is split into a forward and a reverse pass at step pivot, which is part of both, by default at its run_until_interrupted step, like the subject step of a tempco run between the forward and the reverse transfer. Without one the procedure is a single pass. Readings of the same measurement in one pass are pooled.
+
+    The pass uncertainties are the standard errors of the mean readings, combined as relative uncertainties over the chain. The value is the mean of the passes; its uncertainty adds half the difference of the passes as a rectangular distribution, for the drift the average of forward and reverse removes only to first order, and reference_uncertainty. Cycles and passes that miss a step of the chain are NaN.
+
+    rows holds arrays (see read_transfer_log) with the datetime, dut, dut_setting, value and range of every row, rows without a value are ignored. With samples_per_step, segments longer than that many rows are split over consecutive steps with the same key, except for run_until_interrupted steps.
+    """
+    reference_value = reference.dut_setting_cmd.value if reference_value is None else reference_value
+    procedure_keys = [step_key(step) for step in procedure]
+    step_lengths = [None if step.run_until_interrupted else samples_per_step for step in procedure]
+    if pivot is None:
+        pivot = next((index for index, step in enumerate(procedure) if step.run_until_interrupted), None)
+    if pivot is not None:
+        passes = {TransferDirection.FORWARD: range(0, pivot + 1), TransferDirection.REVERSE: range(pivot, len(procedure))}
+    else:
+        reference_first = [key[:2] for key in procedure_keys].index(standard_key(reference)) < [key[:2] for key in procedure_keys].index(standard_key(target))
+        passes = {TransferDirection.FORWARD if reference_first else TransferDirection.REVERSE: range(len(procedure))}
+
+    valid = numpy.isfinite(rows['value']) & numpy.isfinite(rows['range']) & (rows['range'] > 0)
+    values = rows['value'][valid]
+    timestamps = rows['datetime'][valid]
+    range_max = procedure[0].instruments[0].range_max()
+    decades = numpy.ceil(numpy.log10(rows['range'][valid] / range_max)).astype(int)
+    standards, standard_codes = numpy.unique(numpy.char.add(numpy.char.add(rows['dut'][valid].astype(str), '\x1f'), rows['dut_setting'][valid].astype(str)), return_inverse=True)
+    codes = numpy.stack((standard_codes.ravel(), decades))
+    boundaries = numpy.flatnonzero(numpy.any(codes[:, 1:] != codes[:, :-1], axis=0)) + 1
+    starts = numpy.concatenate(([0], boundaries)) if len(values) else boundaries
+    segment_keys = [(*standards[codes[0, start]].split('\x1f', 1), int(codes[1, start])) for start in starts]
+    chunks, unmatched = match_segments(procedure_keys, segment_keys, numpy.diff(numpy.append(starts, len(values))).tolist(), step_lengths)
+
+    chunk_cycle, chunk_step, chunk_start, n = (numpy.array(column, dtype=int) for column in zip(*chunks)) if chunks else (numpy.zeros(0, dtype=int),) * 4
+    cycles = int(chunk_cycle.max()) + 1 if chunks else 0
+
+    # Statistics of every chunk of rows that belongs to one step, in log order
+    offsets = numpy.cumsum(n) - n
+    chunk_ids = numpy.repeat(numpy.arange(len(chunks)), n)
+    chunk_values = values[numpy.repeat(chunk_start - offsets, n) + numpy.arange(n.sum())]
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        mean = numpy.bincount(chunk_ids, chunk_values, minlength=len(chunks)) / n
+        m2 = numpy.bincount(chunk_ids, (chunk_values - mean[chunk_ids]) ** 2, minlength=len(chunks))
+        std = numpy.where(n > 1, numpy.sqrt(m2 / numpy.maximum(n - 1, 1)), numpy.nan)
+    steps = {'cycle': chunk_cycle + 1, 'step': chunk_step + 1,
+             'dut': numpy.array([procedure[index].dut.name for index in chunk_step.tolist()], dtype=str),
+             'dut_setting': numpy.array([str(procedure[index].dut.setting) for index in chunk_step.tolist()], dtype=str),
+             'n': n, 'mean': mean, 'std': std, 'sem': std / numpy.sqrt(n),
+             'min': numpy.minimum.reduceat(chunk_values, offsets) if chunks else mean,
+             'max': numpy.maximum.reduceat(chunk_values, offsets) if chunks else mean,
+             'first': timestamps[chunk_start], 'last': timestamps[chunk_start + n - 1]}
+    start = timestamps[chunk_start[numpy.unique(chunk_cycle, return_index=True)[1]]]
+
+    results = {}
+    links = []
+    for direction, step_range in passes.items():
+        pass_links = chain_links(list(dict.fromkeys(procedure_keys[index] for index in step_range)), standard_key(reference), standard_key(target))
+        slots = list(dict.fromkeys(key for link in pass_links for key in link))
+        step_slots = numpy.array([slots.index(key) if key in slots and index in step_range else -1 for index, key in enumerate(procedure_keys)])
+        chunk_slot = step_slots[chunk_step]
+        selected = chunk_slot >= 0
+        pooled_mean, sem = pooled_statistics(chunk_cycle[selected] * len(slots) + chunk_slot[selected], n[selected], mean[selected], m2[selected], cycles * len(slots))
+        pooled_mean = pooled_mean.reshape(cycles, len(slots))
+        relative_sem = sem.reshape(cycles, len(slots)) / pooled_mean
+        value = numpy.full(cycles, float(reference_value))
+        variance = numpy.zeros(cycles)
+        for numerator, denominator in pass_links:
+            ratio = pooled_mean[:, slots.index(numerator)] / pooled_mean[:, slots.index(denominator)]
+            relative_uncertainty = numpy.hypot(relative_sem[:, slots.index(numerator)], relative_sem[:, slots.index(denominator)])
+            links.append(TransferLink(direction, numerator, denominator, procedure[procedure_keys.index(numerator)].instruments[0].setting.range,
+                                      ratio, relative_uncertainty))
+            value = value * ratio
+            variance += relative_uncertainty ** 2
+        results[direction] = value, numpy.abs(value) * numpy.sqrt(variance)
+
+    missing = numpy.full(cycles, numpy.nan)
+    forward, forward_uncertainty = results.get(TransferDirection.FORWARD, (missing, missing))
+    reverse, reverse_uncertainty = results.get(TransferDirection.REVERSE, (missing, missing))
+    both = numpy.isfinite(forward) & numpy.isfinite(reverse)
+    value = numpy.where(both, (forward + reverse) / 2, numpy.where(numpy.isfinite(forward), forward, reverse))
+    statistical = numpy.where(both, numpy.hypot(forward_uncertainty, reverse_uncertainty) / 2,
+                              numpy.where(numpy.isfinite(forward), forward_uncertainty, reverse_uncertainty))
+    drift = numpy.where(both, numpy.abs(forward - reverse) / (2 * numpy.sqrt(3)), 0.0)
+    uncertainty = numpy.sqrt(statistical ** 2 + drift ** 2 + (value * reference_uncertainty / reference_value) ** 2)
+    return TransferSolution(start, forward, forward_uncertainty, reverse, reverse_uncertainty, value, uncertainty, links, steps, unmatched)
+
+
+def print_solution(solution: TransferSolution):
+    for link in solution.links:
+        print(f'{link.direction.value} on {Quantity(link.range, "Ohm")}: {link.numerator[0]} {link.numerator[1]} / {link.denominator[0]} {link.denominator[1]} = '
+              f'{numpy.nanmean(link.ratio):.9g}, u {numpy.nanmean(link.relative_uncertainty) * 1e6:.3f} ppm')
+    for row in solution.rows():
+        print(f'Cycle {row["cycle"]} at {row["start"]}: forward {row["forward"]:.9g}, reverse {row["reverse"]:.9g}, '
+              f'value {row["value"]:.9g} ± {row["uncertainty"]:.3g}')
+    if solution.unmatched_rows:
+        print(f'Rows that match no step: {solution.unmatched_rows}')
@@ -0,0 +1,254 @@
+#!/usr/bin/python3
+import atexit
+import os
+import socket
+import threading
+import types
+from typing import Dict, Optional, Tuple
+
+import ivi
+import vxi11
+
+LINK_POOL_ENV_VAR = 'VXI11_LINK_POOL'
+# Calls that are repeated on a new connection when the connection breaks. Others may have reached the instrument
+# already, a repeated device_write could trigger or change a setting twice, so they fail and are left to the caller.
+RECONNECT_RETRIED_CALLS = ('create_link', 'destroy_link')
+
+
+class NoSocketTimeout:
+    """
+    Stands in for the socket of a device on a shared channel, which has no socket of its own: the timeout of the device is applied to the shared socket on every call.
+    """
+    def settimeout(self, timeout):
+        pass
+
+
+class GatewayChannel:
+    """
+    One VXI-11 core channel (TCP connection) to a GPIB gateway, shared by the links of all instruments on it.
+
+    The gateway serialises requests on the GPIB bus anyway, so calls from different instruments are arbitrated by a lock per RPC, not per instrument transaction: an instrument that is integrating does not keep others from being written to between its write and read. A blocking device_read does hold the channel until the reading arrives, so concurrent reads are serialised; poll for the reading first (see common_step_execution.wait_for_reading) to keep the channel free while meters integrate. The socket has TCP keep-alive enabled, a broken connection is reconnected and the links of the instruments are recreated on their next call. The call that found the connection broken fails, unless it is one of RECONNECT_RETRIED_CALLS.
+
+    A socket timeout only fails the call that timed out: the late reply carries the transaction id of that call and is discarded by the RPC client on the next call, so the links of the other instruments are kept. A reply that cannot be parsed means the stream is out of step, and disconnects the channel.
+    """
+    def __init__(self, host: str, client_factory=vxi11.vxi11.CoreClient):
+        self.host = host
+        self.client_factory = client_factory
+        self.client = None
+        self.generation = 0
+        self.connects = 0
+        self.calls = 0
+        self.lock = threading.RLock()
+
+    def connect(self):
+        self.client = self.client_factory(self.host)
+        self.client.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.generation += 1
+        self.connects += 1
+
+    def disconnect(self):
+        with self.lock:
+            if self.client is not None:
+                try:
+                    self.client.close()
+                except OSError:
+                    pass
+                self.client = None
+
+    def call(self, device: 'PooledInstrument', name: str, *args):
+        with self.lock:
+            if self.client is None:
+                self.connect()
+            if name == 'destroy_link' and device.generation != self.generation:
+                # The link went away with the connection it was created on
+                return 0
+            try:
+                return self._call(device, name, args)
+            except vxi11.vxi11.rpc.RPCError:
+                self.disconnect()
+                raise
+            except (ConnectionError, EOFError):
+                self.disconnect()
+                if name not in RECONNECT_RETRIED_CALLS:
+                    raise
+                self.connect()
+                if name == 'destroy_link':
+                    # The link went away with the broken connection
+                    return 0
+                return self._call(device, name, args)
+
+    def _call(self, device: 'PooledInstrument', name: str, args):
+        if name != 'create_link' and device.generation != self.generation:
+            device.link = None
+            device.open()
+            args = (device.link,) + args[1:]
+        self.client.sock.settimeout(device.timeout + 1)
+        self.calls += 1
+        result = getattr(self.client, name)(*args)
+        if name == 'create_link':
+            device.generation = self.generation
+        return result
+
+
+class DeviceChannel:
+    """
+    The client of a PooledInstrument: forwards the RPCs of vxi11.Device to the shared GatewayChannel.
+    """
+    sock = NoSocketTimeout()
+
+    def __init__(self, channel: GatewayChannel, device: 'PooledInstrument'):
+        self.channel = channel
+        self.device = device
+
+    def __getattr__(self, name):
+        def call(*args):
+            return self.channel.call(self.device, name, *args)
+        return call
+
+    def close(self):
+        pass
+
+
+class PooledLink:
+    """
+    Opens the link of a vxi11.Device on the shared channel of its gateway. Closing it destroys the link but keeps the channel open.
+    """
+    def __init__(self, *args, channel: GatewayChannel):
+        super().__init__(*args)
+        self.channel = channel
+        self.generation = None
+
+    def open(self):
+        if self.link is not None:
+            return
+        self.client = DeviceChannel(self.channel, self)
+        super().open()
+
+    def close(self):
+        if self.link is None:
+            return
+        try:
+            self.client.destroy_link(self.link)
+        finally:
+            self.link = None
+            self.client = None
+
+
+class PooledInstrument(PooledLink, vxi11.Instrument):
+    """
+    vxi11.Instrument with its link on the shared channel of its gateway.
+    """
+    def __init__(self, resource: str, channel: GatewayChannel):
+        super().__init__(resource, channel=channel)
+
+    # python-ivi only accepts interfaces that define read_raw and write_raw themselves
+    def write_raw(self, data):
+        return super().write_raw(data)
+
+    def read_raw(self, num=-1):
+        return super().read_raw(num)
+
+
+class PooledInterfaceDevice(PooledLink, vxi11.vxi11.InterfaceDevice):
+    """
+    The interface device of a gateway (e.g. gpib1, gpib), for bus commands like a Group Execute Trigger, with its link on the shared channel of the gateway.
+    """
+    def __init__(self, host: str, name: str, channel: GatewayChannel):
+        super().__init__(host, name, channel=channel)
+
+
+class LinkPool:
+    """
+    Hands out one PooledInstrument per instrument address, on one GatewayChannel per gateway host. Instruments are kept for the lifetime of the process, so calling init_func again reuses the open links instead of creating new ones.
+    """
+    def __init__(self, client_factory=vxi11.vxi11.CoreClient):
+        self.client_factory = client_factory
+        self.channels: Dict[str, GatewayChannel] = {}
+        self.instruments: Dict[Tuple[str, str], PooledLink] = {}
+        self.lock = threading.Lock()
+
+    def instrument(self, resource: str) -> PooledInstrument:
+        parsed = vxi11.vxi11.parse_visa_resource_string(resource)
+        if parsed is None:
+            raise vxi11.vxi11.Vxi11Exception('Invalid resource string', 'init')
+        key = (parsed['arg1'], parsed['arg2'] or 'inst0')
+        with self.lock:
+            if key not in self.instruments:
+                host = key[0]
+                if host not in self.channels:
+                    self.channels[host] = GatewayChannel(host, self.client_factory)
+                self.instruments[key] = PooledInstrument(resource, self.channels[host])
+            return self.instruments[key]
+
+    def interface_device(self, host: str, name: str) -> PooledInterfaceDevice:
+        key = (host, name)
+        with self.lock:
+            if key not in self.instruments:
+                if host not in self.channels:
+                    self.channels[host] = GatewayChannel(host, self.client_factory)
+                self.instruments[key] = PooledInterfaceDevice(host, name, self.channels[host])
+            return self.instruments[key]
+
+    def close(self):
+        with self.lock:
+            for instrument in self.instruments.values():
+                try:
+                    instrument.close()
+                except (OSError, EOFError, vxi11.vxi11.Vxi11Exception):
+                    pass
+            for channel in self.channels.values():
+                channel.disconnect()
+            self.instruments.clear()
+            self.channels.clear()
+
+
+_pool: Optional[LinkPool] = None
+_original_vxi11 = None
+
+
+def install(pool: Optional[LinkPool] = None) -> LinkPool:
+    """
+    Makes the ivi drivers open their VXI-11 instruments from the link pool, so scripts keep passing resource strings to the drivers. The pool is closed at exit.
+    """
+    global _pool, _original_vxi11
+    if _original_vxi11 is None:
+        _original_vxi11 = ivi.ivi.vxi11
+        atexit.register(uninstall)
+    if _pool is not None:
+        _pool.close()
+    _pool = pool or LinkPool()
+    pooled_vxi11 = types.ModuleType('vxi11')
+    pooled_vxi11.__dict__.update(vars(_original_vxi11))
+    pooled_vxi11.Instrument = _pool.instrument
+    ivi.ivi.vxi11 = pooled_vxi11
+    return _pool
+
+
+def uninstall():
+    global _pool, _original_vxi11
+    if _original_vxi11 is not None:
+        ivi.ivi.vxi11 = _original_vxi11
+        _original_vxi11 = None
+        atexit.unregister(uninstall)
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+def interface_device(host: str, name: str) -> vxi11.vxi11.InterfaceDevice:
+    """
+    The interface device name (e.g. 'gpib') of gateway host: on the shared channel of the gateway when the pool is installed, otherwise on a connection of its own.
+    """
+    if _pool is not None:
+        return _pool.interface_device(host, name)
+    return vxi11.vxi11.InterfaceDevice(host, name)
+
+
+def install_if_enabled(environ=None) -> Optional[LinkPool]:
+    """
+    Installs the link pool if VXI11_LINK_POOL is set to 1. It is off by default: with a connection per instrument, blocking reads of different instruments on one gateway run concurrently, while the pool serialises them on the shared channel.
+    """
+    value = (os.environ if environ is None else environ).get(LINK_POOL_ENV_VAR, '0')
+    if value.strip().lower() not in ('1', 'on', 'true', 'yes'):
+        return None
+    return install()
@@ -3,20 +3,15 @@
 import ivi
 import time
 import datetime
-import csv
-import os
 import argparse
 
+from log_sink import open_log
+
 OUTPUT_FILE = 'w4920-acv-log2.csv'
 SAMPLE_INTERVAL = 10
 FIELDNAMES = ('datetime', 'dut', 'w4920_acv', 'w4920_freq')
-WRITE_INTERVAL_SECONDS = 3600
 DEBUG = False
 
-if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
-
-
 def init_func():
     w4920 = ivi.datron_wavetek.wavetek4920("TCPIP::gpib4::gpib0,4::INSTR",
                                            reset=True)
@@ -48,16 +43,7 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    last_csvw_write = datetime.datetime(2018, 1, 1)
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         while True:
             loop_func(csvw, args.dut, **inits)
             time.sleep(SAMPLE_INTERVAL)
-            if (datetime.datetime.utcnow() - last_csvw_write) \
-                    > datetime.timedelta(seconds=WRITE_INTERVAL_SECONDS):
-                csv_file.flush()
-                last_csvw_write = datetime.datetime.utcnow()
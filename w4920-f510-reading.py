@@ -3,22 +3,19 @@ import time
 
 import ivi
 import datetime
-import csv
-import os
 
-from common_step_execution import Step, run_procedure, AcVoltageDutSettings, AcVoltageCommand, check_valid_value
+from common_step_execution import Step, run_procedure, settings_snapshot, AcVoltageDutSettings, AcVoltageCommand, check_valid_value, wait_for_reading
+from log_sink import open_log
 
 OUTPUT_FILE = 'w4920-f510-reading.csv'
 FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'w4920_function', 'w4920_range', 'w4920_freq',
               'w4920_value')
-WRITE_INTERVAL_SECONDS = 3600
 SAMPLES_PER_STEP = 57
 STEP_SOAK_TIME = 12
 DEBUG = False
 
 
 if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
     STEP_SOAK_TIME = 6
     SAMPLES_PER_STEP = 4
 
@@ -41,11 +38,7 @@ procedure = [
 
 def main():
     inits = init_func()
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         run_procedure(csvw, procedure, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
 
 
@@ -60,12 +53,14 @@ def read_row(inits, instruments, **kwargs):
     row = {}
     row['datetime'] = datetime.datetime.utcnow().isoformat()
     w4920.measurement.initiate()
-    row['w4920_function'] = w4920.measurement_function
-    row['w4920_range'] = w4920.range
-    time.sleep(4)
+    started = time.monotonic()
+    w4920_settings = settings_snapshot(w4920)
+    row['w4920_function'] = w4920_settings['measurement_function']
+    row['w4920_range'] = w4920_settings['range']
+    wait_for_reading(w4920, started=started)
     row['w4920_value'] = w4920.measurement.fetch(0)
     print(f"{row['w4920_value']}", end='')
-    if w4920.measurement_function in ('ac_volts', 'ac_millivolts'):
+    if w4920_settings['measurement_function'] in ('ac_volts', 'ac_millivolts'):
         row['w4920_freq'] = w4920.measurement.freq
         print(f", freq: {row['w4920_freq']} Hz")
     else:
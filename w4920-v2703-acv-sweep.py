@@ -3,22 +3,20 @@ import time
 
 import ivi
 import datetime
-import csv
-import os
 
-from common_step_execution import Step, run_procedure, AcVoltageDutSettings, AcVoltageCommand, check_valid_value
+from common_step_execution import Step, run_procedure, settings_snapshot, AcVoltageDutSettings, AcVoltageCommand, check_valid_value, SettleDetector, wait_for_reading
+from log_sink import open_log
 
 OUTPUT_FILE = 'w4920-v2703-acv-sweep.csv'
 FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'w4920_function', 'w4920_range', 'w4920_freq',
               'w4920_value')
-WRITE_INTERVAL_SECONDS = 3600
 SAMPLES_PER_STEP = 16
 STEP_SOAK_TIME = 60
+SETTLE_THRESHOLD_PPM = 20
 DEBUG = False
 
 
 if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
     STEP_SOAK_TIME = 6
     SAMPLES_PER_STEP = 4
 
@@ -104,12 +102,9 @@ procedure = [
 
 def main():
     inits = init_func()
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
-        run_procedure(csvw, procedure, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
+        settle_detector = SettleDetector(SETTLE_THRESHOLD_PPM, window=6, read_instrument=read_settle_value)
+        run_procedure(csvw, procedure, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME, settle_detector)
 
 
 def init_func():
@@ -118,17 +113,25 @@ def init_func():
     return {'w4920': w4920}
 
 
+def read_settle_value(w4920, instrument):
+    w4920.measurement.initiate()
+    wait_for_reading(w4920)
+    return w4920.measurement.fetch(0)
+
+
 def read_row(inits, instruments):
     w4920 = inits['w4920']
     row = {}
     row['datetime'] = datetime.datetime.utcnow().isoformat()
     w4920.measurement.initiate()
-    row['w4920_function'] = w4920.measurement_function
-    row['w4920_range'] = w4920.range
-    time.sleep(4)
+    started = time.monotonic()
+    w4920_settings = settings_snapshot(w4920)
+    row['w4920_function'] = w4920_settings['measurement_function']
+    row['w4920_range'] = w4920_settings['range']
+    wait_for_reading(w4920, started=started)
     row['w4920_value'] = w4920.measurement.fetch(0)
     print(f"{row['w4920_value']}", end='')
-    if w4920.measurement_function in ('ac_volts', 'ac_millivolts'):
+    if w4920_settings['measurement_function'] in ('ac_volts', 'ac_millivolts'):
         row['w4920_freq'] = w4920.measurement.freq
         print(f", freq: {row['w4920_freq']} Hz")
     else:
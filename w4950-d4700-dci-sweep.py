@@ -2,22 +2,19 @@
 
 import ivi
 import datetime
-import csv
-import os
 
-from common_step_execution import Step, run_procedure, DcCurrentDutSettings, DcCurrentCommand, check_valid_value
+from common_step_execution import Step, run_procedure, settings_snapshot, DcCurrentDutSettings, DcCurrentCommand, check_valid_value
+from log_sink import open_log
 
 OUTPUT_FILE = 'w4950-d4700-dci-sweep.csv'
 FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'w4950_function', 'w4950_range', 'w4950_percentage', 'w4950_freq',
               'w4950_value', 'w4950_nsamples', 'w4950_std_abs', 'w4950_temp')
-WRITE_INTERVAL_SECONDS = 3600
 SAMPLES_PER_STEP = 16
 STEP_SOAK_TIME = 60
 DEBUG = False
 
 
 if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
     STEP_SOAK_TIME = 6
     SAMPLES_PER_STEP = 4
 
@@ -46,11 +43,7 @@ procedure = [
 
 def main():
     inits = init_func()
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         run_procedure(csvw, procedure, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
 
 
@@ -71,13 +64,14 @@ def read_row(inits, instruments):
         row['w4950_temp'] = w4950.measurement.temp.internal
         w4950.last_temp = datetime.datetime.utcnow()
     w4950.measurement.initiate()
-    row['w4950_function'] = w4950.measurement_function
-    row['w4950_range'] = w4950.range
-    row['w4950_percentage'] = w4950.measurement.percentage
+    w4950_settings = settings_snapshot(w4950)
+    row['w4950_function'] = w4950_settings['measurement_function']
+    row['w4950_range'] = w4950_settings['range']
+    row['w4950_percentage'] = w4950_settings['measurement.percentage']
     row['w4950_value'] = w4950.measurement.fetch(60)
     row['w4950_nsamples'] = w4950.measurement.quality.nsamples
     row['w4950_std_abs'] = w4950.measurement.quality.absolute
-    if w4950.measurement_function in ('ac_volts', 'ac_current'):
+    if w4950_settings['measurement_function'] in ('ac_volts', 'ac_current'):
         row['w4950_freq'] = w4950.measurement.freq
     else:
         row['w4950_freq'] = None
@@ -2,25 +2,22 @@
 
 import ivi
 import datetime
-import csv
-import os
 
-from common_step_execution import (Step, DcVoltageDutSettings, run_procedure, DcVoltageCommand, check_valid_value, Res4WDutSettings, FourWireResistanceCommand, DcCurrentCommand,
+from common_step_execution import (Step, DcVoltageDutSettings, run_procedure, settings_snapshot, DcVoltageCommand, check_valid_value, Res4WDutSettings, FourWireResistanceCommand, DcCurrentCommand,
                                    DcCurrentDutSettings)
+from log_sink import open_log
 
 OUTPUT_FILE_DCV = 'w4950-d4700-dcv-sweep.csv'
 OUTPUT_FILE_DCI = 'w4950-d4700-dci-sweep.csv'
 OUTPUT_FILE_R = 'w4950-d4700-resistance-sweep.csv'
 FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'w4950_function', 'w4950_range', 'w4950_percentage', 'w4950_freq',
               'w4950_value', 'w4950_nsamples', 'w4950_std_abs', 'w4950_temp')
-WRITE_INTERVAL_SECONDS = 3600
 SAMPLES_PER_STEP = 16
 STEP_SOAK_TIME = 60
 DEBUG = False
 
 
 if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
     STEP_SOAK_TIME = 6
     SAMPLES_PER_STEP = 4
 
@@ -103,19 +100,7 @@ procedure_dcv2 = [
 
 def main():
     inits = init_func()
-    with open(OUTPUT_FILE_DCV, 'a', newline='') as csv_file_dcv, open(OUTPUT_FILE_DCI, 'a', newline='') as csv_file_dci, open(OUTPUT_FILE_R, 'a', newline='') as csv_file_r:
-        initial_size_dcv = os.fstat(csv_file_dcv.fileno()).st_size
-        initial_size_dci = os.fstat(csv_file_dci.fileno()).st_size
-        initial_size_r = os.fstat(csv_file_r.fileno()).st_size
-        csvw_dcv = csv.DictWriter(csv_file_dcv, fieldnames=FIELDNAMES)
-        csvw_dci = csv.DictWriter(csv_file_dci, fieldnames=FIELDNAMES)
-        csvw_r = csv.DictWriter(csv_file_r, fieldnames=FIELDNAMES)
-        if initial_size_dcv == 0:
-            csvw_dcv.writeheader()
-        if initial_size_dci == 0:
-            csvw_dci.writeheader()
-        if initial_size_r == 0:
-            csvw_r.writeheader()
+    with open_log(OUTPUT_FILE_DCV, FIELDNAMES) as csvw_dcv, open_log(OUTPUT_FILE_DCI, FIELDNAMES) as csvw_dci, open_log(OUTPUT_FILE_R, FIELDNAMES) as csvw_r:
         run_procedure(csvw_r, procedure_r4w1, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
         run_procedure(csvw_dcv, procedure_dcv1, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
         run_procedure(csvw_dci, procedure_dci, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
@@ -141,13 +126,14 @@ def read_row(inits, instruments):
         row['w4950_temp'] = w4950.measurement.temp.internal
         w4950.last_temp = datetime.datetime.utcnow()
     w4950.measurement.initiate()
-    row['w4950_function'] = w4950.measurement_function
-    row['w4950_range'] = w4950.range
-    row['w4950_percentage'] = w4950.measurement.percentage
+    w4950_settings = settings_snapshot(w4950)
+    row['w4950_function'] = w4950_settings['measurement_function']
+    row['w4950_range'] = w4950_settings['range']
+    row['w4950_percentage'] = w4950_settings['measurement.percentage']
     row['w4950_value'] = w4950.measurement.fetch(60)
     row['w4950_nsamples'] = w4950.measurement.quality.nsamples
     row['w4950_std_abs'] = w4950.measurement.quality.absolute
-    if w4950.measurement_function in ('ac_volts', 'ac_current'):
+    if w4950_settings['measurement_function'] in ('ac_volts', 'ac_current'):
         row['w4950_freq'] = w4950.measurement.freq
     else:
         row['w4950_freq'] = None
@@ -2,24 +2,21 @@
 
 import ivi
 import datetime
-import csv
-import os
 
-from common_step_execution import Step2, run_procedure, check_valid_value, DcCurrentCommand, Instrument, DcVoltageCommand, \
-    DcCurrentDutSettings
+from common_step_execution import Step2, run_procedure, settings_snapshot, check_valid_value, DcCurrentCommand, Instrument, DcVoltageCommand, \
+    DcCurrentDutSettings, wait_for_reading
+from log_sink import open_log
 
 OUTPUT_FILE = 'w4950-ks3458a-d4910-v2500-dci-sweep.csv'
 FIELDNAMES = ('datetime', 'dut', 'dut_setting', 'w4950_function', 'w4950_range', 'w4950_percentage', 'w4950_freq',
               'w4950_value', 'w4950_nsamples', 'w4950_std_abs', 'w4950_temp', 'ag3458a_2_value', 'temp_2', 'last_acal_2',
               'last_acal_2_cal72', '3458a_2_function', 'ag3458a_2_range')
-WRITE_INTERVAL_SECONDS = 3600
 SAMPLES_PER_STEP = 16
 STEP_SOAK_TIME = 60
 DEBUG = False
 
 
 if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
     STEP_SOAK_TIME = 6
     SAMPLES_PER_STEP = 4
 
@@ -46,11 +43,7 @@ procedure = [
 
 def main():
     inits = init_func()
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         run_procedure(csvw, procedure, inits, read_row, SAMPLES_PER_STEP, STEP_SOAK_TIME)
 
 
@@ -77,7 +70,7 @@ def init_func():
     return {'w4950': w4950, 'ag3458a_2': ag3458a_2}
 
 
-def read_row(inits, retry_count=1):
+def read_row(inits, instruments):
     w4950 = inits['w4950']
     ag3458a_2 = inits['ag3458a_2']
     row = {}
@@ -97,32 +90,29 @@ def read_row(inits, retry_count=1):
         row['w4950_temp'] = w4950.measurement.temp.internal
         w4950.last_temp = datetime.datetime.utcnow()
     w4950.measurement.initiate()
-    row['w4950_function'] = w4950.measurement_function
-    row['w4950_range'] = w4950.range
-    row['w4950_percentage'] = w4950.measurement.percentage
+    w4950_settings = settings_snapshot(w4950)
+    row['w4950_function'] = w4950_settings['measurement_function']
+    row['w4950_range'] = w4950_settings['range']
+    row['w4950_percentage'] = w4950_settings['measurement.percentage']
     row['w4950_value'] = w4950.measurement.fetch(60)
     row['w4950_nsamples'] = w4950.measurement.quality.nsamples
     row['w4950_std_abs'] = w4950.measurement.quality.absolute
+    wait_for_reading(ag3458a_2)
     row['ag3458a_2_value'] = ag3458a_2.measurement.fetch(360)
     row['temp_2'] = None
     row['last_acal_2'] = ag3458a_2.last_acal.isoformat()
     row['last_acal_2_cal72'] = ag3458a_2.last_acal_cal72
-    row['ag3458a_2_range'] = ag3458a_2.range
+    row['ag3458a_2_range'] = settings_snapshot(ag3458a_2)['range']
 
     print(f"{row['w4950_value']}", end='')
-    if w4950.measurement_function in ('ac_volts', 'ac_current'):
+    if w4950_settings['measurement_function'] in ('ac_volts', 'ac_current'):
         row['w4950_freq'] = w4950.measurement.freq
         print(f", freq: {row['w4950_freq']}", end='')
     else:
         row['w4950_freq'] = None
     print(f", ag3458a_2: {row['ag3458a_2_value']}")
-    try:
-        check_valid_value(w4950, row['w4950_value'])
-        check_valid_value(ag3458a_2, row['ag3458a_2_value'])
-    except IOError:
-        if retry_count > 20:
-            raise
-        return read_row(inits, retry_count+1)
+    check_valid_value(w4950, row['w4950_value'])
+    check_valid_value(ag3458a_2, row['ag3458a_2_value'])
     return row, True
 
 
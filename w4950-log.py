@@ -4,20 +4,15 @@ import argparse
 import ivi
 import time
 import datetime
-import csv
-import os
+
+from log_sink import open_log
 
 OUTPUT_FILE = 'w4950-log.csv'
 SAMPLE_INTERVAL = 0
 FIELDNAMES = ('datetime', 'w4950_function', 'w4950_range', 'w4950_percentage', 'w4950_freq', 'w4950_value',
               'w4950_nsamples', 'w4950_std_abs', 'dut')
-WRITE_INTERVAL_SECONDS = 3600
 DEBUG = False
 
-if DEBUG:
-    WRITE_INTERVAL_SECONDS = 0
-
-
 def init_func(function, range_, percentage, freq):
     w4950 = ivi.datron_wavetek.wavetek4950("TCPIP::gpib4::gpib0,20::INSTR", reset=True)
     w4950._interface.timeout = 120
@@ -80,17 +75,8 @@ if __name__ == '__main__':
         print("Zeroed. Connect the cable to measure")
         response = input('Press enter to continue')
 
-    last_csvw_write = datetime.datetime(2018, 1, 1)
-    with open(OUTPUT_FILE, 'a', newline='') as csv_file:
-        initial_size = os.fstat(csv_file.fileno()).st_size
-        csvw = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
-        if initial_size == 0:
-            csvw.writeheader()
+    with open_log(OUTPUT_FILE, FIELDNAMES) as csvw:
         while loop_count < args.nreadings:
             loop_func(csvw, args.dut, **inits)
             loop_count += 1
             time.sleep(SAMPLE_INTERVAL)
-            if (datetime.datetime.utcnow() - last_csvw_write) \
-                    > datetime.timedelta(seconds=WRITE_INTERVAL_SECONDS):
-                csv_file.flush()
-                last_csvw_write = datetime.datetime.utcnow()